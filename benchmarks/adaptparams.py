@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of the per block overhead of binding headline
+values to generator parameters (`_adaptParams`).
+
+Compares the current implementation, which uses cached binding plans,
+with the former one, which inspected the signature on every block.
+
+Usage:
+
+    python benchmarks/adaptparams.py [repetitions]
+"""
+
+import inspect
+import sys
+import timeit
+import warnings
+import markdown
+from yamlns import namespace as ns
+from customblocks.customblocks import CustomBlocksProcessor
+from customblocks.generators import youtube, figure
+
+def legacyAdaptParams(callback, ctx, args, kwds):
+    """Implementation previous to binding plans, kept as reference"""
+
+    def warn(message):
+        warnings.warn(f"In block '{ctx.type}', " + message)
+
+    signature = inspect.signature(callback)
+
+    for name, param in signature.parameters.items():
+        if type(param.default) != bool and param.annotation != bool:
+            continue
+        if name in args:
+            args.remove(name)
+            kwds[name] = True
+        if 'no' + name in args:
+            args.remove('no' + name)
+            kwds[name] = False
+
+    outargs = []
+    outkwds = {}
+    acceptAnyKey = False
+    acceptAnyPos = False
+    for name, param in signature.parameters.items():
+        if name == 'ctx':
+            outargs.append(ctx)
+            continue
+        if param.kind == param.VAR_KEYWORD:
+            acceptAnyKey = True
+            continue
+        if param.kind == param.VAR_POSITIONAL:
+            acceptAnyPos = True
+            continue
+        value = (
+            kwds.pop(name)
+            if name in kwds and param.kind != param.POSITIONAL_ONLY
+            else args.pop(0)
+            if args and param.kind != param.KEYWORD_ONLY
+            else param.default
+            if param.default is not param.empty
+            else warn(f"missing mandatory attribute '{name}'") or ""
+        )
+        if param.kind == param.KEYWORD_ONLY:
+            outkwds[name] = value
+        else:
+            outargs.append(value)
+
+    if acceptAnyPos:
+        outargs.extend(args)
+    else:
+        for arg in args:
+            warn(f"ignored extra attribute '{arg}'")
+    if acceptAnyKey:
+        outkwds.update(kwds)
+    else:
+        for key in kwds:
+            warn(f"ignoring unexpected parameter '{key}'")
+
+    return outargs, outkwds
+
+def tenparams(ctx, p1, p2, p3, p4='4', p5='5', *args,
+        f1=False, f2=True, f3:bool=None, k1=None, **kwds):
+    pass
+
+cases = [
+    ('youtube', youtube, ['7SS24_CgwEM', 'autoplay', 'noloop'], dict(style='width:50%')),
+    ('figure', figure, ['image.png', 'local', 'thumb', 'lightbox'], dict(title='A title')),
+    ('tenparams', tenparams, ['a', 'b', 'c', 'f1', 'nof2', 'extra'], dict(k1='k', p5='five')),
+]
+
+def main(repetitions=20000):
+    processor = CustomBlocksProcessor(markdown.Markdown().parser)
+    print(f"{'generator':<12}{'legacy (us)':>14}{'plan (us)':>14}{'speedup':>10}")
+    for name, generator, args, kwds in cases:
+        ctx = ns(type=name)
+        legacy = min(timeit.repeat(
+            lambda: legacyAdaptParams(generator, ctx, list(args), dict(kwds)),
+            number=repetitions, repeat=5,
+        )) / repetitions * 1e6
+        current = min(timeit.repeat(
+            lambda: processor._adaptParams(generator, ctx, list(args), dict(kwds)),
+            number=repetitions, repeat=5,
+        )) / repetitions * 1e6
+        print(f"{name:<12}{legacy:>14.2f}{current:>14.2f}{legacy/current:>9.1f}x")
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
+
+# vim: et ts=4 sw=4
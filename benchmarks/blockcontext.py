@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Memory and throughput comparison of the block context
+on a 10k block document.
+
+Compares the slotted BlockContext sharing the generator config
+with the former yamlns namespace context, which also copied
+the generator config into a new namespace for every block.
+
+Usage:
+
+    python benchmarks/blockcontext.py [blocks]
+"""
+
+import sys
+import time
+import tracemalloc
+from unittest import mock
+import markdown
+from yamlns import namespace as ns
+from customblocks.customblocks import BlockContext
+
+config = dict(
+    youtube_inlineFluidStyle=True,
+    figure_local=True,
+    figure_thumb='200x200',
+    figure_lightbox=True,
+)
+
+def legacyContext(type, parent, content, parser, metadata, config):
+    """Context as built before BlockContext, kept as reference"""
+    ctx = ns()
+    ctx.type = type
+    ctx.parent = parent
+    ctx.content = content
+    ctx.parser = parser
+    ctx.metadata = metadata
+    ctx.config = ns(config)
+    return ctx
+
+contexts = []
+def keeper(ctx):
+    "Generator keeping the contexts alive to measure them"
+    contexts.append(ctx)
+
+def document(blocks):
+    return '\n\n'.join(
+        f'::: keeper\n    Content {i}'
+        for i in range(blocks)
+    )
+
+def convert(source):
+    md = markdown.Markdown(
+        extensions=['customblocks'],
+        extension_configs=dict(customblocks=dict(
+            generators=dict(keeper=keeper),
+            config=config,
+        )),
+    )
+    return md.convert(source)
+
+def measure(source, repetitions=3):
+    """Best conversion time and memory retained by the document
+    including the contexts kept alive"""
+    elapsed = []
+    for i in range(repetitions):
+        contexts.clear()
+        start = time.perf_counter()
+        convert(source)
+        elapsed.append(time.perf_counter() - start)
+
+    contexts.clear()
+    tracemalloc.start()
+    convert(source)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    contexts.clear()
+    return min(elapsed), retained
+
+def main(blocks=10000):
+    source = document(blocks)
+    convert(source) # warm up
+    with mock.patch('customblocks.customblocks.BlockContext', legacyContext):
+        legacyTime, legacyMemory = measure(source)
+    currentTime, currentMemory = measure(source)
+    print(f"{blocks} blocks")
+    print(f"{'':<10}{'time (ms)':>12}{'retained (KiB)':>16}")
+    print(f"{'legacy':<10}{legacyTime*1e3:>12.1f}{legacyMemory/1024:>16.1f}")
+    print(f"{'current':<10}{currentTime*1e3:>12.1f}{currentMemory/1024:>16.1f}")
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Cold start cost of customblocks.
+
+Runs each statement in a fresh interpreter with `-X importtime`
+and reports the best cumulative import time of customblocks
+and of the heaviest modules it pulls in.
+
+Usage:
+
+    python benchmarks/importtime.py [repetitions]
+"""
+
+import sys
+import subprocess
+
+statements = dict(
+    bare="import customblocks",
+    admonition=(
+        "import markdown; "
+        "markdown.markdown('::: note\\n    text', extensions=['customblocks'])"
+    ),
+    fetcher="import customblocks; from customblocks.utils import Fetcher",
+)
+
+watched = 'customblocks.customblocks', 'markdown', 'yamlns', 'bs4', 'PIL', 'magic', 'requests', 'asyncio'
+
+def importTimes(statement):
+    """Cumulative import time in us of every top level module"""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'): continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[0].strip().isdigit(): continue # header
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+def main(repetitions=5):
+    print(f"{'(ms)':<12}" + ''.join(f"{name.split('.')[-1]:>14}" for name in watched))
+    for name, statement in statements.items():
+        best = {}
+        for i in range(repetitions):
+            times = importTimes(statement)
+            for module in watched:
+                if module not in times: continue
+                best[module] = min(best.get(module, times[module]), times[module])
+        print(f"{name:<12}" + ''.join(
+            f"{best[module]/1e3:>14.1f}" if module in best else f"{'-':>14}"
+            for module in watched
+        ))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Scaling benchmark of the extraction of the indented content
+of a custom block placed at the top of a long document.
+
+The block content has a fixed number of paragraphs (k) while
+the number of document blocks (n) grows. Extraction time
+should depend on k, not on n.
+
+Usage:
+
+    python benchmarks/indentedcontent.py [contentblocks]
+"""
+
+import sys
+import timeit
+import markdown
+from customblocks.customblocks import CustomBlocksProcessor
+
+def legacyIndentedContent(processor, blocks):
+    """Implementation previous to single removal, kept as reference"""
+    content = []
+    while blocks:
+        block = blocks.pop(0)
+        indented, unindented = processor.detab(block)
+        if indented:
+            content.append(indented)
+        if unindented:
+            blocks.insert(0, unindented)
+            break
+    return '\n\n'.join(content)
+
+def document(n, k):
+    return (
+        ['    Indented paragraph\n    with two lines'] * k +
+        ['Not indented paragraph'] * (n-k)
+    )
+
+def bestTime(extract, n, k, repetitions=20):
+    """Best time among repetitions, each on a fresh document"""
+    return min(
+        timeit.timeit(lambda: extract(blocks), number=1)
+        for blocks in (document(n, k) for i in range(repetitions))
+    )
+
+def main(k=100):
+    processor = CustomBlocksProcessor(markdown.Markdown().parser)
+    print(f"{'blocks':>8}{'legacy (ms)':>14}{'current (ms)':>14}")
+    for n in (1000, 10000, 100000):
+        legacy = bestTime(lambda blocks: legacyIndentedContent(processor, blocks), n, k)
+        current = bestTime(processor._indentedContent, n, k)
+        print(f"{n:>8}{legacy*1e3:>14.3f}{current*1e3:>14.3f}")
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
+
+# vim: et ts=4 sw=4
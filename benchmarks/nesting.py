@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark of the conversion of nested custom blocks
+for nesting depths from 1 to 10.
+
+Every level extracts its indented content from the blocks that
+follow its headline, so the lines at depth d are detabbed d times.
+Besides the conversion time, it reports the share of it spent
+extracting content, the most that discovering the whole block tree
+in a single pass over the source could save.
+Each level's content is still parsed just once.
+
+Usage:
+
+    python benchmarks/nesting.py [paragraphs per level] [repetitions]
+"""
+
+import sys
+import timeit
+from time import perf_counter
+from unittest import mock
+import markdown
+from customblocks.customblocks import CustomBlocksProcessor
+
+def nestedDocument(depth, paragraphs):
+    lines = []
+    for level in range(depth):
+        indent = '    ' * level
+        lines.append(f'{indent}::: level{level}')
+        for paragraph in range(paragraphs):
+            lines.append(f'{indent}    Paragraph {paragraph} at *level* {level}')
+            lines.append(f'{indent}    with a second line')
+            lines.append('')
+    return '\n'.join(lines)
+
+def extractionTime(md, source):
+    """Seconds spent extracting block content in a conversion"""
+    spent = [0.]
+    extract = CustomBlocksProcessor._indentedContent
+    def timedExtract(self, blocks):
+        start = perf_counter()
+        try:
+            return extract(self, blocks)
+        finally:
+            spent[0] += perf_counter() - start
+    with mock.patch.object(CustomBlocksProcessor, '_indentedContent', timedExtract):
+        md.convert(source)
+    return spent[0]
+
+def main(paragraphs=20, repetitions=5):
+    md = markdown.Markdown(extensions=['customblocks'])
+    print(f"{'depth':>6}{'total (ms)':>12}{'per block (us)':>16}{'extracting':>12}")
+    for depth in range(1, 11):
+        source = nestedDocument(depth, paragraphs)
+        total = min(timeit.repeat(
+            lambda: md.convert(source),
+            number=1, repeat=repetitions,
+        ))
+        extracting = min(
+            extractionTime(md, source) / total
+            for repetition in range(repetitions)
+        )
+        blocks = depth * (paragraphs + 1)
+        print(f"{depth:>6}{total*1e3:>12.2f}{total/blocks*1e6:>16.1f}{extracting:>12.1%}")
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
+
+# vim: et ts=4 sw=4
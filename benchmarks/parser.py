@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of the block parser.
+
+Measures the cost of the processor steps, `test`, `_extractHeadline`,
+`_processParams`, `_adaptParams` and `run`, on synthetic documents.
+Each dimension (block count, headline length, parameter count,
+nesting depth and content size) is swept in turn,
+while the rest are kept at their default values.
+
+Results are printed and can be stored as json to be compared
+with the ones of another release or branch.
+Steps are driven through the processor of a public Markdown instance,
+and the internals some releases lack, like memoizations, are optional,
+so that it runs against older releases too:
+
+    python benchmarks/parser.py --output before.json
+    git checkout mybranch
+    python benchmarks/parser.py --compare before.json
+
+Usage:
+
+    python benchmarks/parser.py [--quick] [--repeat N]
+        [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import timeit
+import warnings
+from contextlib import contextmanager
+from pathlib import Path
+from xml.etree import ElementTree as etree
+import markdown
+from yamlns import namespace as ns
+from customblocks.customblocks import CustomBlocksProcessor
+from customblocks.utils import E, Markdown
+try:
+    from customblocks.customblocks import BlockContext
+except ImportError: # releases passing a namespace as context
+    BlockContext = None
+
+steps = 'test', '_extractHeadline', '_processParams', '_adaptParams', 'run'
+
+defaults = dict(
+    blocks=100,
+    headline=60,
+    params=4,
+    depth=1,
+    content=4,
+)
+
+sweeps = dict(
+    blocks=[10, 100, 1000],
+    headline=[20, 60, 200, 1000],
+    params=[0, 4, 16, 64],
+    depth=[1, 2, 4, 8],
+    content=[1, 4, 16, 64],
+)
+
+quickSweeps = dict(
+    blocks=[10, 100],
+    headline=[20, 200],
+    params=[0, 16],
+    depth=[1, 4],
+    content=[1, 16],
+)
+
+def bench(ctx, title=None, first=None, *args, flag=False, **kwds):
+    return E('div', Markdown(ctx.content, ctx.parser))
+
+def headlineText(index, level, headline, params):
+    """Headline of a block, with the requested number of parameters,
+    padded up to the requested length with a quoted title"""
+    words = ['::: bench']
+    words += [
+        f'key{i}=value{i}' if i % 2 else f'value{i}'
+        for i in range(params)
+    ]
+    words.append('flag' if index % 2 else 'noflag')
+    words.append(f'id=b{level}-{index}')
+    line = ' '.join(words)
+    padding = headline - len(line) - len(' title=""')
+    if padding > 0:
+        line += ' title="' + ('quoted words ' * padding)[:padding] + '"'
+    return line
+
+def document(blocks, headline, params, depth, content):
+    """Synthetic document with `blocks` top level blocks,
+    each one nesting `depth` levels of blocks,
+    and `content` paragraphs at each level"""
+    lines = []
+    for index in range(blocks):
+        for level in range(depth):
+            indent = '    ' * level
+            lines.append(indent + headlineText(index, level, headline, params))
+            for paragraph in range(content):
+                lines.append(f'{indent}    Paragraph {paragraph} with *some* inline markup')
+                lines.append('')
+        lines.append('')
+    return '\n'.join(lines)
+
+def newMarkdown():
+    return markdown.Markdown(
+        extensions=['customblocks'],
+        extension_configs=dict(customblocks=dict(
+            generators=dict(bench=bench),
+        )),
+    )
+
+@contextmanager
+def timedRun(timings):
+    """Accumulates the time spent in top level `run` calls,
+    and counts every call, nested ones included"""
+    original = CustomBlocksProcessor.run
+    nesting = [0]
+    def run(self, parent, blocks):
+        timings['calls'] += 1
+        nesting[0] += 1
+        start = timeit.default_timer()
+        try:
+            return original(self, parent, blocks)
+        finally:
+            nesting[0] -= 1
+            if not nesting[0]:
+                timings['time'] += timeit.default_timer() - start
+    CustomBlocksProcessor.run = run
+    try:
+        yield
+    finally:
+        CustomBlocksProcessor.run = original
+
+def best(function, repeat, minimum=0.02):
+    """Best time of calling function, in seconds.
+    Each repetition calls it as many times as needed
+    to take at least `minimum` seconds."""
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < minimum:
+        number *= 2
+    return min(timer.repeat(number=number, repeat=repeat)) / number
+
+def context(parent, md):
+    """Generator context as the release under test builds it"""
+    if BlockContext is None:
+        return ns(type='bench', parent=parent, content='',
+            parser=md.parser, metadata={}, config=ns())
+    return BlockContext('bench', parent, '', md.parser, {}, {})
+
+def forgetters(processor):
+    """Functions dropping the memoized headline scan and parameters
+    of the processor, so that every call is measured as a first one.
+    Releases without memoization need none."""
+    def forgetScan():
+        processor._lastScan = None, None
+    tokenize = getattr(processor, '_tokenizeParams', None)
+    def nothing():
+        pass
+    return (
+        forgetScan if hasattr(processor, '_lastScan') else nothing,
+        getattr(tokenize, 'cache_clear', nothing),
+    )
+
+def measure(source, repeat):
+    """Time per call in microseconds of each step on the source"""
+    md = newMarkdown()
+    processor = md.parser.blockprocessors['customblocks']
+    forgetScan, forgetParams = forgetters(processor)
+    parent = etree.Element('div')
+    blocks = source.split('\n\n')
+    headlines = [block for block in blocks if processor.test(parent, block)]
+    extracted = [processor._extractHeadline(block) for block in headlines]
+    params = [params for pre, blocktype, params, post in extracted]
+    bound = [processor._processParams(param) for param in params]
+
+    def test():
+        for block in blocks:
+            forgetScan()
+            processor.test(parent, block)
+
+    def extractHeadline():
+        for block in headlines:
+            forgetScan()
+            processor._extractHeadline(block)
+
+    def processParams():
+        forgetParams()
+        for param in params:
+            processor._processParams(param)
+
+    def adaptParams():
+        for args, kwds in bound:
+            ctx = context(parent, md)
+            processor._adaptParams(bench, ctx, list(args), dict(kwds))
+
+    result = dict(
+        test = best(test, repeat) / len(blocks),
+        _extractHeadline = best(extractHeadline, repeat) / len(headlines),
+        _processParams = best(processParams, repeat) / len(params),
+        _adaptParams = best(adaptParams, repeat) / len(bound),
+    )
+
+    runs = []
+    for i in range(repeat):
+        timings = dict(calls=0, time=0.)
+        md = newMarkdown()
+        with timedRun(timings):
+            md.convert(source)
+        runs.append(timings['time'] / timings['calls'])
+    result['run'] = min(runs)
+    return {step: time * 1e6 for step, time in result.items()}
+
+def environment():
+    try:
+        from importlib.metadata import version
+        release = version('markdown-customblocks')
+    except Exception:
+        release = None
+    try:
+        revision = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except Exception:
+        revision = None
+    return dict(
+        date = datetime.datetime.now().isoformat(timespec='seconds'),
+        release = release,
+        revision = revision,
+        python = platform.python_version(),
+        implementation = platform.python_implementation(),
+        markdown = markdown.__version__,
+        platform = platform.platform(),
+    )
+
+def runSuite(sweeps, repeat):
+    cases = []
+    for dimension, values in sweeps.items():
+        for value in values:
+            parameters = dict(defaults, **{dimension: value})
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                timings = measure(document(**parameters), repeat)
+            cases.append(dict(
+                dimension = dimension,
+                parameters = parameters,
+                timings = timings,
+            ))
+            yield cases[-1]
+
+def caseKey(case):
+    return case['dimension'], tuple(sorted(case['parameters'].items()))
+
+def report(case, baseline=None):
+    dimension = case['dimension']
+    label = f"{dimension}={case['parameters'][dimension]}"
+    line = f"{label:<16}"
+    reference = baseline.get(caseKey(case)) if baseline else None
+    for step in steps:
+        time = case['timings'][step]
+        if reference is None:
+            line += f"{time:>17.2f}"
+        else:
+            ratio = time / reference['timings'][step]
+            line += f"{time:>10.2f} {ratio:>5.2f}x"
+    print(line, flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the customblocks block parser",
+    )
+    parser.add_argument('--quick', action='store_true',
+        help="sweep fewer values")
+    parser.add_argument('--repeat', type=int, default=5,
+        help="repetitions, the best one is taken (default 5)")
+    parser.add_argument('--output', metavar='JSON',
+        help="store the results in this file")
+    parser.add_argument('--compare', metavar='JSON',
+        help="show the ratio to the results stored in this file")
+    options = parser.parse_args(argv)
+
+    baseline = None
+    if options.compare:
+        stored = json.loads(Path(options.compare).read_text(encoding='utf8'))
+        baseline = {caseKey(case): case for case in stored['cases']}
+        print("Compared with {revision} ({date}), ratio > 1 is slower".format(
+            **stored['environment']))
+
+    print("Time per call in us")
+    print(f"{'':<16}" + ''.join(f"{step:>17}" for step in steps))
+    cases = []
+    for case in runSuite(quickSweeps if options.quick else sweeps, options.repeat):
+        report(case, baseline)
+        cases.append(case)
+
+    if options.output:
+        Path(options.output).write_text(json.dumps(dict(
+            environment = environment(),
+            defaults = defaults,
+            cases = cases,
+        ), indent=2), encoding='utf8')
+
+if __name__ == '__main__':
+    main()
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,18 @@
+import os
+import shutil
+import tempfile
+
+def pytest_configure(config):
+    # Keep the entry points cache of the test run away from the user's one.
+    # Set before the tests import customblocks, which fills it on import.
+    if 'CUSTOMBLOCKS_CACHE_DIR' in os.environ: return
+    config._customblocksCacheDir = tempfile.mkdtemp(prefix='customblocks-cache-')
+    os.environ['CUSTOMBLOCKS_CACHE_DIR'] = config._customblocksCacheDir
+
+def pytest_unconfigure(config):
+    cachedir = getattr(config, '_customblocksCacheDir', None)
+    if cachedir is None: return
+    del os.environ['CUSTOMBLOCKS_CACHE_DIR']
+    shutil.rmtree(cachedir, ignore_errors=True)
+
+# vim: et ts=4 sw=4
@@ -1 +1,2 @@
 from .customblocks import *
+from .asyncconvert import convert_async
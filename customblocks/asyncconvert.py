@@ -0,0 +1,44 @@
+import markdown
+from .customblocks import CustomBlocksExtension
+
+async def convert_async(text, timeout=None, **kwds):
+    """
+    Converts markdown text into html without blocking the running
+    event loop, taking the same keyword arguments than markdown.markdown.
+
+    The markdown pipeline runs in the loop default executor,
+    while async generators are awaited natively on the running loop.
+    If timeout, in seconds, expires, asyncio.TimeoutError is raised.
+    On timeout or cancellation, pending generators are cancelled
+    and the conversion is aborted before the next block.
+    """
+    import asyncio # Not imported at module level, to speed up startup
+    loop = asyncio.get_running_loop()
+    extensions = list(kwds.pop('extensions', []))
+    if not any(
+        extension == 'customblocks' or
+        isinstance(extension, CustomBlocksExtension)
+        for extension in extensions
+    ):
+        extensions.append('customblocks')
+
+    md = markdown.Markdown(extensions=extensions, **kwds)
+    processor = md.parser.blockprocessors['customblocks']
+    awaiter = md.treeprocessors['customblocks_await']
+    awaiter.loop = loop
+
+    def convert():
+        try:
+            return md.convert(text)
+        finally:
+            # Coroutines of an aborted conversion are never awaited
+            processor.reset()
+
+    job = loop.run_in_executor(None, convert)
+    try:
+        return await asyncio.wait_for(job, timeout)
+    except BaseException:
+        awaiter.cancel()
+        raise
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,118 @@
+import unittest
+import asyncio
+import threading
+import time
+from .asyncconvert import convert_async
+from .customblocks import CustomBlocksExtension
+from .utils import E
+
+class ConvertAsync_Test(unittest.TestCase):
+
+    def convert(self, text, **kwds):
+        return asyncio.run(convert_async(text, **kwds))
+
+    def generators(self, **generators):
+        return dict(extension_configs=dict(customblocks=dict(
+            generators=generators,
+        )))
+
+    def test_plainMarkdown(self):
+        self.assertEqual(self.convert("*hello*"), "<p><em>hello</em></p>")
+
+    def test_customblocksAddedIfMissing(self):
+        self.assertEqual(self.convert("::: myblock"),
+            '<div class="myblock"></div>')
+
+    def test_customblocksInstance_notAddedTwice(self):
+        extension = CustomBlocksExtension()
+        self.assertEqual(self.convert("::: myblock", extensions=[extension]),
+            '<div class="myblock"></div>')
+
+    def test_asyncGenerators_awaitedInCallerLoop(self):
+        loops = []
+        async def custom(ctx):
+            loops.append(asyncio.get_running_loop())
+            return E('custom')
+        async def main():
+            html = await convert_async("::: custom", **self.generators(custom=custom))
+            return html, asyncio.get_running_loop()
+        html, loop = asyncio.run(main())
+        self.assertEqual(html, "<custom></custom>")
+        self.assertEqual(loops, [loop])
+
+    def test_sharedExtension_concurrentConversions(self):
+        entered = threading.Event()
+        release = threading.Event()
+        async def slow(ctx):
+            return E('slow')
+        def gate(ctx):
+            entered.set()
+            release.wait(1) # while the other Markdown is built
+        def other(ctx):
+            release.set()
+            return E('other')
+        extension = CustomBlocksExtension(generators=dict(
+            slow=slow, gate=gate, other=other))
+        async def main():
+            first = asyncio.ensure_future(
+                convert_async("::: slow\n\n::: gate", extensions=[extension]))
+            await asyncio.get_running_loop().run_in_executor(None, entered.wait, 1)
+            second = await convert_async("::: other", extensions=[extension])
+            return await first, second
+        self.assertEqual(asyncio.run(main()), ("<slow></slow>", "<other></other>"))
+
+    def test_syncGenerators_doNotBlockTheLoop(self):
+        def blocking(ctx):
+            time.sleep(0.1)
+            return E('blocking')
+        async def main():
+            ticks = []
+            async def ticker():
+                while True:
+                    ticks.append(None)
+                    await asyncio.sleep(0.005)
+            task = asyncio.create_task(ticker())
+            html = await convert_async("::: blocking", **self.generators(blocking=blocking))
+            task.cancel()
+            return html, len(ticks)
+        html, ticks = asyncio.run(main())
+        self.assertEqual(html, "<blocking></blocking>")
+        self.assertGreater(ticks, 5)
+
+    def test_timeout_cancelsPendingGenerators(self):
+        cancelled = []
+        async def slow(ctx):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(ctx.type)
+                raise
+        async def main():
+            with self.assertRaises(asyncio.TimeoutError):
+                await convert_async("::: slow", timeout=0.05, **self.generators(slow=slow))
+            await asyncio.sleep(0.05)
+        asyncio.run(main())
+        self.assertEqual(cancelled, ['slow'])
+
+    def test_cancellation_abortsBeforeNextBlock(self):
+        calls = []
+        finished = threading.Event()
+        def blocking(ctx):
+            calls.append(ctx.type)
+            time.sleep(0.1)
+            finished.set()
+            return E('blocking')
+        async def main():
+            task = asyncio.create_task(convert_async(
+                "::: blocking\n\n::: blocking",
+                **self.generators(blocking=blocking)))
+            await asyncio.sleep(0.02)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        asyncio.run(main())
+        finished.wait(1)
+        time.sleep(0.05)
+        self.assertEqual(calls, ['blocking'])
+
+# vim: et ts=4 sw=4
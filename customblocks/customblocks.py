@@ -2,23 +2,259 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from markdown.extensions import Extension
 from markdown.blockprocessors import BlockProcessor
+from markdown.preprocessors import Preprocessor
+from markdown.treeprocessors import Treeprocessor
+from markdown.postprocessors import Postprocessor
 from xml.etree import ElementTree as etree
 import importlib
 import re
-from yamlns import namespace as ns
+import unicodedata
 import inspect
+import functools
 import warnings
+import threading
+import logging
+from types import MappingProxyType
+from collections.abc import Mapping
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 from .generators import container
-from .entrypoints import load_entry_points_group
+from .utils import RawHtml
+from .rendercache import RenderCache, sharedRenderCache
+from .stats import Stats
+from . import tracing
+from . import profiling
+from .entrypoints import LazyEntryPoints, cached_entry_points_group
 
 generators_group = 'markdown.customblocks.generators'
 
+logger = logging.getLogger(__name__)
+
 def _installedGenerators():
     if not hasattr(_installedGenerators, 'value'):
-        generators = load_entry_points_group(generators_group)
+        generators = LazyEntryPoints(generators_group,
+            entries=cached_entry_points_group(generators_group))
         _installedGenerators.value = generators
     return _installedGenerators.value
 
+def _resolveGenerator(symbolname):
+    """Turns a generator spec, either a callable or
+    a 'module:function' import string, into a callable.
+    """
+    if callable(symbolname):
+        return symbolname
+    modulename, functionname = symbolname.split(':', 1)
+    module = importlib.import_module(modulename)
+    generator = getattr(module, functionname)
+    if not callable(generator):
+        raise ValueError(
+            "{} is not callable".format(symbolname)
+        )
+    return generator
+
+class _GeneratorRegistry:
+    """Maps block types to already resolved generator callables.
+    Installed generators are overriden by configured ones,
+    and configured as None or not found types go to the fallback.
+    Installed generators are loaded on the first block of their type.
+    """
+    def __init__(self, generators, fallback):
+        self.fallback = _resolveGenerator(fallback)
+        self._installed = _installedGenerators()
+        self._warmupThread = None
+        self._generators = dict(
+            (name, self.fallback if spec is None else _resolveGenerator(spec))
+            for name, spec in generators.items()
+        )
+
+    def __getitem__(self, blocktype):
+        try:
+            return self._generators[blocktype]
+        except KeyError:
+            pass
+        if blocktype not in self._installed:
+            return self.fallback
+        generator = _resolveGenerator(self._installed[blocktype])
+        self._generators[blocktype] = generator
+        return generator
+
+    def warmup(self):
+        """Loads every configured and installed generator
+        and calls their warmup hook, if any,
+        so that the first blocks do not pay their import cost.
+        Failures are left to be reported on use."""
+        generators = [self.fallback]
+        for name in sorted(set(self._generators) | set(self._installed)):
+            try:
+                generators.append(self[name])
+            except Exception:
+                continue
+        for generator in generators:
+            hook = getattr(generator, 'warmup', None)
+            if hook is None: continue
+            try:
+                hook()
+            except Exception:
+                continue
+
+    def startWarmup(self):
+        """Runs warmup in a background thread, just once.
+        Returns the thread."""
+        if self._warmupThread is None:
+            self._warmupThread = threading.Thread(
+                target=self.warmup,
+                name='customblocks-warmup',
+                daemon=True,
+            )
+            self._warmupThread.start()
+        return self._warmupThread
+
+# Backslash escapes recognized in quoted values, as in Python literals
+_RE_ESCAPE = re.compile(
+    r'\\(?:'
+        r'([0-7]{1,3})|' # octal
+        r'x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8})|' # hexa
+        r'N\{([^}]+)\}|' # unicode name
+        r'(.)' # single char
+    r')', re.DOTALL)
+
+_singleCharEscapes = {
+    '\n': '', '\\': '\\', "'": "'", '"': '"',
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n',
+    'r': '\r', 't': '\t', 'v': '\v',
+}
+
+def _unescapeMatch(match):
+    octal, byte, short, long, name, char = match.groups()
+    if char is not None:
+        return _singleCharEscapes.get(char, match.group(0))
+    if octal is not None:
+        return chr(int(octal, 8))
+    if name is not None:
+        return unicodedata.lookup(name)
+    return chr(int(byte or short or long, 16))
+
+def _unescape(text):
+    """Resolves backslash escapes like Python string literals do,
+    but without evaluating the text as Python code."""
+    if '\\' not in text:
+        return text
+    return _RE_ESCAPE.sub(_unescapeMatch, text)
+
+class GeneratorConfig(Mapping):
+    """
+    Read-only view of the generators config, shared by all blocks.
+    Values are accessed either as keys or as attributes,
+    as the namespace it replaces.
+    """
+    __slots__ = '_items',
+
+    def __init__(self, items=()):
+        object.__setattr__(self, '_items', MappingProxyType(dict(items)))
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getattr__(self, name):
+        try:
+            return self._items[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Generators config is read-only")
+
+    __delattr__ = __setattr__
+
+    def __repr__(self):
+        return 'GeneratorConfig({!r})'.format(dict(self._items))
+
+class BlockContext:
+    """
+    Context received by generators as the `ctx` parameter.
+    Fields are accessed as attributes or, as the namespace
+    it replaces, as keys (`ctx['type']`, `ctx.get('type')`).
+
+    - type: the block type
+    - parent: the parent etree node
+    - content: the unparsed indented content
+    - parser: the markdown block parser
+    - metadata: the document metadata
+    - config: the generators config, a read-only GeneratorConfig shared by all blocks
+    """
+    __slots__ = 'type', 'parent', 'content', 'parser', 'metadata', 'config'
+
+    def __init__(self, type, parent, content, parser, metadata, config):
+        self.type = type
+        self.parent = parent
+        self.content = content
+        self.parser = parser
+        self.metadata = metadata
+        self.config = config
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return 'BlockContext(type={!r})'.format(self.type)
+
+_empty = inspect.Parameter.empty
+
+class _BindingPlan:
+    """Precompiled view of a generator signature
+    used to bind headline values to its parameters.
+
+    - flags: maps headline words (name or 'no'+name of bool parameters)
+      to the (name, value) keyword they stand for
+    - slots: (name, isContext, byKey, byPosition, keywordOnly, default)
+      for every non variadic parameter in signature order
+    - acceptAnyPos, acceptAnyKey: whether it has *args or **kwds
+    """
+    def __init__(self, callback):
+        self.flags = {}
+        self.slots = []
+        self.acceptAnyPos = False
+        self.acceptAnyKey = False
+        for name, param in inspect.signature(callback).parameters.items():
+            if type(param.default) == bool or param.annotation == bool:
+                self.flags.setdefault(name, (name, True))
+                self.flags.setdefault('no' + name, (name, False))
+            if name == 'ctx':
+                self.slots.append((name, True, False, False, False, _empty))
+                continue
+            if param.kind == param.VAR_KEYWORD:
+                self.acceptAnyKey = True
+                continue
+            if param.kind == param.VAR_POSITIONAL:
+                self.acceptAnyPos = True
+                continue
+            self.slots.append((
+                name,
+                False, # isContext
+                param.kind != param.POSITIONAL_ONLY, # byKey
+                param.kind != param.KEYWORD_ONLY, # byPosition
+                param.kind == param.KEYWORD_ONLY, # keywordOnly
+                param.default,
+            ))
+
+@functools.lru_cache(maxsize=256)
+def _bindingPlan(callback):
+    return _BindingPlan(callback)
+
 class CustomBlocksExtension(Extension):
     """ CustomBlocks extension for Python-Markdown. """
 
@@ -38,54 +274,261 @@ class CustomBlocksExtension(Extension):
                 {},
                 "Generators config parameters.",
             ],
+            render_cache=[
+                0,
+                "Reuse the output of already rendered blocks. "
+                "A number sets the size of a process wide cache, "
+                "shared by the instances setting the same size, "
+                "a RenderCache object uses it instead. "
+                "By default, 0, disabled.",
+            ],
+            prefetch=[
+                0,
+                "Number of threads fetching concurrently, before rendering, "
+                "the resources declared by the generators prefetch hook. "
+                "By default, 0, disabled.",
+            ],
+            async_concurrency=[
+                8,
+                "Maximum number of async generators awaited at once. "
+                "By default, 8.",
+            ],
+            stats=[
+                False,
+                "Record per block type counts and timings "
+                "into the extension stats object. "
+                "By default, False.",
+            ],
+            slow_block_threshold=[
+                0,
+                "Log a warning with the headline of blocks taking "
+                "longer than this seconds. "
+                "By default, 0, disabled.",
+            ],
+            trace=[
+                '',
+                "File to write a Chrome trace-event trace "
+                "of the conversions. "
+                "By default, '', disabled.",
+            ],
+            profile=[
+                '',
+                "Profile generators per block type: "
+                "'cpu' with cProfile, 'memory' with tracemalloc, "
+                "or 'cpu,memory'. "
+                "By default, '', disabled.",
+            ],
+            profile_dir=[
+                'profile',
+                "Directory to write profiling results into. "
+                "By default, 'profile'.",
+            ],
+            warmup=[
+                False,
+                "Load, in a background thread, every generator "
+                "and the modules they use, "
+                "so that the first blocks render as fast as later ones. "
+                "By default, False.",
+            ],
         )
+        self._registry = None
+        self.stats = Stats()
         super(CustomBlocksExtension, self).__init__(**kwargs)
 
+    def setConfig(self, key, value):
+        super(CustomBlocksExtension, self).setConfig(key, value)
+        self._registry = None
+
+    def registry(self):
+        """Returns the generator registry for the current config,
+        resolving it just once until the config changes."""
+        if self._registry is None:
+            self._registry = _GeneratorRegistry(
+                generators=self.getConfig('generators'),
+                fallback=self.getConfig('fallback'),
+            )
+        return self._registry
+
+    def _renderCache(self):
+        cache = self.getConfig('render_cache')
+        if isinstance(cache, RenderCache):
+            return cache
+        if not cache:
+            return None
+        return sharedRenderCache(int(cache))
+
     def extendMarkdown(self, md):
         """ Add CustomBlocks to Markdown instance. """
-        md.registerExtension(self)
         processor = CustomBlocksProcessor(md.parser)
         processor.config = self.getConfigs()
+        processor.generators = self.registry()
+        if self.getConfig('warmup'):
+            processor.generators.startWarmup()
+        processor.generatorConfig = GeneratorConfig(self.getConfig('config'))
+        processor.renderCache = self._renderCache()
+        processor.configKey = repr(sorted(self.getConfig('config').items()))
+        if processor.renderCache is not None:
+            processor._countParsing()
         processor.md = md
+        processor.pending = []
+        processor.stats = self.stats if self.getConfig('stats') else None
+        processor.slowThreshold = float(self.getConfig('slow_block_threshold') or 0)
+        processor.cancelled = threading.Event()
+        md.registerExtension(processor) # resets with its own Markdown only
         md.parser.blockprocessors.register(processor, 'customblocks', 105)
+        awaiter = CustomBlocksAwaiter(md, processor,
+            concurrency=int(self.getConfig('async_concurrency')))
+        md.treeprocessors.register(awaiter, 'customblocks_await', 30)
+        workers = int(self.getConfig('prefetch') or 0)
+        if workers > 0:
+            prefetcher = CustomBlocksPrefetcher(md, processor, workers)
+            md.preprocessors.register(prefetcher, 'customblocks_prefetch', 15)
+        processor.profiler = self.profiler()
+        tracer = self.tracer()
+        if tracer is not None:
+            traceStart = CustomBlocksTraceStart(md, tracer)
+            md.registerExtension(traceStart)
+            md.preprocessors.register(traceStart, 'customblocks_trace_start', 100)
+            traceEnd = CustomBlocksTraceEnd(md, traceStart)
+            md.postprocessors.register(traceEnd, 'customblocks_trace_end', 0)
+
+    def profiler(self):
+        """The process wide profiler for the profile options,
+        None if disabled"""
+        modes = set(
+            mode.strip()
+            for mode in self.getConfig('profile').split(',')
+            if mode.strip()
+        )
+        if not modes:
+            return None
+        unknown = modes - {'cpu', 'memory'}
+        if unknown:
+            raise ValueError(
+                "Unknown profile mode: {}".format(', '.join(sorted(unknown))))
+        return profiling.profiler(
+            self.getConfig('profile_dir'),
+            cpu='cpu' in modes,
+            memory='memory' in modes,
+        )
+
+    def tracer(self):
+        """The process wide tracer for the trace option, None if disabled"""
+        path = self.getConfig('trace')
+        if not path:
+            return None
+        return tracing.tracer(path)
 
 
 class CustomBlocksProcessor(BlockProcessor):
-    # Detects headlines
-    RE_HEADLINE = re.compile(
-        r'(?:^|\n)::: *' # marker
+    # Detects headline start: marker and type
+    RE_HEADLINE_START = re.compile(
+        r'::: *' # marker
         r'([\w\-]+)' # keyword
-        r'(?:( |\\\n)+(?:[\w]+=)?(' # params (optional keyword)
-            r"'(?:\\.|[^'])*'|" # single quoted
-            r'"(?:\\.|[^"])*"|' # double quoted
-            r'[\S]+' # single word
-        r'))*'
-        r'\s*(?:\n|$)' # ending
     )
+    # Skips a single headline parameter and its preceding separator
+    RE_HEADLINE_PARAM = re.compile(
+        r'(?: |\\\n)+(?:[\w\-]+=)?(?:(?:' # separator and optional key
+            r"'(?:[^'\\\n]|\\.)*'|" # single quoted
+            r'"(?:[^"\\\n]|\\.)*"' # double quoted
+        r')(?=\s|\\\n|\Z)|' # quotes must be closed before a space
+            r'\S+' # single word
+        r')', re.DOTALL)
+    # Detects headline ending
+    RE_HEADLINE_END = re.compile(r'\s*(?:\n|\Z)')
     # Extracts every parameter from the headline as (optional) key and value
     RE_PARAM = re.compile(
-        r' (?:([\w\-]+)=)?('
-            r"'(?:\\.|[^'])*'|" # single quoted
-            r'"(?:\\.|[^"])*"|' # double quoted
-            r'[\S]+' # single word
-        r')')
+        r' +(?:([\w\-]+)=)?(?:('
+            r"'(?:[^'\\\n]|\\.)*'|" # single quoted
+            r'"(?:[^"\\\n]|\\.)*"' # double quoted
+        r')(?=\s|\Z)|'  # quotes must be closed before a space
+            r'(\S+)' # single word
+        r')', re.DOTALL)
     # Detect optional end markers
     RE_END = re.compile(r'^:::(?:$|\n)')
 
+    _lastScan = None, None
+    _markdownKey = None
+    _recorded = False
+    parsings = 0
+    renderCache = None
+    stats = None
+    slowThreshold = 0
+    profiler = None
+
+    def reset(self):
+        """Drops the async blocks left by a failed conversion,
+        and the stats recorded by this Markdown, if any.
+        Building a Markdown resets it, and must not clear the stats
+        that other documents sharing the extension are recording."""
+        for _, _, coroutine, _ in self.pending:
+            coroutine.close()
+        del self.pending[:]
+        self._markdownKey = None
+        if self._recorded:
+            self.stats.reset()
+            self._recorded = False
+
     def test(self, parent, block):
-        return self.RE_HEADLINE.search(block)
-
-    def _getGenerator(self, symbolname):
-        if callable(symbolname):
-            return symbolname
-        modulename, functionname = symbolname.split(':', 1)
-        module = importlib.import_module(modulename)
-        generator = getattr(module, functionname)
-        if not callable(generator):
-            raise ValueError(
-                "{} is not callable".format(symbolname)
-            )
-        return generator
+        if ':::' not in block:
+            return False
+        return self._scanHeadline(block) is not None
+
+    def _scanHeadline(self, block):
+        """
+        Finds the first headline in the block in linear time.
+        Returns its (start, type start, type end, end) positions,
+        or None if there is no headline.
+        """
+        if self._lastScan[0] is block:
+            return self._lastScan[1]
+        result = None
+        failed = set() # positions known not to lead to a headline end
+        pos = block.find(':::')
+        while pos != -1:
+            if pos == 0 or block[pos-1] == '\n':
+                headline = self._matchHeadline(block, pos, failed)
+                if headline is not None:
+                    result = (max(pos-1, 0),) + headline
+                    break
+            pos = block.find(':::', pos+1)
+        self._lastScan = block, result
+        return result
+
+    def _matchHeadline(self, block, pos, failed):
+        """
+        Matches a headline starting at pos.
+        Returns its (type start, type end, end) positions,
+        or None if there is no headline at pos.
+        """
+        start = self.RE_HEADLINE_START.match(block, pos)
+        if not start:
+            return None
+        end = self._headlineEnd(block, start.end(), failed)
+        if end is None:
+            return None
+        return start.start(1), start.end(1), end
+
+    def _headlineEnd(self, block, pos, failed):
+        """
+        Skips headline params from pos and returns the headline end,
+        or None if the line does not end as a headline should.
+        Positions visited by failed scans are added to failed
+        so that later scans reaching them stop right away.
+        """
+        visited = []
+        while pos not in failed:
+            visited.append(pos)
+            param = self.RE_HEADLINE_PARAM.match(block, pos)
+            if param:
+                pos = param.end()
+                continue
+            ending = self.RE_HEADLINE_END.match(block, pos)
+            if ending:
+                return ending.end()
+            break
+        failed.update(visited)
+        return None
 
     def _indentedContent(self, blocks):
         """
@@ -94,14 +537,17 @@ class CustomBlocksProcessor(BlockProcessor):
         Returns the indented lines removing the indentations.
         """
         content = []
-        while blocks:
-            block = blocks.pop(0)
+        consumed = 0
+        for block in blocks:
             indented, unindented = self.detab(block)
             if indented:
                 content.append(indented)
             if unindented:
-                blocks.insert(0, unindented)
+                blocks[consumed] = unindented
                 break
+            consumed += 1
+        # Single removal instead of one pop per block
+        del blocks[:consumed]
         return '\n\n'.join(content)
 
     def _processParams(self, params):
@@ -113,19 +559,24 @@ class CustomBlocksProcessor(BlockProcessor):
         The method returns a tuple of a list with all keyless
         parameters and a dict with all keyword parameters.
         """
-        params = params.replace('\\\n', ' ')
+        args, kwds = self._tokenizeParams(params)
+        return list(args), dict(kwds)
+
+    @classmethod
+    @functools.lru_cache(maxsize=1024)
+    def _tokenizeParams(cls, params):
+        """Memoized single pass split of the headline parameters
+        into a tuple of keyless values and a tuple of key-value pairs.
+        """
         args = []
-        kwd = {}
-        for key, param in self.RE_PARAM.findall(params):
-            if param[0] == param[-1] == '"':
-                param = eval(param)
-            if param[0] == param[-1] == "'":
-                param = eval(param)
+        kwds = {}
+        for key, quoted, word in cls.RE_PARAM.findall(params.replace('\\\n', ' ')):
+            value = _unescape(quoted[1:-1]) if quoted else word
             if key:
-                kwd[key] = param
+                kwds[key] = value
             else:
-                args.append(param)
-        return args, kwd
+                args.append(value)
+        return tuple(args), tuple(kwds.items())
 
     def _adaptParams(self, callback, ctx, args, kwds):
         """
@@ -136,58 +587,57 @@ class CustomBlocksProcessor(BlockProcessor):
         def warn(message):
             warnings.warn(f"In block '{ctx.type}', " + message)
 
-        signature = inspect.signature(callback)
+        try:
+            plan = _bindingPlan(callback)
+        except TypeError: # unhashable callable
+            plan = _BindingPlan(callback)
 
         # Turn flags into boolean keywords
-        for name, param in signature.parameters.items():
-            if type(param.default) != bool and param.annotation != bool:
-                continue
-
-            if name in args:
-                args.remove(name)
-                kwds[name] = True
-
-            if 'no' + name in args:
-                args.remove('no' + name)
-                kwds[name] = False
+        if plan.flags:
+            unflagged = []
+            flagvalues = {}
+            for arg in args:
+                flag = plan.flags.get(arg)
+                if flag is None or arg in flagvalues:
+                    unflagged.append(arg)
+                    continue
+                flagvalues[arg] = flag
+            for name, value in flagvalues.values():
+                kwds[name] = value and kwds.get(name) is not False
+            args = unflagged
 
         outargs = []
         outkwds = {}
-        acceptAnyKey = False
-        acceptAnyPos = False
-        for name, param in signature.parameters.items():
-            if name == 'ctx':
+        nargs = len(args)
+        nextarg = 0
+        for name, isContext, byKey, byPosition, keywordOnly, default in plan.slots:
+            if isContext:
                 outargs.append(ctx)
                 continue
-            if param.kind == param.VAR_KEYWORD:
-                acceptAnyKey = True
-                continue
-            if param.kind == param.VAR_POSITIONAL:
-                acceptAnyPos = True
-                continue
 
-            value = (
-                kwds.pop(name)
-                if name in kwds and param.kind != param.POSITIONAL_ONLY
-                else args.pop(0)
-                if args and param.kind != param.KEYWORD_ONLY
-                else param.default
-                if param.default is not param.empty
-                else warn(f"missing mandatory attribute '{name}'") or ""
-            )
-            if param.kind == param.KEYWORD_ONLY:
+            if byKey and name in kwds:
+                value = kwds.pop(name)
+            elif byPosition and nextarg < nargs:
+                value = args[nextarg]
+                nextarg += 1
+            elif default is not _empty:
+                value = default
+            else:
+                value = warn(f"missing mandatory attribute '{name}'") or ""
+
+            if keywordOnly:
                 outkwds[name] = value
             else:
                 outargs.append(value)
 
         # Extend var pos
-        if acceptAnyPos:
-            outargs.extend(args)
+        if plan.acceptAnyPos:
+            outargs.extend(args[nextarg:])
         else:
-            for arg in args:
+            for arg in args[nextarg:]:
                 warn(f"ignored extra attribute '{arg}'")
         # Extend var key
-        if acceptAnyKey:
+        if plan.acceptAnyKey:
             outkwds.update(kwds)
         else:
             for key in kwds:
@@ -195,55 +645,388 @@ class CustomBlocksProcessor(BlockProcessor):
 
         return outargs, outkwds
 
+    # Line starts, after indentation, of candidate headlines
+    def _headlines(self, blocks):
+        """
+        Yields the (type, params) of the blocks that parsing blocks renders,
+        scanning them as the parser does, so that code blocks are skipped,
+        and the ones nested in their content.
+        """
+        blocks = list(blocks)
+        while blocks:
+            block = blocks.pop(0)
+            headline = self._scanHeadline(block)
+            if headline is None:
+                continue # code, or any other markdown
+            start, typestart, typeend, end = headline
+            blocks.insert(0, block[end:])
+            content = self._indentedContent(blocks)
+            yield block[typestart:typeend], block[typeend:end]
+            for nested in self._headlines(content.split('\n\n')):
+                yield nested
+
+    def prefetchRequests(self, text):
+        """
+        Yields the (fetcher, url) pairs declared by the prefetch hook
+        of the generators of the blocks found in text, nested included.
+        """
+        for blocktype, params in self._headlines(text.split('\n\n')):
+            generator = self.generators[blocktype]
+            prefetch = getattr(generator, 'prefetch', None)
+            if prefetch is None:
+                continue
+            ctx = BlockContext(
+                type=blocktype,
+                parent=None,
+                content='',
+                parser=self.parser,
+                metadata=getattr(self.parser.md, 'Meta', None) or {},
+                config=self.generatorConfig,
+            )
+            try:
+                args, kwds = self._processParams(params)
+                with warnings.catch_warnings():
+                    # Rendering will warn again, if needed
+                    warnings.simplefilter('ignore')
+                    args, kwds = self._adaptParams(generator, ctx, args, kwds)
+                requests = list(prefetch(*args, **kwds))
+            except Exception:
+                continue # Rendering will report the error, if any
+            for request in requests:
+                yield request
+
     def _extractHeadline(self, block):
-        match = self.RE_HEADLINE.search(block)
+        start, typestart, typeend, end = self._scanHeadline(block)
         return (
-            block[: match.start()], # pre
-            match.group(1), # type
-            block[match.end(1) : match.end()], # params
-            block[match.end() :], # post
+            block[:start], # pre
+            block[typestart:typeend], # type
+            block[typeend:end], # params
+            block[end:], # post
         )
 
     def run(self, parent, blocks):
-        block = blocks[0]
+        if self.cancelled.is_set():
+            raise CancelledError()
+        start = perf_counter()
         pre, blocktype, params, post = self._extractHeadline(blocks[0])
-        if pre:
-            self.parser.parseChunk(parent, pre)
         blocks[0] = post
         args, kwds = self._processParams(params)
         content = self._indentedContent(blocks)
         # Remove optional closing if present
         if blocks:
             blocks[0] = self.RE_END.sub('', blocks[0])
+        parsed = perf_counter()
 
-        generators = dict(
-            _installedGenerators(),
-            **self.config['generators']
-        )
-        generator = self._getGenerator(generators.get(blocktype, container))
-
-        ctx = ns()
-        ctx.type = blocktype
-        ctx.parent = parent
-        ctx.content = content
-        ctx.parser = self.parser
-        if not hasattr(self.parser.md, "Meta") or not self.parser.md.Meta:
+        if pre:
+            self.parser.parseChunk(parent, pre)
+
+        binding = perf_counter()
+        generator = self.generators[blocktype]
+
+        if not getattr(self.parser.md, "Meta", None):
             self.parser.md.Meta = {}
-        ctx.metadata = self.parser.md.Meta
-        ctx.config = ns(self.config.get('config',{}))
+        ctx = BlockContext(
+            type=blocktype,
+            parent=parent,
+            content=content,
+            parser=self.parser,
+            metadata=self.parser.md.Meta,
+            config=self.generatorConfig,
+        )
 
         outargs, kwds = self._adaptParams(generator, ctx, args, kwds)
+        bound = perf_counter()
 
-        result = generator(*outargs, **kwds)
+        key = self._renderCacheKey(blocktype, params, content, ctx, generator)
+        elements = None if key is None else self.renderCache.get(key)
+        if elements is not None:
+            parent.extend(elements)
+            generated = bound
+        else:
+            snapshot = None if key is None else self._snapshot(parent)
+            if self.profiler is None:
+                result = generator(*outargs, **kwds)
+            else:
+                result = self.profiler.call(blocktype, generator, outargs, kwds)
+            generated = perf_counter()
+            self._insertResult(parent, blocktype, result)
+            if key is not None and self._onlyAppended(parent, snapshot):
+                self.renderCache.put(key, parent[snapshot[-1]:])
+        end = perf_counter()
+
+        tracer = tracing.active()
+        if tracer is not None:
+            tracer.complete(blocktype, 'block', start, end - start,
+                dict(headline=self._headline(blocktype, params)))
+        if self.stats is not None or self.slowThreshold:
+            self._account(blocktype, params,
+                parse = parsed - start,
+                bind = bound - binding,
+                generate = generated - bound,
+                insert = end - generated,
+            )
+        return True
+
+    def _renderCacheKey(self, blocktype, params, content, ctx, generator):
+        """The render cache key for the block,
+        None if the block can not be cached"""
+        if self.renderCache is None:
+            return None
+        key = (
+            blocktype,
+            params,
+            str(content),
+            self.configKey,
+            self._markdownSetup(),
+            repr(ctx.metadata),
+            generator,
+        )
+        try:
+            hash(key)
+        except TypeError: # unhashable generator
+            return None
+        return key
+
+    def _markdownSetup(self):
+        """The Markdown setup the rendered content depends on:
+        tab length and registered processors, in order"""
+        if self._markdownKey is None:
+            md = self.parser.md
+            self._markdownKey = (md.tab_length,) + tuple(
+                tuple(
+                    (type(processor).__module__, type(processor).__qualname__,
+                        getattr(processor, 'pattern', None))
+                    for processor in registry
+                )
+                for registry in (
+                    self.parser.blockprocessors,
+                    md.treeprocessors,
+                    md.inlinePatterns,
+                )
+            )
+        return self._markdownKey
+
+    def _countParsing(self):
+        """Counts the block parsings, so that blocks parsing their content
+        are not cached, since other processors may keep state from it,
+        like footnote definitions"""
+        parseBlocks = self.parser.parseBlocks
+        def countedParseBlocks(parent, blocks):
+            if any(block.strip() for block in blocks): # empty ones do nothing
+                self.parsings += 1
+            return parseBlocks(parent, blocks)
+        self.parser.parseBlocks = countedParseBlocks
 
+    def _snapshot(self, parent):
+        """State to detect changes other than appending elements"""
+        before = len(parent)
+        return (
+            self.parsings,
+            self.parser.md.htmlStash.html_counter,
+            len(self.pending),
+            parent.text,
+            parent[before-1].tail if before else None,
+            before,
+        )
+
+    def _onlyAppended(self, parent, snapshot):
+        """Whether the block just appended elements to parent.
+        Blocks changing anything else can not be cached."""
+        parsings, stashed, pending, text, tail, before = snapshot
+        if self.parsings != parsings: return False
+        if self.parser.md.htmlStash.html_counter != stashed: return False
+        if len(self.pending) != pending: return False
+        if parent.text != text: return False
+        if before and parent[before-1].tail != tail: return False
+        return True
+
+    def _account(self, blocktype, params, **times):
+        """Records block timings, if enabled, and reports slow blocks"""
+        if self.stats is not None:
+            self.stats.record(blocktype, **times)
+            self._recorded = True
+        elapsed = sum(times.values())
+        if not self.slowThreshold or elapsed < self.slowThreshold:
+            return
+        logger.warning("Slow block, %.3fs: %s",
+            elapsed, self._headline(blocktype, params))
+
+    def _headline(self, blocktype, params):
+        """Single line, space normalized, headline for reports"""
+        return ' '.join([':::', blocktype] + params.replace('\\\n', ' ').split())
+
+    def _insertResult(self, parent, blocktype, result):
+        """Inserts the result or, if it is a coroutine, a placeholder"""
+        if inspect.iscoroutine(result):
+            # Awaited later, along with any other, by CustomBlocksAwaiter
+            placeholder = etree.SubElement(parent, 'customblocks-pending')
+            self.pending.append((parent, placeholder, result, blocktype))
+            return
+        self._insert(parent, result)
+
+    def _insert(self, parent, result):
+        """Inserts a generator result into parent"""
         if result is None:
-            return True
+            return
+        if isinstance(result, RawHtml):
+            # Trusted html, stashed as is, no xml parsing
+            placeholder = self.parser.md.htmlStash.store(result)
+            etree.SubElement(parent, 'p').text = placeholder
+            return
         if type(result) == type(u''):
             result = result.encode('utf8')
         if type(result) == type(b''):
             result = etree.XML(result)
         parent.append(result)
-        return True
+
+class CustomBlocksPrefetcher(Preprocessor):
+    """
+    Fetches concurrently, before any block is rendered,
+    the resources generators declare to need,
+    so that rendering finds them in the fetcher cache.
+    """
+
+    def __init__(self, md, processor, workers):
+        super(CustomBlocksPrefetcher, self).__init__(md)
+        self.processor = processor
+        self.workers = workers
+
+    def run(self, lines):
+        pending = {}
+        for fetcher, url in self.processor.prefetchRequests('\n'.join(lines)):
+            key = str(fetcher.cachedir), url
+            if key in pending or fetcher.fresh(url):
+                continue
+            pending[key] = fetcher, url
+        if not pending:
+            return lines
+        workers = min(self.workers, len(pending))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for fetcher, url in pending.values():
+                # Failed fetches are retried, and reported, on rendering
+                pool.submit(tracing.inContext(fetcher.get), url)
+        return lines
+
+class CustomBlocksAwaiter(Treeprocessor):
+    """
+    Awaits together the results of async generators,
+    and replaces their placeholders before inline processing.
+    """
+
+    def __init__(self, md, processor, concurrency):
+        super(CustomBlocksAwaiter, self).__init__(md)
+        self.processor = processor
+        self.concurrency = concurrency
+        self.loop = None # Event loop to run coroutines on, if any
+        self._future = None
+        self._awaited = 0 # trace span ids
+
+    def cancel(self):
+        """Aborts, from any thread, the conversion in progress"""
+        self.processor.cancelled.set()
+        future = self._future
+        if future is not None:
+            future.cancel()
+
+    def run(self, root):
+        # Awaited results may contain nested async blocks
+        while self.processor.pending:
+            pending = self.processor.pending[:]
+            del self.processor.pending[:]
+            results = self._gather([coroutine for _, _, coroutine, _ in pending])
+            stats = self.processor.stats
+            tracer = tracing.active()
+            for (parent, placeholder, _, blocktype), (result, started, elapsed) in zip(pending, results):
+                if tracer is not None:
+                    self._awaited += 1
+                    tracer.asyncSpan(blocktype, 'block', self._awaited, started, elapsed)
+                start = perf_counter()
+                self._replace(parent, placeholder, result)
+                if stats is None: continue
+                stats.add(blocktype, 'generate', elapsed)
+                stats.add(blocktype, 'insert', perf_counter() - start)
+
+    def _gather(self, coroutines):
+        """Runs the coroutines concurrently and returns
+        their results along with the time each one took"""
+        import asyncio # Lazy, just needed when async generators are used
+        tracer = tracing.active()
+        async def gatherAll():
+            tracing.activate(tracer) # runs in a task of its own context
+            semaphore = asyncio.Semaphore(max(self.concurrency, 1))
+            async def bounded(coroutine):
+                async with semaphore:
+                    start = perf_counter()
+                    result = await coroutine
+                    return result, start, perf_counter() - start
+            return await asyncio.gather(*[
+                bounded(coroutine) for coroutine in coroutines
+            ])
+
+        if self.processor.cancelled.is_set():
+            raise CancelledError()
+        if self.loop is not None:
+            future = asyncio.run_coroutine_threadsafe(gatherAll(), self.loop)
+            self._future = future
+            if self.processor.cancelled.is_set():
+                future.cancel()
+            try:
+                return future.result()
+            finally:
+                self._future = None
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(gatherAll())
+        # A loop already runs in this thread, use another one
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, gatherAll()).result()
+
+    def _replace(self, parent, placeholder, result):
+        holder = etree.Element('div')
+        self.processor._insert(holder, result)
+        index = list(parent).index(placeholder)
+        parent[index:index+1] = list(holder)
+
+class CustomBlocksTraceStart(Preprocessor):
+    """Starts tracing a conversion"""
+
+    def __init__(self, md, tracer):
+        super(CustomBlocksTraceStart, self).__init__(md)
+        self.tracer = tracer
+        self.start = None
+        self.previous = None
+
+    def reset(self):
+        """Restores the tracer active before a conversion that failed"""
+        if self.start is None:
+            return
+        tracing.activate(self.previous)
+        self.start = self.previous = None
+
+    def run(self, lines):
+        self.reset() # left over by a failed conversion
+        self.previous = tracing.activate(self.tracer)
+        self.start = perf_counter()
+        return lines
+
+class CustomBlocksTraceEnd(Postprocessor):
+    """Ends tracing a conversion"""
+
+    def __init__(self, md, traceStart):
+        super(CustomBlocksTraceEnd, self).__init__(md)
+        self.traceStart = traceStart
+
+    def run(self, text):
+        start = self.traceStart
+        if start.start is None:
+            return text
+        start.tracer.complete('convert', 'markdown',
+            start.start, perf_counter() - start.start)
+        start.tracer.flush()
+        tracing.activate(start.previous)
+        start.start = start.previous = None
+        return text
 
 def makeExtension(**kwargs):  # pragma: no cover
     return CustomBlocksExtension(**kwargs)
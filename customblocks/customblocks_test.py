@@ -1,4 +1,11 @@
 import unittest
+import importlib
+import inspect
+import time
+import threading
+import asyncio
+from unittest import mock
+import markdown
 from markdown import test_tools
 from xml.etree import ElementTree as etree
 
@@ -7,6 +14,11 @@ try:
 except ImportError:
     full_yaml_metadata = None
 
+from .customblocks import CustomBlocksExtension, CustomBlocksProcessor
+from .utils import RawHtml, E, Markdown
+from .rendercache import RenderCache
+from .testutils import sandbox_dir
+
 
 class CustomBlockExtension_Test(test_tools.TestCase):
     def setUp(self):
@@ -327,6 +339,40 @@ class CustomBlockExtension_Test(test_tools.TestCase):
             <div class="myblock" key1="param1" key2="param2"></div>
             """)
 
+    def test_quotedValues_escapedUnicode(self):
+        self.assertMarkdown("""\
+            ::: myblock key="\\u00e9\\x41\\101\\N{BULLET}"
+            """, """\
+            <div class="myblock" key="\u00e9AA\u2022"></div>
+            """)
+
+    def test_quotedValues_unknownEscapeKept(self):
+        self.assertMarkdown("""\
+            ::: myblock key="C:\\dir"
+            """, """\
+            <div class="myblock" key="C:\\dir"></div>
+            """)
+
+    def test_quotedValues_closingQuoteFollowedByText_takenAsWords(self):
+        self.assertMarkdown("""\
+            ::: myblock "a b"c
+            """, """\
+            <div class="myblock &quot;a b&quot;c"></div>
+            """)
+
+    def test_params_memoizedByHeadline(self):
+        CustomBlocksProcessor._tokenizeParams.cache_clear()
+        self.assertMarkdown("""\
+            ::: myblock param key=value
+
+            ::: myblock param key=value
+            """, """\
+            <div class="myblock param" key="value"></div>
+            <div class="myblock param" key="value"></div>
+            """)
+        info = CustomBlocksProcessor._tokenizeParams.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 1))
+
 
     def test_customGenerator_returnsEtree(self):
         def custom():
@@ -367,6 +413,64 @@ class CustomBlockExtension_Test(test_tools.TestCase):
             <custom></custom>
             """)
 
+    def test_customGenerator_returnsRawHtml(self):
+        def custom():
+            return RawHtml("<div><br>Not xml &nbsp; but html</div>")
+
+        self.setupCustomBlocks(custom=custom)
+
+        self.assertMarkdown("""\
+            ::: custom
+            """,
+            """\
+            <div><br>Not xml &nbsp; but html</div>
+            """)
+
+    def test_customGenerator_returnsRawHtml_notXmlParsed(self):
+        def custom():
+            return RawHtml("<div></div>")
+
+        self.setupCustomBlocks(custom=custom)
+        with mock.patch('xml.etree.ElementTree.XML') as xml:
+            self.assertMarkdown("""\
+                ::: custom
+                """,
+                """\
+                <div></div>
+                """)
+        xml.assert_not_called()
+
+    def test_customGenerator_returnsRawHtml_inlineWrappedInParagraph(self):
+        def custom():
+            return RawHtml("<span>inline</span>")
+
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+            """,
+            """\
+            <p><span>inline</span></p>
+            """)
+
+    def test_customGenerator_returnsRawHtml_nested(self):
+        def custom():
+            return RawHtml("<div>*not markdown*</div>")
+
+        self.setupCustomBlocks(custom=custom)
+
+        self.assertMarkdown("""\
+            ::: container
+                ::: custom
+
+                Content
+            """,
+            """\
+            <div class="container">
+            <div>*not markdown*</div>
+            <p>Content</p>
+            </div>
+            """)
+
 
     def test_customGenerator_receivesParent(self):
         def custom(ctx):
@@ -662,6 +766,46 @@ class CustomBlockExtension_Test(test_tools.TestCase):
             <custom flag="False"></custom>
             """)
 
+    def test_customGenerator_flagAndNoflag_noflagWins(self):
+        def custom(*, flag=False):
+            return "<custom flag='{}'></custom>".format(flag)
+
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom noflag flag
+            """,
+            """\
+            <custom flag="False"></custom>
+            """)
+
+    def test_customGenerator_flag_repeatedTakenAsPositional(self):
+        def custom(*args, flag=False):
+            return "<custom flag='{}'>{}</custom>".format(flag, ' '.join(args))
+
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom flag flag
+            """,
+            """\
+            <custom flag="True">flag</custom>
+            """)
+
+    def test_customGenerator_signatureInspectedOnce(self):
+        def custom(ctx, key, *, flag=False):
+            return "<custom></custom>"
+
+        self.setupCustomBlocks(custom=custom)
+        with mock.patch('inspect.signature', wraps=inspect.signature) as signature:
+            self.assertMarkdown("""\
+                ::: custom value
+
+                ::: custom value flag
+                """,
+                """\
+                <custom></custom><custom></custom>
+                """)
+        signature.assert_called_once_with(custom)
+
     def test_customGenerator_unparsedContentReceived(self):
         def custom(ctx):
             return "<custom>{}</custom>".format(ctx.content)
@@ -830,6 +974,274 @@ class CustomBlockExtension_Test(test_tools.TestCase):
             """, """\
             <custom>value</custom>""")
 
+    def test_config_sharedAmongBlocks(self):
+        configs = []
+        def custom(ctx):
+            configs.append(ctx.config)
+
+        self.setupConfig(parameter='value')
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+
+            ::: custom
+            """, "")
+        self.assertIs(configs[0], configs[1])
+
+    def test_context_attributes(self):
+        def custom(ctx):
+            return "<custom>{}</custom>".format(
+                sorted(name for name in dir(ctx) if not name.startswith('_')))
+
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+            """, """\
+            <custom>['config', 'content', 'get', 'metadata', 'parent', 'parser', 'type']</custom>""")
+
+    def test_context_accessedAsKeys(self):
+        def custom(ctx):
+            return "<custom>{} {} {}</custom>".format(
+                ctx['type'], ctx.get('type'), ctx.get('missing', 'default'))
+
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+            """, """\
+            <custom>custom custom default</custom>""")
+
+    def test_context_missingKey(self):
+        errors = []
+        def custom(ctx):
+            try:
+                ctx['missing']
+            except KeyError as e:
+                errors.append(e)
+
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+            """, "")
+        self.assertEqual(len(errors), 1)
+
+    def test_config_accessedAsKeys(self):
+        def custom(ctx):
+            return "<custom>{} {} {}</custom>".format(
+                ctx.config['parameter'],
+                ctx.config.get('parameter'),
+                ctx.config.get('missing', 'default'))
+
+        self.setupConfig(parameter='value')
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+            """, """\
+            <custom>value value default</custom>""")
+
+    def test_config_readOnly(self):
+        errors = []
+        def custom(ctx):
+            try:
+                ctx.config['parameter'] = 'changed'
+            except TypeError as e:
+                errors.append(e)
+            try:
+                ctx.config.parameter = 'changed'
+            except AttributeError as e:
+                errors.append(e)
+            return "<custom>{}</custom>".format(ctx.config.parameter)
+
+        self.setupConfig(parameter='value')
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+
+            ::: custom
+            """, """\
+            <custom>value</custom><custom>value</custom>""")
+        self.assertEqual(len(errors), 4)
+
+    def setupRenderCache(self):
+        cache = RenderCache()
+        self.default_kwargs.setdefault('extension_configs', {}).setdefault('customblocks', {})['render_cache'] = cache
+        return cache
+
+    def test_renderCache_repeatedBlocksRenderedOnce(self):
+        calls = []
+        def custom(ctx, param):
+            calls.append(param)
+            return E('custom', ctx.content, param=param)
+
+        cache = self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom value
+                content
+
+            ::: custom value
+                content
+            """, """\
+            <custom param="value">content</custom><custom param="value">content</custom>""")
+        self.assertEqual(calls, ['value'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_renderCache_differentBlocksRendered(self):
+        calls = []
+        def custom(ctx, param):
+            calls.append(param)
+
+        cache = self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom value
+                content
+
+            ::: custom other
+                content
+
+            ::: custom value
+                other content
+            """, "")
+        self.assertEqual(calls, ['value', 'other', 'value'])
+
+    def test_renderCache_sharedAmongConversions(self):
+        calls = []
+        def custom(ctx):
+            calls.append(ctx.type)
+            return "<custom></custom>"
+
+        self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("::: custom", "<custom></custom>")
+        self.assertMarkdown("::: custom", "<custom></custom>")
+        self.assertEqual(calls, ['custom'])
+
+    def test_renderCache_configChange_rendered(self):
+        calls = []
+        def custom(ctx):
+            calls.append(ctx.config.parameter)
+
+        self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        self.setupConfig(parameter='value')
+        self.assertMarkdown("::: custom", "")
+        self.setupConfig(parameter='other')
+        self.assertMarkdown("::: custom", "")
+        self.assertEqual(calls, ['value', 'other'])
+
+    def test_renderCache_parsingBlocks_notCached(self):
+        calls = []
+        def custom(ctx):
+            calls.append(ctx.type)
+            return E('custom', Markdown(ctx.content, ctx.parser))
+
+        cache = self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+                content
+
+            ::: custom
+                content
+            """, """\
+            <custom><p>content</p></custom><custom><p>content</p></custom>""")
+        self.assertEqual(calls, ['custom', 'custom'])
+        self.assertEqual(len(cache), 0)
+
+    def test_renderCache_figureWithoutCaption_cached(self):
+        cache = self.setupRenderCache()
+        self.setupCustomBlocks()
+        for i in range(2):
+            self.assertMarkdown("::: figure https://example.com/image.png", """\
+                <figure><a href="https://example.com/image.png" target="_blank"><img src="https://example.com/image.png" /></a><figcaption></figcaption>
+                </figure>""")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_renderCache_sizeOption_ownCachePerSize(self):
+        def custom(ctx):
+            return E('custom')
+        self.setupCustomBlocks(custom=custom)
+        def cacheOf(size):
+            extension = CustomBlocksExtension(render_cache=size)
+            md = markdown.Markdown(extensions=[extension])
+            return md.parser.blockprocessors['customblocks'].renderCache
+        small = cacheOf(3)
+        self.assertIs(cacheOf(3), small)
+        self.assertIsNot(cacheOf(5), small)
+        self.assertEqual(small.maxsize, 3)
+
+    def test_renderCache_extensionsChange_rendered(self):
+        calls = []
+        def custom(ctx):
+            calls.append(ctx.type)
+            return E('custom', ctx.content)
+
+        self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        withTables = dict(self.default_kwargs)
+        withTables['extensions'] = self.default_kwargs['extensions'] + ['tables']
+        markdown.markdown("::: custom", **withTables)
+        markdown.markdown("::: custom", **self.default_kwargs)
+        markdown.markdown("::: custom", **self.default_kwargs)
+        self.assertEqual(calls, ['custom', 'custom'])
+
+    def test_renderCache_tableContent_notReusedWithoutTables(self):
+        def table(ctx):
+            return E('div', Markdown(ctx.content, ctx.parser))
+
+        self.setupRenderCache()
+        self.setupCustomBlocks(table=table)
+        source = "::: table\n    a | b\n    --|--\n    1 | 2"
+        withTables = dict(self.default_kwargs)
+        withTables['extensions'] = self.default_kwargs['extensions'] + ['tables']
+        self.assertIn('<table>', markdown.markdown(source, **withTables))
+        self.assertNotIn('<table>', markdown.markdown(source, **self.default_kwargs))
+
+    def test_renderCache_footnoteDefinitions_kept(self):
+        def custom(ctx):
+            return E('div', Markdown(ctx.content, ctx.parser))
+
+        self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        kwargs = dict(self.default_kwargs)
+        kwargs['extensions'] = self.default_kwargs['extensions'] + ['footnotes']
+        source = "Text[^1]\n\n::: custom\n    [^1]: The note"
+        first = markdown.markdown(source, **kwargs)
+        second = markdown.markdown(source, **kwargs)
+        self.assertIn('The note', first)
+        self.assertEqual(second, first)
+
+    def test_renderCache_stashingBlocks_notCached(self):
+        calls = []
+        def custom(ctx):
+            calls.append(ctx.type)
+            return RawHtml("<div></div>")
+
+        cache = self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+
+            ::: custom
+            """, """\
+            <div></div>
+            <div></div>""")
+        self.assertEqual(calls, ['custom', 'custom'])
+        self.assertEqual(len(cache), 0)
+
+    def test_renderCache_disabledByDefault(self):
+        calls = []
+        def custom(ctx):
+            calls.append(ctx.type)
+
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+
+            ::: custom
+            """, "")
+        self.assertEqual(calls, ['custom', 'custom'])
+
 
     def test_customGenerator_byName(self):
         self.setupConfig(parameter='value')
@@ -883,6 +1295,563 @@ class CustomBlockExtension_Test(test_tools.TestCase):
         self.assertEqual(format(ctx.exception),
             "customblocks.customblocks_test:notcallable is not callable")
 
+    def test_customGenerator_byName_resolvedOnce(self):
+        self.setupCustomBlocks(custom='customblocks.customblocks_test:mycustom')
+        with mock.patch('importlib.import_module', wraps=importlib.import_module) as importer:
+            self.assertMarkdown("""\
+                ::: custom
+
+                ::: custom
+                """, """\
+                <custom></custom><custom></custom>""")
+        importer.assert_called_once_with('customblocks.customblocks_test')
+
+    def test_fallback_usedForUnknownTypes(self):
+        def fallback(ctx):
+            return "<fallback>{}</fallback>".format(ctx.type)
+
+        self.default_kwargs.setdefault('extension_configs', {}).setdefault('customblocks', {})['fallback'] = fallback
+        self.assertMarkdown("""\
+            ::: unknown
+            """, """\
+            <fallback>unknown</fallback>""")
+
+    def test_fallback_usedForNoneGenerators(self):
+        def fallback(ctx):
+            return "<fallback>{}</fallback>".format(ctx.type)
+
+        self.default_kwargs.setdefault('extension_configs', {}).setdefault('customblocks', {})['fallback'] = fallback
+        self.setupCustomBlocks(note=None)
+        self.assertMarkdown("""\
+            ::: note
+            """, """\
+            <fallback>note</fallback>""")
+
+    def test_registry_reusedAmongMarkdownInstances(self):
+        extension = CustomBlocksExtension()
+        markdown.Markdown(extensions=[extension])
+        registry = extension.registry()
+        markdown.Markdown(extensions=[extension])
+        self.assertIs(extension.registry(), registry)
+
+    def test_registry_brokenPluginsJustFailWhenUsed(self):
+        from importlib.metadata import EntryPoint
+        from .entrypoints import LazyEntryPoints
+        with mock.patch('customblocks.entrypoints.entry_points_group', return_value=[
+            EntryPoint('broken', 'nonexistingmodule:generator', 'group'),
+        ]):
+            installed = LazyEntryPoints('group')
+        with mock.patch('customblocks.customblocks._installedGenerators', return_value=installed):
+            self.assertMarkdown("""\
+                ::: note
+                """, """\
+                <div class="note"></div>
+                """)
+            with self.assertRaises(ImportError):
+                markdown.markdown("::: broken", **self.default_kwargs)
+
+    def test_warmup_disabledByDefault(self):
+        extension = CustomBlocksExtension()
+        markdown.Markdown(extensions=[extension])
+        self.assertIsNone(extension.registry()._warmupThread)
+
+    def test_warmup_callsHooks(self):
+        calls = []
+        def custom(ctx):
+            pass
+        custom.warmup = lambda: calls.append('custom')
+        def failing(ctx):
+            pass
+        def fail():
+            raise ImportError("Missing module")
+        failing.warmup = fail
+        def other(ctx):
+            pass
+        other.warmup = lambda: calls.append('other')
+
+        extension = CustomBlocksExtension(warmup=True, generators=dict(
+            custom=custom, failing=failing, other=other,
+        ))
+        with sandbox_dir(): # builtin hooks may create fetcher caches
+            markdown.Markdown(extensions=[extension])
+            extension.registry().startWarmup().join(5)
+        self.assertEqual(calls, ['custom', 'other'])
+
+    def test_warmup_loadsInstalledGenerators(self):
+        from importlib.metadata import EntryPoint
+        from .entrypoints import LazyEntryPoints
+        installed = LazyEntryPoints('group', [
+            EntryPoint('youtube', 'customblocks.generators:youtube', 'group'),
+            EntryPoint('broken', 'nonexistingmodule:generator', 'group'),
+        ])
+        with mock.patch('customblocks.customblocks._installedGenerators', return_value=installed):
+            extension = CustomBlocksExtension(warmup=True)
+            markdown.Markdown(extensions=[extension])
+            extension.registry().startWarmup().join(5)
+        self.assertEqual(list(installed._loaded), ['youtube'])
+
+    def test_warmup_startedOnce(self):
+        extension = CustomBlocksExtension(warmup=True, generators=dict(custom=mycustom))
+        with sandbox_dir(): # builtin hooks may create fetcher caches
+            markdown.Markdown(extensions=[extension])
+            thread = extension.registry().startWarmup()
+            markdown.Markdown(extensions=[extension])
+            self.assertIs(extension.registry().startWarmup(), thread)
+            thread.join(5)
+
+    def test_registry_invalidatedOnConfigChange(self):
+        def first():
+            return "<first></first>"
+        def second():
+            return "<second></second>"
+
+        extension = CustomBlocksExtension(generators=dict(custom=first))
+        md = markdown.Markdown(extensions=[extension])
+        self.assertEqual(md.convert("::: custom"), "<first></first>")
+
+        extension.setConfig('generators', dict(custom=second))
+        md = markdown.Markdown(extensions=[extension])
+        self.assertEqual(md.convert("::: custom"), "<second></second>")
+
+
+    def setupPrefetch(self, workers):
+        self.default_kwargs.setdefault('extension_configs', {}).setdefault('customblocks', {})['prefetch'] = workers
+
+    def prefetchingGenerator(self, fetcher):
+        def custom(ctx, url, *args):
+            return E('custom', 'cached' if url in fetcher else 'missing')
+        def prefetch(ctx, url, *args):
+            yield fetcher, url
+        custom.prefetch = prefetch
+        return custom
+
+    def test_prefetch_fetchesDeclaredUrls(self):
+        fetcher = FakeFetcher()
+        self.setupPrefetch(4)
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            ::: custom url1
+
+            ::: container
+                ::: custom url2
+
+            ::: custom url1
+            """, """\
+            <custom>cached</custom><div class="container"><custom>cached</custom></div>
+            <custom>cached</custom>""")
+        self.assertEqual(sorted(fetcher.fetched), ['url1', 'url2'])
+
+    def test_prefetch_disabledByDefault(self):
+        fetcher = FakeFetcher()
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            ::: custom url1
+            """, """\
+            <custom>missing</custom>""")
+        self.assertEqual(fetcher.fetched, [])
+
+    def test_prefetch_cachedUrlsNotFetched(self):
+        fetcher = FakeFetcher()
+        fetcher.cache.add('url1')
+        self.setupPrefetch(4)
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            ::: custom url1
+
+            ::: custom url2
+            """, """\
+            <custom>cached</custom><custom>cached</custom>""")
+        self.assertEqual(fetcher.fetched, ['url2'])
+
+    def test_prefetch_staleUrlsFetched(self):
+        fetcher = FakeFetcher()
+        fetcher.cache.update(['url1', 'url2'])
+        fetcher.stale.add('url2')
+        self.setupPrefetch(4)
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            ::: custom url1
+
+            ::: custom url2
+            """, """\
+            <custom>cached</custom><custom>cached</custom>""")
+        self.assertEqual(fetcher.fetched, ['url2'])
+
+    def test_prefetch_codeBlocksSkipped(self):
+        fetcher = FakeFetcher()
+        self.setupPrefetch(4)
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            Example:
+
+                ::: custom url1
+
+            ::: container
+                Nested example:
+
+                    ::: custom url2
+
+            ::: custom url3
+            """, """\
+            <p>Example:</p>
+            <pre><code>::: custom url1
+            </code></pre>
+            <div class="container">
+            <p>Nested example:</p>
+            <pre><code>::: custom url2
+            </code></pre>
+            </div>
+            <custom>cached</custom>""")
+        self.assertEqual(fetcher.fetched, ['url3'])
+
+    def test_prefetch_fencedCodeSkipped(self):
+        fetcher = FakeFetcher()
+        self.default_kwargs['extensions'].append('fenced_code')
+        self.setupPrefetch(4)
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            ```
+            ::: custom url1
+            ```
+
+            ::: custom url2
+            """, """\
+            <pre><code>::: custom url1
+            </code></pre>
+            <custom>cached</custom>""")
+        self.assertEqual(fetcher.fetched, ['url2'])
+
+    def test_prefetch_concurrent(self):
+        barrier = threading.Barrier(2, timeout=5)
+        class WaitingFetcher(FakeFetcher):
+            def get(self, url):
+                barrier.wait() # Fails unless both urls are fetched at once
+                super(WaitingFetcher, self).get(url)
+        fetcher = WaitingFetcher()
+        self.setupPrefetch(2)
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            ::: custom url1
+
+            ::: custom url2
+            """, """\
+            <custom>cached</custom><custom>cached</custom>""")
+
+    def test_prefetch_failedFetchesIgnored(self):
+        class FailingFetcher(FakeFetcher):
+            def get(self, url):
+                raise Exception("Network down")
+        fetcher = FailingFetcher()
+        self.setupPrefetch(2)
+        self.setupCustomBlocks(custom=self.prefetchingGenerator(fetcher))
+        self.assertMarkdown("""\
+            ::: custom url1
+            """, """\
+            <custom>missing</custom>""")
+
+    def test_prefetch_failingHooksIgnored(self):
+        def custom(ctx, url):
+            return E('custom', url)
+        def prefetch(ctx, url):
+            raise Exception("Bad url")
+        custom.prefetch = prefetch
+        self.setupPrefetch(2)
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom url1
+            """, """\
+            <custom>url1</custom>""")
+
+    def test_async_resultInserted(self):
+        async def custom(ctx, value):
+            await asyncio.sleep(0)
+            return E('custom', Markdown(ctx.content, ctx.parser), value=value)
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom myvalue
+                some *content*
+            """, """\
+            <custom value="myvalue"><p>some <em>content</em></p></custom>""")
+
+    def test_async_keepsBlockOrder(self):
+        async def custom(ctx, delay):
+            await asyncio.sleep(float(delay))
+            return E('custom', delay)
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            para1
+
+            ::: custom 0.02
+
+            para2
+
+            ::: custom 0
+            """, """\
+            <p>para1</p>
+            <custom>0.02</custom><p>para2</p>
+            <custom>0</custom>""")
+
+    def test_async_otherResults(self):
+        async def none(ctx):
+            return None
+        async def string(ctx):
+            return '<string></string>'
+        async def raw(ctx):
+            return RawHtml('<div>raw<br></div>')
+        self.setupCustomBlocks(none=none, string=string, raw=raw)
+        self.assertMarkdown("""\
+            ::: none
+
+            ::: string
+
+            ::: raw
+            """, """\
+            <string></string><div>raw<br></div>""")
+
+    def test_async_awaitedConcurrently(self):
+        started = []
+        async def custom(ctx, value):
+            started.append(value)
+            for i in range(1000):
+                if len(started) == 2: break
+                await asyncio.sleep(0.001)
+            return E('custom', str(len(started)))
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom 1
+
+            ::: custom 2
+            """, """\
+            <custom>2</custom><custom>2</custom>""")
+
+    def test_async_concurrencyBounded(self):
+        running = []
+        maxrunning = []
+        async def custom(ctx):
+            running.append(ctx)
+            maxrunning.append(len(running))
+            await asyncio.sleep(0.001)
+            running.remove(ctx)
+        self.default_kwargs.setdefault('extension_configs', {}).setdefault('customblocks', {})['async_concurrency'] = 2
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("\n\n".join(["::: custom"]*5), "")
+        self.assertEqual(max(maxrunning), 2)
+
+    def test_async_nested(self):
+        async def custom(ctx, value):
+            await asyncio.sleep(0)
+            return E('custom', Markdown(ctx.content, ctx.parser), value=value)
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom outer
+                ::: custom inner
+                    *content*
+            """, """\
+            <custom value="outer"><custom value="inner"><p><em>content</em></p></custom></custom>""")
+
+    def test_async_errorsRaised(self):
+        async def custom(ctx):
+            raise ValueError("Failed")
+        self.setupCustomBlocks(custom=custom)
+        with self.assertRaises(ValueError):
+            markdown.markdown("::: custom", **self.default_kwargs)
+
+    def test_async_insideRunningLoop(self):
+        async def custom(ctx):
+            return E('custom')
+        self.setupCustomBlocks(custom=custom)
+        async def convert():
+            return markdown.markdown("::: custom", **self.default_kwargs)
+        self.assertEqual(asyncio.run(convert()), "<custom></custom>")
+
+    def test_async_failedConversion_pendingDroppedOnReset(self):
+        awaited = []
+        async def custom(ctx):
+            awaited.append(ctx.type)
+            return E('custom')
+        def failing(ctx):
+            raise ValueError("Failed")
+        self.setupCustomBlocks(custom=custom, failing=failing)
+        md = markdown.Markdown(**self.default_kwargs)
+        with self.assertRaises(ValueError):
+            md.convert("::: custom\n\n::: failing")
+        md.reset()
+        self.assertEqual(md.convert("plain"), "<p>plain</p>")
+        self.assertEqual(awaited, [])
+        self.assertEqual(md.parser.blockprocessors['customblocks'].pending, [])
+
+    def test_async_notRenderCached(self):
+        calls = []
+        async def custom(ctx):
+            calls.append(ctx.type)
+            return E('custom')
+        cache = self.setupRenderCache()
+        self.setupCustomBlocks(custom=custom)
+        self.assertMarkdown("""\
+            ::: custom
+
+            ::: custom
+            """, """\
+            <custom></custom><custom></custom>""")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_stats_disabledByDefault(self):
+        extension = CustomBlocksExtension()
+        markdown.markdown("::: note", extensions=[extension])
+        self.assertEqual(list(extension.stats), [])
+
+    def test_stats_perBlockType(self):
+        extension = CustomBlocksExtension(stats=True)
+        markdown.markdown("""\
+::: note
+
+::: container
+    ::: note
+
+::: youtube myid
+""", extensions=[extension])
+        stats = extension.stats
+        self.assertEqual(list(stats), ['container', 'note', 'youtube'])
+        self.assertEqual(stats['note'].count, 2)
+        self.assertEqual(stats['container'].count, 1)
+        self.assertEqual(stats['youtube'].count, 1)
+        self.assertEqual(set(stats['note'].total), {'parse', 'bind', 'generate', 'insert'})
+
+    def test_stats_aggregatedUntilReset(self):
+        extension = CustomBlocksExtension(stats=True)
+        md = markdown.Markdown(extensions=[extension])
+        md.convert("::: note")
+        md.convert("::: note")
+        self.assertEqual(extension.stats['note'].count, 2)
+
+    def test_stats_resetWithMarkdown(self):
+        extension = CustomBlocksExtension(stats=True)
+        md = markdown.Markdown(extensions=[extension])
+        md.convert("::: note")
+        md.reset()
+        md.convert("::: container")
+        self.assertEqual(list(extension.stats), ['container'])
+
+    def test_stats_sharedExtension_keptWhenOtherMarkdownBuilt(self):
+        extension = CustomBlocksExtension(stats=True)
+        md = markdown.Markdown(extensions=[extension])
+        md.convert("::: note")
+        other = markdown.Markdown(extensions=[extension])
+        other.reset()
+        self.assertEqual(extension.stats['note'].count, 1)
+        md.reset()
+        self.assertEqual(list(extension.stats), [])
+
+    def test_stats_asyncGenerationTime(self):
+        async def custom(ctx):
+            await asyncio.sleep(0.01)
+        extension = CustomBlocksExtension(stats=True, generators=dict(custom=custom))
+        markdown.markdown("::: custom", extensions=[extension])
+        self.assertEqual(extension.stats['custom'].count, 1)
+        self.assertGreaterEqual(extension.stats['custom'].total['generate'], 0.01)
+
+    def test_slowBlocks_logged(self):
+        def slow(ctx, *args):
+            time.sleep(0.01)
+        extension = CustomBlocksExtension(
+            slow_block_threshold=0.005,
+            generators=dict(slow=slow),
+        )
+        with self.assertLogs('customblocks', 'WARNING') as logs:
+            markdown.markdown("::: note\n\n::: slow value \\\n  other", extensions=[extension])
+        [message] = logs.output
+        self.assertRegex(message, r'Slow block, 0\.0\d\ds: ::: slow value other$')
+
+    def test_slowBlocks_fastOnesNotLogged(self):
+        extension = CustomBlocksExtension(slow_block_threshold=10)
+        with mock.patch('customblocks.customblocks.logger') as logger:
+            markdown.markdown("::: note", extensions=[extension])
+        logger.warning.assert_not_called()
+
+
+class HeadlineScanner_Test(unittest.TestCase):
+    """Adversarial headlines that made the former headline regex
+    backtrack exponentially or quadratically must be scanned
+    in bounded time."""
+
+    size = 50000
+    timeLimit = 1.0 # seconds, way above actual times
+
+    def setUp(self):
+        self.processor = CustomBlocksProcessor(markdown.Markdown().parser)
+
+    def assertScannedFast(self, block, expected):
+        start = time.perf_counter()
+        result = self.processor.test(None, block)
+        elapsed = time.perf_counter() - start
+        self.assertEqual(bool(result), expected)
+        self.assertLess(elapsed, self.timeLimit,
+            f"Scanning {len(block)} chars took {elapsed:.2f}s")
+
+    def test_noMarker(self):
+        self.assertScannedFast('word '*self.size, False)
+
+    def test_markersNotAtLineStart(self):
+        self.assertScannedFast('a ::: b '*self.size, False)
+
+    def test_backslashesInUnclosedQuotes(self):
+        self.assertScannedFast('::: a "' + '\\\\'*self.size + '\t!', False)
+
+    def test_backslashesInUnclosedQuotes_manyLines(self):
+        self.assertScannedFast(('::: a "' + '\\\\'*20 + '\t!\n')*1000, False)
+
+    def test_manyUnclosedQuotes(self):
+        self.assertScannedFast('::: a ' + '"x \'x '*self.size + '\t!', False)
+
+    def test_manyQuotesClosedBeforeText(self):
+        self.assertScannedFast('::: a ' + '"x"x '*self.size + '\t!', False)
+
+    def test_manyKeys(self):
+        self.assertScannedFast('::: a ' + 'k='*self.size + '\t!', False)
+
+    def test_manyContinuationLines(self):
+        # the last backslash is taken as a value
+        self.assertScannedFast('::: a \\\n'*self.size + '\t!', True)
+
+    def test_manyContinuationLines_insideQuotes(self):
+        self.assertScannedFast('::: a "\\\n'*self.size + '\t!', True)
+
+    def test_manyCandidateLines(self):
+        self.assertScannedFast('::: a \t!\n'*self.size, False)
+
+    def test_longValidHeadline(self):
+        self.assertScannedFast(
+            '::: a ' + 'k="quoted \\" value" word '*self.size + '\n', True)
+
+    def test_validHeadlineAfterManyCandidates(self):
+        self.assertScannedFast(
+            '::: a \t!\n'*self.size + '::: a "b" c\n', True)
+
+    def test_convert_unclosedQuotes(self):
+        source = '::: a "' + '\\\\'*self.size + '\n\n::: b\n'
+        start = time.perf_counter()
+        markdown.markdown(source, extensions=['customblocks'])
+        self.assertLess(time.perf_counter() - start, self.timeLimit)
+
+
+class FakeFetcher:
+    """Fetcher double just recording the fetched urls"""
+    def __init__(self):
+        self.cachedir = 'fake'
+        self.cache = set()
+        self.stale = set()
+        self.fetched = []
+
+    def __contains__(self, url):
+        return url in self.cache
+
+    def fresh(self, url):
+        return url in self.cache and url not in self.stale
+
+    def get(self, url):
+        self.fetched.append(url)
+        self.cache.add(url)
 
 def mycustom():
     return "<custom></custom>"
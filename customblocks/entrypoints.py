@@ -1,7 +1,14 @@
 # This module is a compatibility layer among different
 # Python versions to load entry_points in a group.
 
+import os
 import sys
+import json
+import hashlib
+import tempfile
+import warnings
+from pathlib import Path
+from collections.abc import Mapping
 
 def _iter_entry_points_group__pkg_resources(group):
 	""" This is the old version, everyone loved, (or not)
@@ -42,5 +49,173 @@ def load_entry_points_group(group):
 		(entry.name, entry.load())
 		for entry in entry_points_group(group)
 	)
-		
+
+def _entry_point_value(entry):
+	""" The 'module:attr' the entry point refers to.
+	pkg_resources entry points have no 'value' attribute."""
+	value = getattr(entry, 'value', None)
+	if value is not None:
+		return value
+	return str(entry).split('=', 1)[1].strip()
+
+def _cache_dir():
+	""" Directory to keep the entry points cache, None if disabled.
+	CUSTOMBLOCKS_CACHE_DIR environment variable overrides it,
+	and an empty value disables the cache."""
+	path = os.environ.get('CUSTOMBLOCKS_CACHE_DIR')
+	if path is not None:
+		return Path(path) if path else None
+	if sys.platform == 'win32' and os.environ.get('LOCALAPPDATA'):
+		base = Path(os.environ['LOCALAPPDATA'])
+	else:
+		base = Path(os.environ.get('XDG_CACHE_HOME') or Path.home()/'.cache')
+	return base / 'markdown-customblocks'
+
+def _mtime(path):
+	try:
+		return os.stat(path).st_mtime_ns
+	except OSError:
+		return None
+
+def _distribution_stamp(entry):
+	""" Modification times of a dist-info/egg-info directory
+	and its entry_points.txt, which legacy and editable installs
+	may rewrite in place, keeping the directory untouched."""
+	return (
+		entry.name,
+		entry.stat().st_mtime_ns,
+		_mtime(os.path.join(entry.path, 'entry_points.txt')),
+	)
+
+def _metadata_fingerprint(path=None):
+	""" Hash of the distribution metadata found in the import path.
+	It changes when any distribution is installed, removed or upgraded,
+	since their dist-info directory is created anew,
+	or when its entry points are rewritten.
+	Much cheaper than reading the metadata itself."""
+	items = []
+	for entry in sys.path if path is None else path:
+		directory = os.path.abspath(entry or '.')
+		try:
+			with os.scandir(directory) as children:
+				dists = sorted(
+					_distribution_stamp(child)
+					for child in children
+					if child.name.endswith(('.dist-info', '.egg-info'))
+				)
+		except OSError: # not a directory: zips, path hooks...
+			continue
+		if dists:
+			items.append((directory, dists))
+	key = repr((sys.version, items)).encode('utf8')
+	return hashlib.sha256(key).hexdigest()
+
+class _CachedEntryPoint(object):
+	""" Entry point restored from the cache.
+	Loads without importing importlib.metadata."""
+
+	def __init__(self, name, value):
+		self.name = name
+		self.value = value
+
+	def load(self):
+		import importlib
+		spec = self.value.split('[')[0] # drop extras
+		modulename, _, attrs = spec.partition(':')
+		result = importlib.import_module(modulename.strip())
+		for attr in attrs.strip().split('.') if attrs.strip() else []:
+			result = getattr(result, attr)
+		return result
+
+def cached_entry_points_group(group):
+	""" Like entry_points_group, but the entry points found are kept
+	on disk and reused, without scanning the distributions metadata,
+	while the fingerprint of the installed distributions is the same."""
+	cachedir = _cache_dir()
+	if cachedir is None:
+		return list(entry_points_group(group))
+	cachefile = cachedir / 'entrypoints-{}.json'.format(group)
+	fingerprint = _metadata_fingerprint()
+	try:
+		cached = json.loads(cachefile.read_text(encoding='utf8'))
+		if cached['fingerprint'] == fingerprint:
+			return [
+				_CachedEntryPoint(name, value)
+				for name, value in cached['entries']
+			]
+	except (OSError, ValueError, KeyError, TypeError):
+		pass # missing or corrupted, rebuild it
+
+	entries = list(entry_points_group(group))
+	content = json.dumps(dict(
+		fingerprint=fingerprint,
+		entries=[[entry.name, _entry_point_value(entry)] for entry in entries],
+	))
+	try:
+		cachedir.mkdir(parents=True, exist_ok=True)
+		# Atomic replace, concurrent processes may be reading it
+		with tempfile.NamedTemporaryFile('w', encoding='utf8',
+				dir=str(cachedir), suffix='.tmp', delete=False) as tmp:
+			tmp.write(content)
+		os.replace(tmp.name, str(cachefile))
+	except OSError:
+		pass # read only, just do not cache
+	return entries
+
+class LazyEntryPoints(Mapping):
+	""" Read-only mapping from the names of the entry points in a group
+	to the objects they refer. Each entry point is loaded just
+	the first time it is looked up, so unused plugins are not imported.
+	Entries, if not provided, are taken from entry_points_group.
+	"""
+
+	def __init__(self, group, entries=None):
+		self.group = group
+		self._entries = {}
+		self._loaded = {}
+		if entries is None:
+			entries = entry_points_group(group)
+		for entry in entries:
+			previous = self._entries.get(entry.name)
+			if previous is not None:
+				self._warn_conflict(entry.name, previous, entry)
+			self._entries[entry.name] = entry
+
+	def _warn_conflict(self, name, previous, entry):
+		previous, value = _entry_point_value(previous), _entry_point_value(entry)
+		if previous == value: return
+		warnings.warn(
+			"Entry point '{}' in group '{}' defined twice, "
+			"'{}' overrides '{}'"
+			.format(name, self.group, value, previous))
+
+	def spec(self, name):
+		""" The 'module:attr' string the entry point refers to """
+		return _entry_point_value(self._entries[name])
+
+	def __getitem__(self, name):
+		try:
+			return self._loaded[name]
+		except KeyError:
+			pass
+		entry = self._entries[name]
+		try:
+			value = entry.load()
+		except (ImportError, AttributeError) as e:
+			raise ImportError(
+				"Unable to load entry point '{} = {}' in group '{}': {}"
+				.format(name, _entry_point_value(entry), self.group, e)
+			) from e
+		self._loaded[name] = value
+		return value
+
+	def __contains__(self, name):
+		# Unlike Mapping's, does not load the entry point
+		return name in self._entries
+
+	def __iter__(self):
+		return iter(self._entries)
+
+	def __len__(self):
+		return len(self._entries)
 
@@ -0,0 +1,233 @@
+import unittest
+import os
+from unittest import mock
+from importlib.metadata import EntryPoint
+from .testutils import temp_path
+from .entrypoints import LazyEntryPoints
+from .entrypoints import cached_entry_points_group, _metadata_fingerprint
+
+group = 'markdown.customblocks.generators'
+
+class LazyEntryPoints_Test(unittest.TestCase):
+
+    def lazy(self, **specs):
+        entries = [
+            EntryPoint(name, value, group)
+            for name, value in specs.items()
+        ]
+        return self.lazyFromEntries(entries)
+
+    def lazyFromEntries(self, entries):
+        with mock.patch('customblocks.entrypoints.entry_points_group',
+                return_value=entries):
+            return LazyEntryPoints(group)
+
+    def test_getitem_loadsTheEntryPoint(self):
+        from .generators import youtube
+        entries = self.lazy(youtube='customblocks.generators:youtube')
+        self.assertIs(entries['youtube'], youtube)
+
+    def test_getitem_unknown(self):
+        entries = self.lazy(youtube='customblocks.generators:youtube')
+        with self.assertRaises(KeyError):
+            entries['unknown']
+
+    def test_loadsJustOnLookup(self):
+        entries = self.lazy(
+            youtube='customblocks.generators:youtube',
+            broken='nonexistingmodule:generator',
+        )
+        with mock.patch.object(EntryPoint, 'load', autospec=True,
+                side_effect=lambda entry: entry.name) as load:
+            self.assertEqual(entries['youtube'], 'youtube')
+            self.assertEqual(entries['youtube'], 'youtube')
+        load.assert_called_once()
+
+    def test_contains_doesNotLoad(self):
+        entries = self.lazy(broken='nonexistingmodule:generator')
+        self.assertIn('broken', entries)
+        self.assertNotIn('unknown', entries)
+
+    def test_iteration_doesNotLoad(self):
+        entries = self.lazy(
+            broken='nonexistingmodule:generator',
+            youtube='customblocks.generators:youtube',
+        )
+        self.assertEqual(sorted(entries), ['broken', 'youtube'])
+        self.assertEqual(len(entries), 2)
+
+    def test_spec(self):
+        entries = self.lazy(youtube='customblocks.generators:youtube')
+        self.assertEqual(entries.spec('youtube'), 'customblocks.generators:youtube')
+
+    def test_missingModule_clearError(self):
+        entries = self.lazy(broken='nonexistingmodule:generator')
+        with self.assertRaises(ImportError) as ctx:
+            entries['broken']
+        self.assertEqual(format(ctx.exception),
+            "Unable to load entry point 'broken = nonexistingmodule:generator' "
+            "in group 'markdown.customblocks.generators': "
+            "No module named 'nonexistingmodule'")
+
+    def test_missingAttribute_clearError(self):
+        entries = self.lazy(broken='customblocks.generators:nonexisting')
+        with self.assertRaises(ImportError) as ctx:
+            entries['broken']
+        self.assertIn(
+            "Unable to load entry point 'broken = customblocks.generators:nonexisting'",
+            format(ctx.exception))
+
+    def test_conflict_warnsAndLastWins(self):
+        with self.assertWarns(UserWarning) as ctx:
+            entries = self.lazyFromEntries([
+                EntryPoint('video', 'customblocks.generators:youtube', group),
+                EntryPoint('video', 'customblocks.generators:vimeo', group),
+            ])
+        self.assertEqual(format(ctx.warning),
+            "Entry point 'video' in group 'markdown.customblocks.generators' "
+            "defined twice, 'customblocks.generators:vimeo' "
+            "overrides 'customblocks.generators:youtube'")
+        self.assertEqual(entries.spec('video'), 'customblocks.generators:vimeo')
+
+    def test_sameEntryTwice_noWarning(self):
+        with mock.patch('warnings.warn') as warn:
+            self.lazyFromEntries([
+                EntryPoint('video', 'customblocks.generators:youtube', group),
+                EntryPoint('video', 'customblocks.generators:youtube', group),
+            ])
+        warn.assert_not_called()
+
+class CachedEntryPointsGroup_Test(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = temp_path()
+        self.cachedir = self._temp.__enter__() / 'cache'
+        self._env = mock.patch.dict(os.environ,
+            CUSTOMBLOCKS_CACHE_DIR=str(self.cachedir))
+        self._env.start()
+
+    def tearDown(self):
+        self._env.stop()
+        self._temp.__exit__(None, None, None)
+
+    def scan(self, **specs):
+        """Mocks the metadata scan to find the given entry points"""
+        return mock.patch('customblocks.entrypoints.entry_points_group',
+            return_value=[
+                EntryPoint(name, value, group)
+                for name, value in specs.items()
+            ])
+
+    def asTuples(self, entries):
+        return [(entry.name, entry.value) for entry in entries]
+
+    def test_firstTime_scansAndStores(self):
+        with self.scan(youtube='customblocks.generators:youtube') as scan:
+            entries = cached_entry_points_group(group)
+        scan.assert_called_once_with(group)
+        self.assertEqual(self.asTuples(entries), [
+            ('youtube', 'customblocks.generators:youtube'),
+        ])
+        self.assertTrue((self.cachedir / ('entrypoints-'+group+'.json')).exists())
+
+    def test_secondTime_avoidsScanning(self):
+        with self.scan(youtube='customblocks.generators:youtube'):
+            cached_entry_points_group(group)
+        with self.scan() as scan:
+            entries = cached_entry_points_group(group)
+        scan.assert_not_called()
+        self.assertEqual(self.asTuples(entries), [
+            ('youtube', 'customblocks.generators:youtube'),
+        ])
+
+    def test_cachedEntries_load(self):
+        from .generators import youtube
+        with self.scan(youtube='customblocks.generators:youtube'):
+            cached_entry_points_group(group)
+        [entry] = cached_entry_points_group(group)
+        self.assertIs(entry.load(), youtube)
+
+    def test_cachedEntries_lazyMapping(self):
+        with self.scan(youtube='customblocks.generators:youtube'):
+            cached_entry_points_group(group)
+        entries = LazyEntryPoints(group, cached_entry_points_group(group))
+        self.assertEqual(entries.spec('youtube'), 'customblocks.generators:youtube')
+
+    def test_fingerprintChanged_scansAgain(self):
+        with self.scan(youtube='customblocks.generators:youtube'):
+            cached_entry_points_group(group)
+        with self.scan(vimeo='customblocks.generators:vimeo') as scan, \
+                mock.patch('customblocks.entrypoints._metadata_fingerprint',
+                    return_value='changed'):
+            entries = cached_entry_points_group(group)
+        scan.assert_called_once_with(group)
+        self.assertEqual(self.asTuples(entries), [
+            ('vimeo', 'customblocks.generators:vimeo'),
+        ])
+
+    def test_corruptedCache_scansAgain(self):
+        self.cachedir.mkdir(parents=True)
+        (self.cachedir / ('entrypoints-'+group+'.json')).write_text('{bad json')
+        with self.scan(youtube='customblocks.generators:youtube') as scan:
+            cached_entry_points_group(group)
+        scan.assert_called_once_with(group)
+        with self.scan() as rescan:
+            entries = cached_entry_points_group(group)
+        rescan.assert_not_called()
+        self.assertEqual(self.asTuples(entries), [
+            ('youtube', 'customblocks.generators:youtube'),
+        ])
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, CUSTOMBLOCKS_CACHE_DIR=''):
+            with self.scan(youtube='customblocks.generators:youtube') as scan:
+                cached_entry_points_group(group)
+                cached_entry_points_group(group)
+        self.assertEqual(scan.call_count, 2)
+        self.assertFalse(self.cachedir.exists())
+
+    def test_fingerprint_stable(self):
+        path = [str(self.cachedir)]
+        self.cachedir.mkdir()
+        (self.cachedir / 'package-1.0.dist-info').mkdir()
+        self.assertEqual(_metadata_fingerprint(path), _metadata_fingerprint(path))
+
+    def test_fingerprint_changesOnInstall(self):
+        path = [str(self.cachedir)]
+        self.cachedir.mkdir()
+        (self.cachedir / 'package-1.0.dist-info').mkdir()
+        before = _metadata_fingerprint(path)
+        (self.cachedir / 'other-1.0.dist-info').mkdir()
+        self.assertNotEqual(_metadata_fingerprint(path), before)
+
+    def test_fingerprint_changesOnUpgrade(self):
+        path = [str(self.cachedir)]
+        self.cachedir.mkdir()
+        (self.cachedir / 'package-1.0.dist-info').mkdir()
+        before = _metadata_fingerprint(path)
+        (self.cachedir / 'package-1.0.dist-info').rmdir()
+        (self.cachedir / 'package-1.1.dist-info').mkdir()
+        self.assertNotEqual(_metadata_fingerprint(path), before)
+
+    def test_fingerprint_changesOnEntryPointsRewritten(self):
+        path = [str(self.cachedir)]
+        egginfo = self.cachedir / 'package.egg-info'
+        egginfo.mkdir(parents=True)
+        entrypoints = egginfo / 'entry_points.txt'
+        entrypoints.write_text('[{}]\n'.format(group))
+        before = _metadata_fingerprint(path)
+        dirtime = egginfo.stat().st_mtime_ns
+        entrypoints.write_text('[{}]\nyoutube = customblocks.generators:youtube\n'.format(group))
+        mtime = entrypoints.stat().st_mtime_ns + 10**9
+        os.utime(str(entrypoints), ns=(mtime, mtime))
+        os.utime(str(egginfo), ns=(dirtime, dirtime)) # rewritten in place
+        self.assertNotEqual(_metadata_fingerprint(path), before)
+
+    def test_fingerprint_ignoresDirsWithoutDistributions(self):
+        self.cachedir.mkdir()
+        self.assertEqual(
+            _metadata_fingerprint([str(self.cachedir), '/nonexisting', 'path_hook']),
+            _metadata_fingerprint([]),
+        )
+
+# vim: et ts=4 sw=4
@@ -1,11 +1,8 @@
-from bs4 import BeautifulSoup
-from yamlns import namespace as ns
 import uuid
 import warnings
-from .utils import image
 from .utils import E, Markdown
-from .utils import PageInfo
-from .utils import Fetcher
+# Heavy dependencies (bs4, PIL, magic, requests...) are imported
+# by the generators using them, not to slow down startup
 
 def container(ctx, *args, **kwds):
     args = [ '-'.join(arg.split()) for arg in args ]
@@ -70,6 +67,7 @@ def figure(
                 self._value = self._f()
             return self._value
 
+    from .utils import image
     localsrc = Dependency(lambda: image.local(url, target="cached_images"))
     sizedsrc = Dependency(lambda: image.thumbnail(localsrc(), *parseSize(thumb)))
     encodedsrc = Dependency(lambda: image.embed(localsrc()))
@@ -115,8 +113,18 @@ def figure(
         **kwds
     )
 
+def _figureWarmup():
+    from .utils import image
+
+figure.warmup = _figureWarmup
+
+def _linkcardFetcher():
+    from .utils import Fetcher
+    return Fetcher('fetchercache/linkcard') # TODO: Configurable
+
 def linkcard(ctx, url, *args, wideimage=True, **overrides):
-    fetcher = Fetcher('fetchercache/linkcard') # TODO: Configurable
+    from .utils import PageInfo
+    fetcher = _linkcardFetcher()
     response = fetcher.get(url)
 
     info = PageInfo(response.text, url, **overrides)
@@ -153,6 +161,17 @@ def linkcard(ctx, url, *args, wideimage=True, **overrides):
         ),
     )
 
+def _linkcardPrefetch(ctx, url, *args, **kwds):
+    yield _linkcardFetcher(), url
+
+linkcard.prefetch = _linkcardPrefetch
+
+def _linkcardWarmup():
+    from .utils import PageInfo
+    _linkcardFetcher()
+
+linkcard.warmup = _linkcardWarmup
+
 
 def youtube(ctx, id, *args, autoplay=False, controls=True, loop=False, style=None, **kwds):
     options = []
@@ -272,7 +291,7 @@ def goteo(ctx, id):
         scrolling="no",
     )
 
-def twitter(user,
+def _twitterOembedUrl(user,
     tweet=None,
     theme=None,
     hideimages=False,
@@ -284,17 +303,41 @@ def twitter(user,
     options += '&cards=hidden' if hideimages else ''
     options += f'&align={align}' if align in ('right', 'center', 'left') else ''
     options += f'&conversation=none' if not conversation else ''
-
-    fetcher = Fetcher('fetchercache/twitter')
-    oembedurl = (
+    return (
         f'https://publish.twitter.com/oembed?'
         f'url=https://twitter.com/{user}/status/{tweet}&dnt=True{options}'
     )
+
+def twitter(user,
+    tweet=None,
+    theme=None,
+    hideimages=False,
+    align=None,
+    conversation=False,
+):
+    from bs4 import BeautifulSoup
+    from yamlns import namespace as ns
+    from .utils import Fetcher
+    fetcher = Fetcher('fetchercache/twitter')
+    oembedurl = _twitterOembedUrl(user, tweet, theme, hideimages, align, conversation)
     response = fetcher.get(oembedurl)
     result = ns(response.json())
     soup = BeautifulSoup(result.html, 'html.parser')
     return type(u'')(soup.find('blockquote'))
 
+def _twitterPrefetch(*args, **kwds):
+    from .utils import Fetcher
+    yield Fetcher('fetchercache/twitter'), _twitterOembedUrl(*args, **kwds)
+
+twitter.prefetch = _twitterPrefetch
+
+def _twitterWarmup():
+    from bs4 import BeautifulSoup
+    from .utils import Fetcher
+    Fetcher('fetchercache/twitter')
+
+twitter.warmup = _twitterWarmup
+
 def mastodon(ctx, instance, user, post):
     # TODO: For future prove using oembed https://{instance}/api/oembed
     # TODO: Or taking the post info from here https://{instance}/api/v1/statuses/{id}
@@ -373,9 +416,23 @@ def map(ctx, location=None, marker=True, *args, **kwds):
         **kwds
     )
 
-def wikipedia(ctx, lemma, *args, lang=None, wideimage=False, **kwds):
+def _mapWarmup():
+    import geocoder
+
+map.warmup = _mapWarmup
+
+def _wikipediaUrl(lemma, lang=None):
     lang = lang or 'en'
-    wiki_url = f'https://{lang}.wikipedia.org/wiki/{lemma}'
+    return f'https://{lang}.wikipedia.org/wiki/{lemma}'
+
+def wikipedia(ctx, lemma, *args, lang=None, wideimage=False, **kwds):
+    wiki_url = _wikipediaUrl(lemma, lang)
     return linkcard(ctx, wiki_url, 'wikipedia', wideimage=wideimage, *args, **kwds)
 
+def _wikipediaPrefetch(ctx, lemma, *args, lang=None, **kwds):
+    yield _linkcardFetcher(), _wikipediaUrl(lemma, lang)
+
+wikipedia.prefetch = _wikipediaPrefetch
+wikipedia.warmup = _linkcardWarmup
+
 # vim: et ts=4 sw=4
@@ -9,6 +9,7 @@ from pathlib import Path
 from PIL import Image, ImageDraw
 import base64
 from .utils import image
+from .generators import linkcard, wikipedia, twitter
 
 class Generators_Test(test_tools.TestCase):
 
@@ -29,6 +30,14 @@ class Generators_Test(test_tools.TestCase):
                 .update(kwds)
         )
 
+    def setupExtension(self, **kwds):
+        (
+            self.default_kwargs
+                .setdefault('extension_configs',{})
+                .setdefault('customblocks', {})
+                .update(kwds)
+        )
+
     def assertMarkdown(self, markdown, html, **kwds):
         self.assertMarkdownRenders(
             self.dedent(markdown),
@@ -483,6 +492,39 @@ La nueva renta mínima estatal se tramitará como proyecto de ley, para que los
 </div>
 """)
 
+    def test_linkcard_prefetch(self):
+        with sandbox_dir():
+            [(fetcher, url)] = linkcard.prefetch(None, 'https://example.com/page', 'aclass')
+        self.assertEqual(fetcher.cachedir, Path('fetchercache/linkcard'))
+        self.assertEqual(url, 'https://example.com/page')
+
+    @responses.activate
+    def test_linkcard_prefetched(self):
+        self.setupResponse()
+        self.setupExtension(prefetch=4)
+        with sandbox_dir():
+            markdown(self.dedent("""
+                ::: linkcard https://www.eldiario.es/economia/Congreso-decreto-ingreso-minimo-vital_0_1036596743.html
+
+                ::: linkcard https://www.eldiario.es/economia/Congreso-decreto-ingreso-minimo-vital_0_1036596743.html
+                """), **self.default_kwargs)
+        self.assertEqual(len(responses.calls), 1)
+
+    def test_wikipedia_prefetch(self):
+        with sandbox_dir():
+            [(fetcher, url)] = wikipedia.prefetch(None, 'Lemma', lang='ca')
+        self.assertEqual(fetcher.cachedir, Path('fetchercache/linkcard'))
+        self.assertEqual(url, 'https://ca.wikipedia.org/wiki/Lemma')
+
+    def test_twitter_prefetch(self):
+        with sandbox_dir():
+            [(fetcher, url)] = twitter.prefetch('user', '1234', theme='dark')
+        self.assertEqual(fetcher.cachedir, Path('fetchercache/twitter'))
+        self.assertEqual(url,
+            'https://publish.twitter.com/oembed?'
+            'url=https://twitter.com/user/status/1234&dnt=True'
+            '&theme=dark&conversation=none'
+        )
 
     def sample_image(self, imagefile):
         with Image.new(mode='RGB', size=(1920,1080), color="pink") as im:
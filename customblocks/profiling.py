@@ -0,0 +1,196 @@
+"""
+Per block type profiling of the generators,
+with cProfile for cpu and tracemalloc for memory.
+"""
+
+import io
+import os
+import atexit
+import fnmatch
+import threading
+import cProfile
+import pstats
+import tracemalloc
+import warnings
+from collections import Counter
+from pathlib import Path
+
+class Profiler:
+    """Profiles generator calls and aggregates the results per block type.
+
+    Cpu profiles are exclusive: while a nested block is rendered,
+    the profile of the outer block is paused,
+    since just a single profiler can be active at once.
+    Memory is inclusive: allocations of nested blocks
+    also count for the outer block,
+    and so do the ones of other threads converting meanwhile.
+    Conversions in several threads are profiled separately
+    and aggregated on report.
+    Async generators are profiled just while creating the coroutine,
+    not while it is awaited, interleaved with others in the event loop.
+    """
+
+    def __init__(self, cpu=True, memory=False, top=20):
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.counts = Counter()
+        self._profiles = {} # blocktype: {thread id: profile}
+        self._allocations = {}
+        self._running = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._startedTracing = False
+
+    @property
+    def _stack(self):
+        """Profiles active in the current thread, innermost last"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def call(self, blocktype, generator, args, kwds):
+        """Calls the generator profiling it as blocktype"""
+        with self._lock:
+            self.counts[blocktype] += 1
+        stack = self._stack
+        outer = stack[-1] if stack else None
+        if outer is not None:
+            outer.disable() # keep our own overhead out of it
+        profile = None
+        try:
+            before = self._snapshot() if self.memory else None
+            if self.cpu:
+                profile = self._enable(blocktype)
+            try:
+                return generator(*args, **kwds)
+            finally:
+                if profile is not None:
+                    stack.pop().disable()
+                    with self._lock:
+                        self._running.discard(profile)
+                if before is not None:
+                    self._accountMemory(blocktype, before)
+        finally:
+            if outer is not None:
+                outer.enable()
+
+    def _enable(self, blocktype):
+        with self._lock:
+            profiles = self._profiles.setdefault(blocktype, {})
+            profile = profiles.get(threading.get_ident())
+            if profile is None:
+                profile = profiles[threading.get_ident()] = cProfile.Profile()
+            self._running.add(profile)
+        try:
+            profile.enable()
+        except ValueError as e: # another profiler is active
+            with self._lock:
+                self._running.discard(profile)
+            warnings.warn("Unable to profile block '{}': {}".format(blocktype, e))
+            return None
+        self._stack.append(profile)
+        return profile
+
+    def _snapshot(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+        return tracemalloc.take_snapshot()
+
+    _ignoredFiles = {
+        tracemalloc.__file__,
+        fnmatch.__file__,
+        __file__,
+    }
+
+    def _accountMemory(self, blocktype, before):
+        after = self._snapshot()
+        diff = Counter()
+        for stat in after.compare_to(before, 'lineno'):
+            if stat.size_diff <= 0: continue
+            frame = stat.traceback[0]
+            if frame.filename in self._ignoredFiles: continue
+            diff[str(frame)] += stat.size_diff
+        with self._lock:
+            self._allocations.setdefault(blocktype, Counter()).update(diff)
+
+    def _stats(self, blocktype, stream=None):
+        """Stats of the block type aggregated along threads,
+        None if it is still running"""
+        with self._lock:
+            profiles = list(self._profiles[blocktype].values())
+            if self._running.intersection(profiles):
+                return None
+        return pstats.Stats(*profiles, stream=stream)
+
+    def cpuReport(self, blocktype):
+        """Text report of the top functions by cumulative time"""
+        output = io.StringIO()
+        stats = self._stats(blocktype, stream=output)
+        if stats is None:
+            return ''
+        stats.sort_stats('cumulative').print_stats(self.top)
+        return output.getvalue()
+
+    def memoryReport(self):
+        """Text report of the top allocating lines for each block type"""
+        lines = []
+        for blocktype in sorted(self._allocations):
+            allocations = self._allocations[blocktype]
+            lines.append("{}: {} blocks, {:.1f} KiB allocated".format(
+                blocktype,
+                self.counts[blocktype],
+                sum(allocations.values()) / 1024,
+            ))
+            lines += [
+                "    {:>10.1f} KiB  {}".format(size / 1024, location)
+                for location, size in allocations.most_common(self.top)
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, directory):
+        """Writes a pstats file and a text report for each block type,
+        and the memory report, into the directory"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for blocktype in list(self._profiles):
+            stats = self._stats(blocktype)
+            if stats is None: continue # still running
+            stats.dump_stats(str(directory / (blocktype + '.pstats')))
+            (directory / (blocktype + '.txt')).write_text(
+                self.cpuReport(blocktype), encoding='utf8')
+        if self.memory:
+            (directory / 'memory.txt').write_text(
+                self.memoryReport(), encoding='utf8')
+
+    def close(self):
+        """Stops memory tracing if it was started by the profiler"""
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+_profilers = {}
+
+def profiler(directory, cpu=True, memory=False, top=20):
+    """Process wide profiler for the directory,
+    so that results aggregate along a whole build,
+    even if every document uses a new extension.
+    The directory is resolved now, results are written on exit."""
+    key = os.path.abspath(directory), cpu, memory, top
+    if key not in _profilers:
+        _profilers[key] = Profiler(cpu=cpu, memory=memory, top=top)
+    return _profilers[key]
+
+@atexit.register
+def finish():
+    """Writes the results of the process wide profilers
+    into their directories and closes them.
+    Called on exit, call it to get the results before."""
+    while _profilers:
+        (directory, cpu, memory, top), profiler = _profilers.popitem()
+        profiler.dump(directory)
+        profiler.close()
+
+# vim: et ts=4 sw=4
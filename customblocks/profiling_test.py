@@ -0,0 +1,180 @@
+import unittest
+import threading
+import pstats
+import tracemalloc
+import markdown
+from .testutils import sandbox_dir, working_dir
+from . import profiling
+from .profiling import Profiler
+from .customblocks import CustomBlocksExtension
+from .utils import E, Markdown
+
+kept = []
+
+def allocating(ctx):
+    kept.append([bytearray(1000) for i in range(100)])
+    return E('div', ctx.content)
+
+def outer(ctx):
+    return E('div', Markdown(ctx.content, ctx.parser))
+
+bothInside = threading.Barrier(2, timeout=1)
+
+def waiting(ctx):
+    bothInside.wait()
+    return E('div', Markdown(ctx.content, ctx.parser))
+
+class Profiling_Test(unittest.TestCase):
+
+    def tearDown(self):
+        for profiler in profiling._profilers.values():
+            profiler.close()
+        profiling._profilers.clear()
+
+    def convert(self, text, finish=True, **kwds):
+        md = markdown.Markdown(extensions=[
+            CustomBlocksExtension(
+                generators=dict(
+                    allocating=allocating,
+                    outer=outer,
+                    waiting=waiting,
+                ),
+                **kwds
+            ),
+        ])
+        result = md.convert(text)
+        if finish:
+            profiling.finish()
+        return result
+
+    def functions(self, pstatsfile):
+        stats = pstats.Stats(str(pstatsfile))
+        return set(name for _, _, name in stats.stats)
+
+    def test_disabledByDefault(self):
+        with sandbox_dir() as tmp:
+            self.convert("::: allocating\n    content")
+            self.assertEqual(list(tmp.iterdir()), [])
+
+    def test_cpu_pstatsPerBlockType(self):
+        with sandbox_dir() as tmp:
+            self.convert(
+                "::: allocating\n    content\n\n"
+                "::: allocating\n    content\n",
+                profile='cpu',
+                profile_dir=str(tmp/'profile'),
+            )
+            self.assertEqual(sorted(p.name for p in (tmp/'profile').iterdir()), [
+                'allocating.pstats',
+                'allocating.txt',
+            ])
+            self.assertIn('allocating', self.functions(tmp/'profile'/'allocating.pstats'))
+            self.assertIn('allocating', (tmp/'profile'/'allocating.txt').read_text(encoding='utf8'))
+
+    def test_cpu_nestedBlocks_exclusive(self):
+        with sandbox_dir() as tmp:
+            self.convert(
+                "::: outer\n    ::: allocating\n        content\n",
+                profile='cpu',
+                profile_dir=str(tmp/'profile'),
+            )
+            outerFunctions = self.functions(tmp/'profile'/'outer.pstats')
+            self.assertIn('outer', outerFunctions)
+            self.assertNotIn('allocating', outerFunctions)
+            self.assertIn('allocating', self.functions(tmp/'profile'/'allocating.pstats'))
+
+    def test_cpu_aggregatesAlongConversions(self):
+        with sandbox_dir() as tmp:
+            for i in range(3):
+                self.convert("::: allocating\n    content",
+                    finish=False,
+                    profile='cpu',
+                    profile_dir=str(tmp/'profile'),
+                )
+            self.assertFalse((tmp/'profile').exists())
+            profiling.finish()
+            stats = pstats.Stats(str(tmp/'profile'/'allocating.pstats'))
+            [calls] = [
+                stat[1] for (_, _, name), stat in stats.stats.items()
+                if name == 'allocating'
+            ]
+            self.assertEqual(calls, 3)
+
+    def test_memory_report(self):
+        with sandbox_dir() as tmp:
+            self.convert("::: allocating\n    content",
+                profile='memory',
+                profile_dir=str(tmp/'profile'),
+            )
+            report = (tmp/'profile'/'memory.txt').read_text(encoding='utf8')
+            self.assertFalse((tmp/'profile'/'allocating.pstats').exists())
+        self.assertIn("allocating: 1 blocks", report)
+        self.assertIn("profiling_test.py:15", report)
+
+    def test_unknownMode(self):
+        with self.assertRaises(ValueError) as ctx:
+            self.convert("", profile='cpu,disk')
+        self.assertEqual(format(ctx.exception),
+            "Unknown profile mode: disk")
+
+    def test_cpu_concurrentConversions(self):
+        with sandbox_dir() as tmp:
+            def convert():
+                self.convert("::: waiting\n    ::: allocating\n        content\n",
+                    finish=False,
+                    profile='cpu',
+                    profile_dir=str(tmp/'profile'),
+                )
+            threads = [threading.Thread(target=convert) for i in range(2)]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            profiling.finish()
+            stats = pstats.Stats(str(tmp/'profile'/'allocating.pstats'))
+        [calls] = [
+            stat[1] for (_, _, name), stat in stats.stats.items()
+            if name == 'allocating'
+        ]
+        self.assertEqual(calls, 2)
+
+    def test_relativeDirectory_resolvedOnCreation(self):
+        with sandbox_dir() as tmp:
+            self.convert("::: allocating\n    content",
+                finish=False,
+                profile='cpu',
+                profile_dir='profile',
+            )
+            with working_dir(tmp.parent):
+                profiling.finish()
+            self.assertTrue((tmp/'profile'/'allocating.pstats').exists())
+
+    def test_finish_closesProfilers(self):
+        with sandbox_dir() as tmp:
+            self.convert("::: allocating\n    content",
+                finish=False,
+                profile='memory',
+                profile_dir=str(tmp/'profile'),
+            )
+            self.assertTrue(tracemalloc.is_tracing())
+            profiling.finish()
+            self.assertFalse(tracemalloc.is_tracing())
+            self.assertEqual(profiling._profilers, {})
+            self.assertTrue((tmp/'profile'/'memory.txt').exists())
+
+    def test_close_stopsTracingItStarted(self):
+        profiler = Profiler(cpu=False, memory=True)
+        profiler.call('allocating', len, ['abc'], {})
+        self.assertTrue(tracemalloc.is_tracing())
+        profiler.close()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_close_keepsTracingStartedOutside(self):
+        tracemalloc.start()
+        try:
+            profiler = Profiler(cpu=False, memory=True)
+            profiler.call('allocating', len, ['abc'], {})
+            profiler.close()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+import copy
+import threading
+
+class RenderCache:
+    """
+    LRU cache of the elements rendered by custom blocks.
+
+    Keys identify the block rendering inputs: type, headline,
+    content, config, metadata and generator. Cached elements
+    are deep copied on insertion and on retrieval, so later
+    changes on the document tree do not alter the cache.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns a copy of the elements cached for key or None if missing"""
+        with self._lock:
+            elements = self._entries.get(key)
+            if elements is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return [copy.deepcopy(element) for element in elements]
+
+    def put(self, key, elements):
+        """Stores a copy of the elements for the key,
+        evicting the least recently used entries if full."""
+        if self.maxsize <= 0:
+            return
+        elements = [copy.deepcopy(element) for element in elements]
+        with self._lock:
+            self._entries[key] = elements
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all the entries and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+_renderCaches = {}
+_renderCachesLock = threading.Lock()
+
+def sharedRenderCache(maxsize):
+    """Process wide cache of that size, shared by every Markdown instance
+    configured with it, so that it survives tools creating one per page"""
+    with _renderCachesLock:
+        if maxsize not in _renderCaches:
+            _renderCaches[maxsize] = RenderCache(maxsize)
+        return _renderCaches[maxsize]
+
+# vim: et ts=4 sw=4
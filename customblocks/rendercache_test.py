@@ -0,0 +1,68 @@
+import unittest
+from xml.etree import ElementTree as etree
+from .rendercache import RenderCache, sharedRenderCache
+
+class RenderCache_Test(unittest.TestCase):
+
+    def element(self, text):
+        element = etree.Element('div')
+        element.text = text
+        return element
+
+    def texts(self, elements):
+        return [element.text for element in elements]
+
+    def test_get_missing(self):
+        cache = RenderCache()
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_get_stored(self):
+        cache = RenderCache()
+        cache.put('key', [self.element('a'), self.element('b')])
+        self.assertEqual(self.texts(cache.get('key')), ['a', 'b'])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_put_storesACopy(self):
+        cache = RenderCache()
+        element = self.element('a')
+        cache.put('key', [element])
+        element.text = 'changed'
+        self.assertEqual(self.texts(cache.get('key')), ['a'])
+
+    def test_get_returnsACopy(self):
+        cache = RenderCache()
+        cache.put('key', [self.element('a')])
+        cache.get('key')[0].text = 'changed'
+        self.assertEqual(self.texts(cache.get('key')), ['a'])
+
+    def test_put_evictsLeastRecentlyUsed(self):
+        cache = RenderCache(maxsize=2)
+        cache.put('first', [self.element('1')])
+        cache.put('second', [self.element('2')])
+        cache.get('first')
+        cache.put('third', [self.element('3')])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual(self.texts(cache.get('first')), ['1'])
+
+    def test_put_zeroSize_disabled(self):
+        cache = RenderCache(maxsize=0)
+        cache.put('key', [self.element('a')])
+        self.assertIsNone(cache.get('key'))
+
+    def test_sharedRenderCache_perSize(self):
+        cache = sharedRenderCache(3)
+        self.assertIs(sharedRenderCache(3), cache)
+        self.assertIsNot(sharedRenderCache(4), cache)
+        self.assertEqual(cache.maxsize, 3)
+
+    def test_clear(self):
+        cache = RenderCache()
+        cache.put('key', [self.element('a')])
+        cache.get('key')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+# vim: et ts=4 sw=4
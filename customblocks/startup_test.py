@@ -0,0 +1,47 @@
+import unittest
+import subprocess
+import sys
+
+class Startup_Test(unittest.TestCase):
+
+    def importedModules(self, statement):
+        """
+        Runs the statement in a fresh interpreter and returns
+        the cumulative import time in us of every imported module.
+        """
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', statement],
+            capture_output=True, text=True, check=True,
+        )
+        modules = {}
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:'): continue
+            fields = line[len('import time:'):].split('|')
+            if not fields[0].strip().isdigit(): continue # header
+            modules[fields[2].strip()] = int(fields[1])
+        return modules
+
+    def assertNotImported(self, statement, *heavy):
+        modules = self.importedModules(statement)
+        imported = [
+            module for module in modules
+            if module.split('.')[0] in heavy
+        ]
+        self.assertEqual(imported, [])
+
+    def test_import_skipsHeavyDependencies(self):
+        self.assertNotImported("import customblocks",
+            'bs4', 'PIL', 'magic', 'requests', 'asyncio')
+
+    def test_simpleBlocks_skipHeavyDependencies(self):
+        self.assertNotImported(
+            "import markdown; "
+            "markdown.markdown('::: note\\n    *content*', extensions=['customblocks'])",
+            'bs4', 'PIL', 'magic', 'requests', 'asyncio')
+
+    def test_heavyDependencies_importedOnUse(self):
+        modules = self.importedModules(
+            "from customblocks.utils import Fetcher")
+        self.assertIn('requests', modules)
+
+# vim: et ts=4 sw=4
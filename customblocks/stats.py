@@ -0,0 +1,105 @@
+import threading
+
+class BlockTypeStats:
+    """Counters and timings, in seconds, of a single block type.
+    Times are inclusive: generation time of a block includes
+    the time of any block nested in its content."""
+
+    __slots__ = 'count', 'total', 'max'
+
+    def __init__(self):
+        self.count = 0
+        self.total = dict.fromkeys(Stats.phases, 0.)
+        self.max = dict.fromkeys(Stats.phases, 0.)
+
+    def __repr__(self):
+        return 'BlockTypeStats(count={}, total={})'.format(self.count, self.total)
+
+
+class Stats:
+    """Per block type counts and timings of the rendered blocks.
+
+    Phases are:
+    - parse: headline and content extraction
+    - bind: generator lookup and parameters binding
+    - generate: the generator call
+    - insert: inserting the result into the document
+    """
+
+    phases = 'parse', 'bind', 'generate', 'insert'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.types = {}
+
+    def _type(self, blocktype):
+        stats = self.types.get(blocktype)
+        if stats is None:
+            stats = self.types[blocktype] = BlockTypeStats()
+        return stats
+
+    def record(self, blocktype, **times):
+        """Accounts a rendered block with the time of each phase"""
+        with self._lock:
+            stats = self._type(blocktype)
+            stats.count += 1
+            for phase, elapsed in times.items():
+                stats.total[phase] += elapsed
+                if elapsed > stats.max[phase]:
+                    stats.max[phase] = elapsed
+
+    def add(self, blocktype, phase, elapsed):
+        """Adds time to a phase of an already recorded block"""
+        with self._lock:
+            stats = self._type(blocktype)
+            stats.total[phase] += elapsed
+            if elapsed > stats.max[phase]:
+                stats.max[phase] = elapsed
+
+    def reset(self):
+        with self._lock:
+            self.types = {}
+
+    def __getitem__(self, blocktype):
+        return self.types[blocktype]
+
+    def __iter__(self):
+        return iter(sorted(self.types))
+
+    def __len__(self):
+        return len(self.types)
+
+    def prometheus(self, prefix='customblocks'):
+        """Dumps the stats in Prometheus text exposition format"""
+        def label(value):
+            return (value
+                .replace('\\', '\\\\')
+                .replace('"', '\\"')
+                .replace('\n', '\\n')
+            )
+        with self._lock:
+            types = [(name, self.types[name]) for name in sorted(self.types)]
+        lines = [
+            '# HELP {}_blocks_total Rendered blocks.'.format(prefix),
+            '# TYPE {}_blocks_total counter'.format(prefix),
+        ] + [
+            '{}_blocks_total{{type="{}"}} {}'.format(prefix, label(name), stats.count)
+            for name, stats in types
+        ]
+        for metric, attribute, kind, help in (
+            ('seconds_total', 'total', 'counter', 'Cumulative time per phase.'),
+            ('seconds_max', 'max', 'gauge', 'Slowest block time per phase.'),
+        ):
+            lines += [
+                '# HELP {}_{} {}'.format(prefix, metric, help),
+                '# TYPE {}_{} {}'.format(prefix, metric, kind),
+            ] + [
+                '{}_{}{{type="{}",phase="{}"}} {!r}'.format(
+                    prefix, metric, label(name), phase,
+                    getattr(stats, attribute)[phase])
+                for name, stats in types
+                for phase in self.phases
+            ]
+        return '\n'.join(lines) + '\n'
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,82 @@
+import unittest
+from .stats import Stats
+
+class Stats_Test(unittest.TestCase):
+
+    def times(self, parse=0., bind=0., generate=0., insert=0.):
+        return dict(parse=parse, bind=bind, generate=generate, insert=insert)
+
+    def test_empty(self):
+        stats = Stats()
+        self.assertEqual(list(stats), [])
+        self.assertEqual(len(stats), 0)
+
+    def test_record_counts(self):
+        stats = Stats()
+        stats.record('note', **self.times())
+        stats.record('note', **self.times())
+        stats.record('figure', **self.times())
+        self.assertEqual(list(stats), ['figure', 'note'])
+        self.assertEqual(stats['note'].count, 2)
+        self.assertEqual(stats['figure'].count, 1)
+
+    def test_record_accumulatesAndKeepsMax(self):
+        stats = Stats()
+        stats.record('note', **self.times(parse=1., generate=3.))
+        stats.record('note', **self.times(parse=2., generate=1.))
+        self.assertEqual(stats['note'].total, self.times(parse=3., generate=4.))
+        self.assertEqual(stats['note'].max, self.times(parse=2., generate=3.))
+
+    def test_add_doesNotCount(self):
+        stats = Stats()
+        stats.record('note', **self.times(generate=1.))
+        stats.add('note', 'generate', 2.)
+        self.assertEqual(stats['note'].count, 1)
+        self.assertEqual(stats['note'].total['generate'], 3.)
+        self.assertEqual(stats['note'].max['generate'], 2.)
+
+    def test_reset(self):
+        stats = Stats()
+        stats.record('note', **self.times())
+        stats.reset()
+        self.assertEqual(list(stats), [])
+
+    def test_prometheus_empty(self):
+        stats = Stats()
+        self.assertEqual(stats.prometheus(),
+            '# HELP customblocks_blocks_total Rendered blocks.\n'
+            '# TYPE customblocks_blocks_total counter\n'
+            '# HELP customblocks_seconds_total Cumulative time per phase.\n'
+            '# TYPE customblocks_seconds_total counter\n'
+            '# HELP customblocks_seconds_max Slowest block time per phase.\n'
+            '# TYPE customblocks_seconds_max gauge\n'
+        )
+
+    def test_prometheus(self):
+        stats = Stats()
+        stats.record('note', **self.times(parse=0.5, bind=0.25, generate=2., insert=0.125))
+        self.assertEqual(stats.prometheus(prefix='md'),
+            '# HELP md_blocks_total Rendered blocks.\n'
+            '# TYPE md_blocks_total counter\n'
+            'md_blocks_total{type="note"} 1\n'
+            '# HELP md_seconds_total Cumulative time per phase.\n'
+            '# TYPE md_seconds_total counter\n'
+            'md_seconds_total{type="note",phase="parse"} 0.5\n'
+            'md_seconds_total{type="note",phase="bind"} 0.25\n'
+            'md_seconds_total{type="note",phase="generate"} 2.0\n'
+            'md_seconds_total{type="note",phase="insert"} 0.125\n'
+            '# HELP md_seconds_max Slowest block time per phase.\n'
+            '# TYPE md_seconds_max gauge\n'
+            'md_seconds_max{type="note",phase="parse"} 0.5\n'
+            'md_seconds_max{type="note",phase="bind"} 0.25\n'
+            'md_seconds_max{type="note",phase="generate"} 2.0\n'
+            'md_seconds_max{type="note",phase="insert"} 0.125\n'
+        )
+
+    def test_prometheus_escapesLabels(self):
+        stats = Stats()
+        stats.record('a"b\\c', **self.times())
+        self.assertIn('md_blocks_total{type="a\\"b\\\\c"} 1\n',
+            stats.prometheus(prefix='md'))
+
+# vim: et ts=4 sw=4
@@ -108,5 +108,94 @@ def sandbox_dir():
         with working_dir(path):
             yield path
 
+@contextmanager
+def stand_in_server(pages):
+    """
+    Context manager that serves the pages dict in a local http server,
+    mapping paths to dicts with the 'body' and, optionally,
+    'status', 'content_type', 'etag', 'last_modified',
+    'headers', a dict of further response headers,
+    and 'delay', seconds to wait before answering.
+    Conditional requests matching the validators get a 304.
+    Every received request is appended as (path, headers)
+    to the `requests` attribute of the server,
+    and the address of the client to `clients`.
+    Connections are kept alive.
+    Pages can be changed while serving.
+
+    >>> import requests
+    >>> with stand_in_server({'/page': dict(body='hello', etag='"v1"')}) as server:
+    ...     requests.get(server.url('/page')).text
+    ...     requests.get(server.url('/page'), headers={'If-None-Match': '"v1"'}).status_code
+    ...     requests.get(server.url('/missing')).status_code
+    ...     len(server.requests)
+    'hello'
+    304
+    404
+    3
+    """
+    import socket
+    import threading
+    import time
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            server.requests.append((self.path, dict(self.headers)))
+            server.clients.append(self.client_address)
+            server.connections.add(self.connection)
+            page = pages.get(self.path)
+            if page is None:
+                self.send_error(404)
+                return
+            time.sleep(page.get('delay', 0))
+            etag = page.get('etag')
+            lastModified = page.get('last_modified')
+            notModified = (
+                self.headers.get('If-None-Match') == etag
+                if etag and 'If-None-Match' in self.headers else
+                self.headers.get('If-Modified-Since') == lastModified
+                if lastModified and 'If-Modified-Since' in self.headers else
+                False
+            )
+            body = b'' if notModified else page['body'].encode('utf8')
+            self.send_response(304 if notModified else page.get('status', 200))
+            self.send_header('Content-Type',
+                page.get('content_type', 'text/html; charset=utf-8'))
+            self.send_header('Content-Length', str(len(body)))
+            if etag:
+                self.send_header('ETag', etag)
+            if lastModified:
+                self.send_header('Last-Modified', lastModified)
+            for header, value in page.get('headers', {}).items():
+                self.send_header(header, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    server.clients = []
+    server.connections = set()
+    server.url = lambda path: 'http://127.0.0.1:{}{}'.format(server.server_port, path)
+    thread = threading.Thread(target=server.serve_forever,
+        kwargs=dict(poll_interval=0.05), daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        for connection in server.connections: # the kept alive ones
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
 # vim: ts=4 sw=4 et
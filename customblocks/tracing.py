@@ -0,0 +1,173 @@
+"""
+Chrome trace-event tracing of conversions.
+
+Produces files that can be loaded in chrome://tracing
+or https://ui.perfetto.dev, offline.
+Instrumented code just checks a context variable when tracing is disabled.
+The active tracer is local to each thread and async task,
+so that concurrent conversions do not mix their events.
+"""
+
+import os
+import json
+import atexit
+import threading
+import contextvars
+import functools
+from time import perf_counter
+from contextlib import contextmanager
+
+# Tracer receiving the events, if any
+_active = contextvars.ContextVar('customblocks_tracer', default=None)
+_tracers = {} # Process wide tracers by file
+_tracersLock = threading.Lock()
+
+class Tracer:
+    """Writes trace events to a file as they happen,
+    using the JSON array format, so that the file is usable
+    even if it is not properly closed."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path) # lazily opened, maybe from elsewhere
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._file = None
+
+    def _write(self, event):
+        line = json.dumps(event)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'w', encoding='utf8')
+                self._file.write('[\n' + line)
+            else:
+                self._file.write(',\n' + line)
+
+    def complete(self, name, category, start, duration, args=None):
+        """Adds a span, start and duration in perf_counter seconds"""
+        event = dict(
+            name=name,
+            cat=category,
+            ph='X',
+            ts=start * 1e6,
+            dur=duration * 1e6,
+            pid=self._pid,
+            tid=threading.get_ident(),
+        )
+        if args:
+            event.update(args=args)
+        self._write(event)
+
+    def asyncSpan(self, name, category, id, start, duration, args=None):
+        """Adds a span that may overlap others in the same thread,
+        like the ones of concurrent coroutines"""
+        event = dict(
+            name=name,
+            cat=category,
+            id=id,
+            pid=self._pid,
+            tid=threading.get_ident(),
+        )
+        begin = dict(event, ph='b', ts=start * 1e6)
+        if args:
+            begin.update(args=args)
+        self._write(begin)
+        self._write(dict(event, ph='e', ts=(start + duration) * 1e6))
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Context manager adding a span for its block.
+        It yields the args dict so that the block can add more."""
+        start = perf_counter()
+        try:
+            yield args
+        finally:
+            self.complete(name, category, start, perf_counter() - start, args)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with _tracersLock:
+            if _tracers.get(self.path) is self:
+                del _tracers[self.path]
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'w', encoding='utf8')
+                self._file.write('[')
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+
+def active():
+    """The tracer receiving events, None if tracing is disabled"""
+    return _active.get()
+
+def activate(tracer):
+    """Sets the tracer receiving events in the current thread or task,
+    returns the previous one"""
+    previous = _active.get()
+    _active.set(tracer)
+    return previous
+
+def inContext(function):
+    """The function bound to the current context, so that,
+    called from other threads, it traces into the active tracer"""
+    return functools.partial(contextvars.copy_context().run, function)
+
+def tracer(path):
+    """Process wide tracer for the file, so that every conversion
+    of a build goes into it, even if every document uses a new extension.
+    Unless closed before, it is closed on exit."""
+    key = os.path.abspath(path)
+    with _tracersLock:
+        if key not in _tracers:
+            _tracers[key] = Tracer(path)
+        return _tracers[key]
+
+@atexit.register
+def _closeTracers():
+    for tracer in list(_tracers.values()):
+        tracer.close()
+
+@contextmanager
+def trace(path):
+    """Traces the conversions done in its block into the file"""
+    tracer = Tracer(path)
+    previous = activate(tracer)
+    try:
+        yield tracer
+    finally:
+        activate(previous)
+        tracer.close()
+
+class _NoSpan:
+    def __enter__(self):
+        return {}
+    def __exit__(self, *args):
+        return False
+
+_noSpan = _NoSpan()
+
+def span(name, category, **args):
+    """Context manager tracing its block, if tracing is enabled"""
+    tracer = _active.get()
+    if tracer is None:
+        return _noSpan
+    return tracer.span(name, category, **args)
+
+def traced(name, category):
+    """Decorator tracing every call to the function"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwds):
+            tracer = _active.get()
+            if tracer is None:
+                return f(*args, **kwds)
+            with tracer.span(name, category):
+                return f(*args, **kwds)
+        return wrapper
+    return decorator
+
+# vim: et ts=4 sw=4
@@ -0,0 +1,262 @@
+import unittest
+import json
+import threading
+import markdown
+import responses
+from pathlib import Path
+from PIL import Image
+from .testutils import sandbox_dir, working_dir
+from . import tracing
+from .customblocks import CustomBlocksExtension
+from .utils import Fetcher, PageInfo, E
+from .utils import image
+
+def failing(ctx):
+    raise ValueError("Failed")
+
+class Tracing_Test(unittest.TestCase):
+
+    def tearDown(self):
+        tracing._closeTracers()
+        tracing.activate(None)
+
+    def events(self, path):
+        return json.loads(Path(path).read_text(encoding='utf8'))
+
+    def spans(self, path, category):
+        return [
+            event for event in self.events(path)
+            if event['cat'] == category
+        ]
+
+    def test_disabled_byDefault(self):
+        self.assertIsNone(tracing.active())
+        with tracing.span('name', 'category') as args:
+            args.update(ignored=True)
+
+    def test_trace_activatesAndRestores(self):
+        with sandbox_dir():
+            with tracing.trace('trace.json') as tracer:
+                self.assertIs(tracing.active(), tracer)
+            self.assertIsNone(tracing.active())
+
+    def test_trace_emptyFileIsValid(self):
+        with sandbox_dir():
+            with tracing.trace('trace.json'):
+                pass
+            self.assertEqual(self.events('trace.json'), [])
+
+    def test_span(self):
+        with sandbox_dir():
+            with tracing.trace('trace.json'):
+                with tracing.span('myspan', 'mycategory', param='value') as args:
+                    args.update(result='done')
+            [event] = self.events('trace.json')
+        self.assertEqual(event['name'], 'myspan')
+        self.assertEqual(event['cat'], 'mycategory')
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['args'], dict(param='value', result='done'))
+        self.assertGreaterEqual(event['dur'], 0)
+
+    def test_unclosedTrace_readableAsArray(self):
+        with sandbox_dir():
+            tracer = tracing.Tracer('trace.json')
+            tracer.complete('first', 'category', 1., 1.)
+            tracer.complete('second', 'category', 2., 1.)
+            tracer.flush()
+            # Viewers accept the missing closing bracket
+            content = Path('trace.json').read_text(encoding='utf8')
+            events = json.loads(content + ']')
+            tracer.close()
+        self.assertEqual([event['name'] for event in events], ['first', 'second'])
+        self.assertEqual(events[1]['ts'], 2e6)
+
+    def test_asyncSpan(self):
+        with sandbox_dir():
+            with tracing.trace('trace.json') as tracer:
+                tracer.asyncSpan('myspan', 'category', 3, 1., 2.)
+            events = self.events('trace.json')
+        self.assertEqual(
+            [(event['ph'], event['id'], event['ts']) for event in events],
+            [('b', 3, 1e6), ('e', 3, 3e6)])
+
+    def test_traced(self):
+        @tracing.traced('myfunction', 'mycategory')
+        def myfunction(a, b):
+            return a + b
+        self.assertEqual(myfunction(1, 2), 3)
+        with sandbox_dir():
+            with tracing.trace('trace.json'):
+                self.assertEqual(myfunction(1, b=2), 3)
+            [event] = self.events('trace.json')
+        self.assertEqual(event['name'], 'myfunction')
+
+    def test_traceOption_nestedBlocks(self):
+        with sandbox_dir():
+            extension = CustomBlocksExtension(trace='trace.json')
+            markdown.markdown(
+                "::: note\n"
+                "    ::: container\n"
+                "        content\n",
+                extensions=[extension])
+            extension.tracer().close()
+            self.assertIsNone(tracing.active())
+            blocks = self.spans('trace.json', 'block')
+            [convert] = self.spans('trace.json', 'markdown')
+        inner, outer = blocks
+        self.assertEqual(outer['args'], dict(headline='::: note'))
+        self.assertEqual(inner['args'], dict(headline='::: container'))
+        # Nested spans
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['ts'] + outer['dur'], inner['ts'] + inner['dur'])
+        self.assertLessEqual(convert['ts'], outer['ts'])
+
+    def test_traceOption_sharedAmongExtensions(self):
+        with sandbox_dir():
+            first = CustomBlocksExtension(trace='trace.json')
+            second = CustomBlocksExtension(trace='./trace.json')
+            self.assertIs(first.tracer(), second.tracer())
+            markdown.markdown("::: note", extensions=[first])
+            markdown.markdown("::: note", extensions=[second])
+            first.tracer().close()
+            converts = self.spans('trace.json', 'markdown')
+        self.assertEqual(len(converts), 2)
+
+    def test_tracer_closedNotShared(self):
+        with sandbox_dir():
+            tracer = tracing.tracer('trace.json')
+            tracer.close()
+            self.assertIsNot(tracing.tracer('trace.json'), tracer)
+            tracing._closeTracers()
+
+    def failedConversion(self):
+        extension = CustomBlocksExtension(
+            trace='trace.json',
+            generators=dict(failing=failing),
+        )
+        md = markdown.Markdown(extensions=[extension])
+        with self.assertRaises(ValueError):
+            md.convert("::: failing")
+        self.assertIs(tracing.active(), extension.tracer())
+        return md
+
+    def test_traceOption_failedConversion_restoredOnReset(self):
+        with sandbox_dir():
+            md = self.failedConversion()
+            md.reset()
+            self.assertIsNone(tracing.active())
+            tracing._closeTracers()
+
+    def test_traceOption_failedConversion_restoredOnNextConversion(self):
+        with sandbox_dir():
+            md = self.failedConversion()
+            md.convert("::: note")
+            self.assertIsNone(tracing.active())
+            tracing._closeTracers()
+
+    def test_tracer_relativePathFixedOnCreation(self):
+        with sandbox_dir() as tmp:
+            tracer = tracing.Tracer('trace.json')
+            with working_dir(tmp.parent):
+                tracer.close()
+            self.assertEqual(self.events('trace.json'), [])
+
+    def test_traceOption_concurrentConversions_ownTraces(self):
+        # first starts, other starts, first ends, other ends
+        firstStarted = threading.Event()
+        otherStarted = threading.Event()
+        firstDone = threading.Event()
+        def first(ctx):
+            firstStarted.set()
+            otherStarted.wait(1)
+            return E('first')
+        def other(ctx):
+            otherStarted.set()
+            firstDone.wait(1)
+            return E('other')
+        def convert(name, after=None, done=None):
+            if after: after.wait(1)
+            extension = CustomBlocksExtension(
+                trace=name + '.json',
+                generators=dict(first=first, other=other),
+            )
+            markdown.markdown("::: " + name, extensions=[extension])
+            if done: done.set()
+        with sandbox_dir():
+            threads = [
+                threading.Thread(target=convert, args=('first', None, firstDone)),
+                threading.Thread(target=convert, args=('other', firstStarted)),
+            ]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            self.assertIsNone(tracing.active())
+            tracing._closeTracers()
+            firstBlocks = self.spans('first.json', 'block')
+            otherBlocks = self.spans('other.json', 'block')
+        self.assertEqual([span['name'] for span in firstBlocks], ['first'])
+        self.assertEqual([span['name'] for span in otherBlocks], ['other'])
+
+    def test_traceOption_activeInAsyncGenerators(self):
+        seen = []
+        async def custom(ctx):
+            seen.append(tracing.active())
+            return E('custom')
+        with sandbox_dir():
+            extension = CustomBlocksExtension(trace='trace.json',
+                generators=dict(custom=custom))
+            markdown.markdown("::: custom", extensions=[extension])
+            self.assertEqual(seen, [extension.tracer()])
+            tracing._closeTracers()
+
+    def test_inContext_activeInOtherThreads(self):
+        results = []
+        with sandbox_dir():
+            with tracing.trace('trace.json') as tracer:
+                bound = tracing.inContext(tracing.active)
+                for target in bound, tracing.active:
+                    thread = threading.Thread(target=lambda: results.append(target()))
+                    thread.start()
+                    thread.join()
+        self.assertEqual(results, [tracer, None])
+
+    def test_traceOption_disabled(self):
+        extension = CustomBlocksExtension()
+        md = markdown.Markdown(extensions=[extension])
+        self.assertIsNone(extension.tracer())
+        self.assertNotIn('customblocks_trace_start', md.preprocessors)
+
+    @responses.activate
+    def test_fetcher_hitAndMiss(self):
+        responses.add(method='GET', url='http://google.com', status=200, body="hello")
+        with sandbox_dir():
+            fetcher = Fetcher('cache')
+            with tracing.trace('trace.json'):
+                fetcher.get('http://google.com')
+                fetcher.get('http://google.com')
+            spans = self.spans('trace.json', 'fetcher')
+        self.assertEqual([span['args'] for span in spans], [
+            dict(url='http://google.com', cache='miss', status=200),
+            dict(url='http://google.com', cache='hit'),
+        ])
+
+    def test_image(self):
+        with sandbox_dir():
+            Image.new(mode='RGB', size=(400, 300), color='pink').save('image.png')
+            with tracing.trace('trace.json'):
+                image.embed(image.thumbnail('image.png', 100, 100))
+            spans = self.spans('trace.json', 'image')
+        self.assertEqual([span['name'] for span in spans],
+            ['image.thumbnail', 'image.embed'])
+
+    def test_pageinfo_extractionsTracedOnce(self):
+        info = PageInfo("<html><head><title>A title</title></head></html>",
+            'https://example.com')
+        with sandbox_dir():
+            with tracing.trace('trace.json'):
+                info.title
+                info.title
+            spans = self.spans('trace.json', 'pageinfo')
+        self.assertEqual([span['name'] for span in spans],
+            ['PageInfo._soup', 'PageInfo.title'])
+
+# vim: et ts=4 sw=4
@@ -1,3 +1,23 @@
-from .hyperscript import E, Markdown
-from .pageinfo import PageInfo
-from .fetcher import Fetcher
+from .hyperscript import E, Markdown, RawHtml
+
+# Modules with heavy dependencies (bs4, PIL, magic, requests)
+# are imported on first access to speed up startup
+_lazy = dict(
+    PageInfo='.pageinfo',
+    Fetcher='.fetcher',
+)
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    import importlib
+    module = importlib.import_module(_lazy[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy))
+
+# vim: et ts=4 sw=4
@@ -1,76 +1,330 @@
-import json
+import os
+import logging
+import queue
+import threading
+import http.cookiejar
 from pathlib import Path
 import requests
-from yamlns import namespace as ns
+from requests.structures import CaseInsensitiveDict
+from .. import tracing
+from .fetcherstorage import (
+    DirectoryStorage,
+    SqliteStorage,
+    legacyName,
+    sqlitePath,
+    response2namespace,
+    namespace2response,
+)
+
+logger = logging.getLogger(__name__)
+
+def _environmentTtl(namespace):
+    """Ttl for the cache namespace in CUSTOMBLOCKS_FETCHER_TTL,
+    either a number of seconds for every cache,
+    or a comma separated list of `namespace=seconds`,
+    with an optional plain number for the rest."""
+    setting = os.environ.get('CUSTOMBLOCKS_FETCHER_TTL', '').strip()
+    if not setting:
+        return None
+    ttls = {}
+    for item in setting.split(','):
+        name, _, seconds = item.rpartition('=')
+        ttls[name.strip()] = float(seconds)
+    return ttls.get(namespace, ttls.get(''))
+
+class Revalidator:
+    """Refreshes stale responses in background threads.
+    A url is queued just once until it is refreshed,
+    and requests are dropped when the queue is full,
+    since a later hit will queue them again.
+    """
+
+    def __init__(self, workers=4, queueSize=1000):
+        self._queue = queue.Queue(queueSize)
+        self._pending = set()
+        self._lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(
+                target=self._work,
+                name='customblocks-revalidator-{}'.format(i),
+                daemon=True,
+            ).start()
+
+    def submit(self, fetcher, url):
+        """Queues the refresh of the url in the fetcher,
+        returns False if it is already queued or the queue is full"""
+        key = str(fetcher.cachedir), url
+        with self._lock:
+            if key in self._pending:
+                return False
+            try:
+                self._queue.put_nowait((key, tracing.inContext(fetcher._revalidate), url))
+            except queue.Full:
+                return False
+            self._pending.add(key)
+        return True
+
+    def _work(self):
+        while True:
+            key, revalidate, url = self._queue.get()
+            try:
+                revalidate(url)
+            except Exception as e:
+                logger.warning("Unable to revalidate %s: %s", url, e)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+    def join(self):
+        """Waits until every queued refresh is done"""
+        self._queue.join()
+
+class SessionPool:
+    """Provides a requests Session for each thread,
+    all of them sharing a single pool of kept alive connections,
+    with up to `perHost` connections for each of the last `hosts` hosts.
+    Requests beyond `perHost` to a host wait for a free connection.
+    Cookies are not kept, so no fetch sends the ones set by another.
+    """
+
+    def __init__(self, hosts=32, perHost=8):
+        from requests.adapters import HTTPAdapter
+        self.adapter = HTTPAdapter(
+            pool_connections=hosts,
+            pool_maxsize=perHost,
+            pool_block=True,
+        )
+        self._local = threading.local()
+
+    def session(self):
+        """The session for the current thread"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(
+                http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def close(self):
+        """Closes every pooled connection"""
+        self.adapter.close()
+
+_sessionPool = None
+_sessionPoolLock = threading.Lock()
+
+def sessionPool():
+    """The process wide SessionPool used by every Fetcher"""
+    global _sessionPool
+    with _sessionPoolLock:
+        if _sessionPool is None:
+            _sessionPool = SessionPool()
+        return _sessionPool
+
+def configureSessionPool(hosts=32, perHost=8):
+    """Replaces the process wide SessionPool by one with those limits"""
+    global _sessionPool
+    with _sessionPoolLock:
+        if _sessionPool is not None:
+            _sessionPool.close()
+        _sessionPool = SessionPool(hosts=hosts, perHost=perHost)
+        return _sessionPool
+
+_revalidator = None
+_revalidatorLock = threading.Lock()
+
+def revalidator():
+    """The process wide Revalidator"""
+    global _revalidator
+    with _revalidatorLock:
+        if _revalidator is None:
+            _revalidator = Revalidator()
+        return _revalidator
 
 class Fetcher:
+    """Downloads urls keeping the successful responses in a cache.
+
+    The storage of the cache can be either 'directory', a yaml file
+    per url inside the `cache` directory, or 'sqlite', a single
+    `<cache>.sqlite` database file, or any object with the interface
+    of those in `fetcherstorage`.
+    If not given, it is taken from the `CUSTOMBLOCKS_FETCHER_STORAGE`
+    environment variable, and defaults to 'directory'.
+
+    Cached responses older than `ttl` seconds are revalidated
+    with the server using their `ETag` and `Last-Modified` headers.
+    If not given, it is taken from `CUSTOMBLOCKS_FETCHER_TTL`,
+    and defaults to None, keeping responses forever.
 
-    def __init__(self, cache):
+    With `revalidate` set to 'background', stale responses
+    are returned right away while they are refreshed
+    by the process wide `revalidator()`.
+    If not given, it is taken from `CUSTOMBLOCKS_FETCHER_REVALIDATE`,
+    and defaults to 'inline', waiting for the refreshed response.
+    """
+
+    def __init__(self, cache, storage=None, ttl=None, revalidate=None):
         self.cachedir = Path(cache)
-        if not self.cachedir.exists():
-            self.cachedir.mkdir(parents=True)
+        self.ttl = ttl if ttl is not None else _environmentTtl(self.cachedir.name)
+        self.revalidate = revalidate or os.environ.get('CUSTOMBLOCKS_FETCHER_REVALIDATE') or 'inline'
+        if self.revalidate not in ('inline', 'background'):
+            raise ValueError("Unknown revalidate mode: {}".format(self.revalidate))
+        storage = storage or os.environ.get('CUSTOMBLOCKS_FETCHER_STORAGE') or 'directory'
+        if storage == 'directory':
+            storage = DirectoryStorage(self.cachedir)
+        elif storage == 'sqlite':
+            storage = SqliteStorage.open(sqlitePath(self.cachedir))
+        elif isinstance(storage, str):
+            raise ValueError("Unknown fetcher storage: {}".format(storage))
+        self.storage = storage
 
     def _url2path(self, url):
-        return self.cachedir / (
-            url
-                .replace('://','_')
-                .replace('//','_')
-                .replace('/','_')
-            )
+        return self.cachedir / legacyName(url)
+
+    def __contains__(self, url):
+        """True if the response for url is already cached"""
+        return url in self.storage
+
+    def fresh(self, url):
+        """True if the response for url is cached
+        and get returns it without waiting for the network"""
+        if url not in self.storage:
+            return False
+        return self.revalidate == 'background' or not self._stale(url)
 
     def clear(self):
-        for item in self.cachedir.glob('*'):
-            item.unlink()
-        if self.cachedir.exists():
-            self.cachedir.rmdir()
+        self.storage.clear()
 
+    _response2namespace = staticmethod(response2namespace)
+    _namespace2response = staticmethod(namespace2response)
+
+    def _stale(self, url):
+        if self.ttl is None:
+            return False
+        age = self.storage.age(url)
+        return age is None or age >= self.ttl
 
     @staticmethod
-    def _response2namespace(response):
-        result = ns(
-            url=response.url,
-            headers=ns(response.headers),
-            status_code=response.status_code,
-        )
-        try:
-            result.update(json=response.json())
-        except Exception:
-            if 'text' in response.headers['Content-Type']:
-                result.update(
-                    text=response.text,
-                    encoding=response.encoding,
-                )
+    def _validators(cached):
+        """Headers for a conditional request revalidating cached"""
+        if cached is None:
+            return {}
+        headers = CaseInsensitiveDict(cached.headers)
+        validators = {}
+        if 'ETag' in headers:
+            validators['If-None-Match'] = headers['ETag']
+        if 'Last-Modified' in headers:
+            validators['If-Modified-Since'] = headers['Last-Modified']
+        return validators
+
+    def get(self, url):
+        with tracing.span('Fetcher.get', 'fetcher', url=url) as span:
+            cached, usable = self._lookup(url, span)
+            if usable:
+                return cached
+            return self._fetch(url, cached, span)
+
+    def _lookup(self, url, span):
+        """Returns the cached response, if any,
+        and whether it can be returned without waiting for the network"""
+        cached = self.storage.load(url)
+        if cached is not None and not self._stale(url):
+            span.update(cache='hit')
+            return cached, True
+        if cached is not None and self.revalidate == 'background':
+            span.update(cache='stale')
+            revalidator().submit(self, url)
+            return cached, True
+        span.update(cache='miss' if cached is None else 'stale')
+        return cached, False
+
+    def get_many(self, urls, max_workers=8, per_host=None):
+        """Gets several urls at once, returning a list
+        with their responses in the same order.
+        Cached responses are taken without network access,
+        while the rest are downloaded concurrently by `max_workers` threads,
+        and up to `per_host` at once for the same host.
+        A failed download does not abort the rest,
+        the exception is placed instead of its response.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from urllib.parse import urlsplit
+
+        results = {}
+        missing = {}
+        for url in urls:
+            if url in results or url in missing: continue
+            try:
+                cached, usable = self._lookup(url, {})
+            except Exception as e:
+                results[url] = e
+                continue
+            if usable:
+                results[url] = cached
             else:
-                result.update(content=response.content)
+                missing[url] = cached
 
-        return result
+        hosts = {}
+        if per_host:
+            for url in missing:
+                host = urlsplit(url).netloc
+                if host not in hosts:
+                    hosts[host] = threading.BoundedSemaphore(per_host)
 
-    @staticmethod
-    def _namespace2response(namespace):
-        result = requests.Response()
-        for key in namespace:
-            if key in ('content', 'text', 'json'): continue
-            setattr(result, key, namespace[key])
-        if 'text' in namespace:
-            result._content = namespace.text.encode(namespace.encoding)
-        elif 'json' in namespace:
-            result._content = json.dumps(namespace.json).encode('utf8')
-        else:
-            result._content = namespace.content
-        return result
+        def fetch(url, cached):
+            semaphore = hosts.get(urlsplit(url).netloc)
+            with tracing.span('Fetcher.get', 'fetcher', url=url) as span:
+                span.update(cache='miss' if cached is None else 'stale')
+                try:
+                    if semaphore is None:
+                        return self._fetch(url, cached, span)
+                    with semaphore:
+                        return self._fetch(url, cached, span)
+                except Exception as e:
+                    return e
 
-    def get(self, url):
-        cachefile = self._url2path(url)
-        if cachefile.exists():
-            info = ns.load(str(cachefile))
-            return self._namespace2response(info)
-        response = requests.get(url)
-        if response.ok:
-            self._response2namespace(response).dump(self._url2path(url))
+        with tracing.span('Fetcher.get_many', 'fetcher',
+                urls=len(urls), cached=len(results), missing=len(missing)):
+            if missing:
+                with ThreadPoolExecutor(min(max_workers, len(missing))) as executor:
+                    futures = {
+                        url: executor.submit(tracing.inContext(fetch), url, cached)
+                        for url, cached in missing.items()
+                    }
+                results.update(
+                    (url, future.result())
+                    for url, future in futures.items()
+                )
+        return [results[url] for url in urls]
+
+    def _revalidate(self, url):
+        with tracing.span('Fetcher.revalidate', 'fetcher', url=url) as span:
+            cached = self.storage.load(url)
+            if cached is not None and not self._stale(url):
+                span.update(cache='hit') # refreshed meanwhile
+                return
+            self._fetch(url, cached, span)
+
+    def _fetch(self, url, cached, span):
+        try:
+            response = sessionPool().session().get(url,
+                headers=self._validators(cached))
+        except requests.RequestException:
+            if cached is None: raise
+            return cached # better stale than nothing
+        span.update(status=response.status_code)
+        if cached is not None and response.status_code == 304:
+            self.storage.touch(url)
+            return cached
+        if not response.ok:
+            return response if cached is None else cached
+        self.storage.save(url, response)
         return response
 
     def remove(self, url):
-        cachefile = self._url2path(url)
-        cachefile.unlink()
+        self.storage.remove(url)
 
 # vim: et ts=4 sw=4
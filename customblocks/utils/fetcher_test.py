@@ -1,10 +1,25 @@
 import base64
+import os
+import time
 import requests
 import responses
 import unittest
+from unittest import mock
 from pathlib import Path
 from yamlns import namespace as ns
-from .fetcher import Fetcher
+from ..testutils import sandbox_dir, stand_in_server
+from . import fetcherstorage
+import threading
+from . import fetcher as fetchermodule
+from .fetcher import (
+    Fetcher,
+    Revalidator,
+    revalidator,
+    SessionPool,
+    sessionPool,
+    configureSessionPool,
+    _environmentTtl,
+)
 
 offline=False
 
@@ -371,6 +386,19 @@ class Fetcher_Test(unittest.TestCase):
         """)
         self.assertEqual(len(responses.calls), 1)
 
+    @responses.activate
+    def test_contains(self):
+        f = Fetcher(cache=self.cachedir)
+        responses.add(
+            method='GET',
+            url='http://google.com',
+            status=200,
+            body=u"hello world",
+            )
+        self.assertNotIn('http://google.com', f)
+        f.get('http://google.com')
+        self.assertIn('http://google.com', f)
+
     def test_clear(self):
         f = Fetcher(cache=self.cachedir)
         f._url2path('http://google.com').touch()
@@ -426,5 +454,479 @@ class Fetcher_Test(unittest.TestCase):
         self.assertEqual(len(responses.calls), 2)
 
 
+class FetcherFreshness_Test(unittest.TestCase):
+
+    storage = 'directory'
+
+    def setUp(self):
+        self.sandbox = sandbox_dir()
+        self.sandbox.__enter__()
+        self.pages = {
+            '/page': dict(body='version 1', etag='"v1"'),
+        }
+        self.startServer(self.pages)
+        self.url = self.server.url('/page')
+
+    def tearDown(self):
+        self.stopServer()
+        for storage in list(fetcherstorage.SqliteStorage._instances.values()):
+            storage.close()
+        self.sandbox.__exit__(None, None, None)
+
+    def startServer(self, pages):
+        self.serverContext = stand_in_server(pages)
+        self.server = self.serverContext.__enter__()
+
+    def stopServer(self):
+        if self.serverContext is None: return
+        self.serverContext.__exit__(None, None, None)
+        self.serverContext = None
+
+    def fetcher(self, ttl=None):
+        return Fetcher('cache', storage=self.storage, ttl=ttl)
+
+    def requestHeaders(self):
+        return [headers for path, headers in self.server.requests]
+
+    def later(self, seconds):
+        """Moves the cache clock forward"""
+        now = time.time() + seconds
+        return mock.patch.object(fetcherstorage, 'time', mock.Mock(time=lambda: now))
+
+    def test_noTtl_neverRevalidates(self):
+        self.fetcher().get(self.url)
+        self.pages['/page'].update(body='version 2', etag='"v2"')
+        with self.later(10*365*24*3600):
+            response = self.fetcher().get(self.url)
+        self.assertEqual(response.text, 'version 1')
+        self.assertEqual(len(self.requestHeaders()), 1)
+
+    def test_fresh_noRequest(self):
+        self.fetcher(ttl=3600).get(self.url)
+        response = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(response.text, 'version 1')
+        self.assertEqual(len(self.requestHeaders()), 1)
+
+    def test_stale_revalidatesWithEtag(self):
+        self.fetcher(ttl=3600).get(self.url)
+        with self.later(3600):
+            response = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, 'version 1')
+        first, second = self.requestHeaders()
+        self.assertNotIn('If-None-Match', first)
+        self.assertEqual(second['If-None-Match'], '"v1"')
+
+    def test_stale_revalidatesWithLastModified(self):
+        del self.pages['/page']['etag']
+        self.pages['/page'].update(last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+        self.fetcher(ttl=3600).get(self.url)
+        with self.later(3600):
+            response = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(response.text, 'version 1')
+        first, second = self.requestHeaders()
+        self.assertEqual(second['If-Modified-Since'], 'Wed, 21 Oct 2015 07:28:00 GMT')
+        self.assertNotIn('If-None-Match', second)
+
+    def test_notModified_refreshesAge(self):
+        self.fetcher(ttl=3600).get(self.url)
+        with self.later(3600):
+            self.fetcher(ttl=3600).get(self.url)
+            self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(len(self.requestHeaders()), 2)
+
+    def test_modified_storesNewVersion(self):
+        self.fetcher(ttl=3600).get(self.url)
+        self.pages['/page'].update(body='version 2', etag='"v2"')
+        with self.later(3600):
+            response = self.fetcher(ttl=3600).get(self.url)
+            cached = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(response.text, 'version 2')
+        self.assertEqual(cached.text, 'version 2')
+        self.assertEqual(cached.headers['ETag'], '"v2"')
+        self.assertEqual(len(self.requestHeaders()), 2)
+
+    def test_fresh(self):
+        self.assertFalse(self.fetcher(ttl=3600).fresh(self.url))
+        self.fetcher(ttl=3600).get(self.url)
+        self.assertTrue(self.fetcher(ttl=3600).fresh(self.url))
+        with self.later(3600):
+            self.assertFalse(self.fetcher(ttl=3600).fresh(self.url))
+            self.assertTrue(self.fetcher().fresh(self.url))
+
+    def test_stale_serverError_keepsCached(self):
+        self.fetcher(ttl=3600).get(self.url)
+        self.pages['/page'].update(body='failed', etag='"error"', status=500)
+        with self.later(3600):
+            response = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(response.text, 'version 1')
+
+    def test_stale_unreachable_keepsCached(self):
+        self.fetcher(ttl=3600).get(self.url)
+        self.stopServer()
+        with self.later(3600):
+            response = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(response.text, 'version 1')
+
+    def test_missing_unreachable_raises(self):
+        self.stopServer()
+        with self.assertRaises(requests.ConnectionError):
+            self.fetcher(ttl=3600).get(self.url)
+
+class FetcherFreshnessSqlite_Test(FetcherFreshness_Test):
+
+    storage = 'sqlite'
+
+class FetcherBackgroundRevalidation_Test(FetcherFreshness_Test):
+
+    def tearDown(self):
+        revalidator().join()
+        super(FetcherBackgroundRevalidation_Test, self).tearDown()
+
+    def fetcher(self, ttl=None):
+        return Fetcher('cache', storage=self.storage, ttl=ttl, revalidate='background')
+
+    def test_fresh(self):
+        self.fetcher(ttl=3600).get(self.url)
+        with self.later(3600):
+            # Stale ones are returned right away
+            self.assertTrue(self.fetcher(ttl=3600).fresh(self.url))
+
+    def test_modified_storesNewVersion(self):
+        self.fetcher(ttl=3600).get(self.url)
+        self.pages['/page'].update(body='version 2', etag='"v2"')
+        with self.later(3600):
+            stale = self.fetcher(ttl=3600).get(self.url)
+            revalidator().join()
+            refreshed = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(stale.text, 'version 1')
+        self.assertEqual(refreshed.text, 'version 2')
+        self.assertEqual(len(self.requestHeaders()), 2)
+
+    def test_notModified_refreshesAge(self):
+        self.fetcher(ttl=3600).get(self.url)
+        with self.later(3600):
+            self.fetcher(ttl=3600).get(self.url)
+            revalidator().join()
+            self.fetcher(ttl=3600).get(self.url)
+            revalidator().join()
+        self.assertEqual(len(self.requestHeaders()), 2)
+        self.assertEqual(self.requestHeaders()[1]['If-None-Match'], '"v1"')
+
+    def test_stale_revalidatesWithEtag(self):
+        self.fetcher(ttl=3600).get(self.url)
+        with self.later(3600):
+            self.fetcher(ttl=3600).get(self.url)
+            revalidator().join()
+        first, second = self.requestHeaders()
+        self.assertEqual(second['If-None-Match'], '"v1"')
+
+    def test_stale_revalidatesWithLastModified(self):
+        del self.pages['/page']['etag']
+        self.pages['/page'].update(last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+        self.fetcher(ttl=3600).get(self.url)
+        with self.later(3600):
+            self.fetcher(ttl=3600).get(self.url)
+            revalidator().join()
+        first, second = self.requestHeaders()
+        self.assertEqual(second['If-Modified-Since'], 'Wed, 21 Oct 2015 07:28:00 GMT')
+
+    def test_stale_doesNotWaitForTheServer(self):
+        self.fetcher(ttl=3600).get(self.url)
+        fetcher = self.fetcher(ttl=3600)
+        with mock.patch.object(requests.Session, 'get', side_effect=AssertionError("Should not wait")):
+            with mock.patch.object(Revalidator, 'submit') as submit:
+                with self.later(3600):
+                    response = fetcher.get(self.url)
+        self.assertEqual(response.text, 'version 1')
+        submit.assert_called_once_with(fetcher, self.url)
+
+    def test_missing_fetchedInline(self):
+        response = self.fetcher(ttl=3600).get(self.url)
+        self.assertEqual(response.text, 'version 1')
+        self.assertEqual(len(self.requestHeaders()), 1)
+
+class FetcherBackgroundRevalidationSqlite_Test(FetcherBackgroundRevalidation_Test):
+
+    storage = 'sqlite'
+
+class BlockingFetcher:
+    """Fake fetcher whose refreshes wait to be released"""
+
+    def __init__(self, cachedir='cache'):
+        self.cachedir = cachedir
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.revalidated = []
+
+    def _revalidate(self, url):
+        self.started.set()
+        self.release.wait(5)
+        self.revalidated.append(url)
+
+class Revalidator_Test(unittest.TestCase):
+
+    def test_submit_refreshes(self):
+        revalidator = Revalidator(workers=1)
+        fetcher = BlockingFetcher()
+        fetcher.release.set()
+        self.assertTrue(revalidator.submit(fetcher, 'http://a.com'))
+        revalidator.join()
+        self.assertEqual(fetcher.revalidated, ['http://a.com'])
+
+    def test_submit_pendingUrl_ignored(self):
+        revalidator = Revalidator(workers=1)
+        fetcher = BlockingFetcher()
+        self.assertTrue(revalidator.submit(fetcher, 'http://a.com'))
+        self.assertFalse(revalidator.submit(fetcher, 'http://a.com'))
+        fetcher.release.set()
+        revalidator.join()
+        self.assertEqual(fetcher.revalidated, ['http://a.com'])
+
+    def test_submit_sameUrlOtherCache_queued(self):
+        revalidator = Revalidator(workers=1)
+        fetcher = BlockingFetcher()
+        other = BlockingFetcher('othercache')
+        other.release.set()
+        self.assertTrue(revalidator.submit(fetcher, 'http://a.com'))
+        self.assertTrue(revalidator.submit(other, 'http://a.com'))
+        fetcher.release.set()
+        revalidator.join()
+
+    def test_submit_afterDone_queuedAgain(self):
+        revalidator = Revalidator(workers=1)
+        fetcher = BlockingFetcher()
+        fetcher.release.set()
+        revalidator.submit(fetcher, 'http://a.com')
+        revalidator.join()
+        self.assertTrue(revalidator.submit(fetcher, 'http://a.com'))
+        revalidator.join()
+        self.assertEqual(fetcher.revalidated, ['http://a.com', 'http://a.com'])
+
+    def test_submit_fullQueue_dropped(self):
+        revalidator = Revalidator(workers=1, queueSize=1)
+        fetcher = BlockingFetcher()
+        self.assertTrue(revalidator.submit(fetcher, 'http://a.com'))
+        fetcher.started.wait(5) # taken out of the queue
+        self.assertTrue(revalidator.submit(fetcher, 'http://b.com'))
+        self.assertFalse(revalidator.submit(fetcher, 'http://c.com'))
+        fetcher.release.set()
+        revalidator.join()
+        self.assertEqual(fetcher.revalidated, ['http://a.com', 'http://b.com'])
+
+    def test_failure_logged(self):
+        revalidator = Revalidator(workers=1)
+        fetcher = BlockingFetcher()
+        fetcher._revalidate = mock.Mock(side_effect=Exception("Boom"))
+        with self.assertLogs('customblocks.utils.fetcher', 'WARNING') as logs:
+            revalidator.submit(fetcher, 'http://a.com')
+            revalidator.join()
+        self.assertEqual(logs.output, [
+            "WARNING:customblocks.utils.fetcher:Unable to revalidate http://a.com: Boom",
+        ])
+        self.assertTrue(revalidator.submit(fetcher, 'http://a.com'))
+        revalidator.join()
+
+    def test_revalidateMode_fromEnvironment(self):
+        with mock.patch.dict(os.environ, CUSTOMBLOCKS_FETCHER_REVALIDATE='background'):
+            with sandbox_dir():
+                self.assertEqual(Fetcher('cache').revalidate, 'background')
+
+    def test_revalidateMode_unknown(self):
+        with sandbox_dir():
+            with self.assertRaises(ValueError) as ctx:
+                Fetcher('cache', revalidate='never')
+        self.assertEqual(format(ctx.exception), "Unknown revalidate mode: never")
+
+class SessionPool_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.sandbox = sandbox_dir()
+        self.sandbox.__enter__()
+        self.pages = {
+            '/page{}'.format(i): dict(body='page {}'.format(i))
+            for i in range(16)
+        }
+
+    def tearDown(self):
+        self.sandbox.__exit__(None, None, None)
+
+    def usingPool(self, **kwds):
+        pool = SessionPool(**kwds)
+        self.addCleanup(pool.close)
+        return mock.patch.object(fetchermodule, '_sessionPool', pool)
+
+    def inThreads(self, function, nthreads):
+        threads = [threading.Thread(target=function) for i in range(nthreads)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+    def test_session_perThread_sharingConnections(self):
+        pool = SessionPool()
+        sessions = []
+        self.inThreads(lambda: sessions.append(pool.session()), 2)
+        first, second = sessions
+        self.assertIsNot(first, second)
+        self.assertIs(first.get_adapter('https://a.com'), pool.adapter)
+        self.assertIs(second.get_adapter('http://b.com'), pool.adapter)
+
+    def test_session_sameThread_reused(self):
+        pool = SessionPool()
+        self.assertIs(pool.session(), pool.session())
+
+    def test_sessionPool_processWide(self):
+        self.assertIs(sessionPool(), sessionPool())
+
+    def test_configureSessionPool(self):
+        with mock.patch.object(fetchermodule, '_sessionPool', None):
+            pool = configureSessionPool(hosts=4, perHost=2)
+            self.assertIs(sessionPool(), pool)
+            self.assertEqual(pool.adapter._pool_maxsize, 2)
+            self.assertEqual(pool.adapter._pool_connections, 4)
+
+    def test_fetchers_reuseConnections(self):
+        with stand_in_server(self.pages) as server, self.usingPool():
+            for i in range(6):
+                Fetcher('cache{}'.format(i%3)).get(server.url('/page{}'.format(i)))
+        self.assertEqual(len(server.requests), 6)
+        self.assertEqual(len(set(server.clients)), 1)
+
+    def test_fetchers_limitConnectionsPerHost(self):
+        for page in self.pages.values():
+            page.update(delay=0.05)
+        urls = iter(range(16))
+        def fetch():
+            for i in urls:
+                Fetcher('cache').get(server.url('/page{}'.format(i)))
+        with stand_in_server(self.pages) as server, self.usingPool(perHost=2):
+            self.inThreads(fetch, 8)
+        self.assertEqual(len(server.requests), 16)
+        self.assertEqual(len(set(server.clients)), 2)
+
+    def test_fetchers_cookiesNotKept(self):
+        self.pages['/page0'].update(headers={'Set-Cookie': 'session=secret; Path=/'})
+        with stand_in_server(self.pages) as server, self.usingPool():
+            Fetcher('cache').get(server.url('/page0'))
+            Fetcher('cache').get(server.url('/page1'))
+        [(_, first), (_, second)] = server.requests
+        self.assertNotIn('Cookie', second)
+
+class FetcherGetMany_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.sandbox = sandbox_dir()
+        self.sandbox.__enter__()
+        self.pages = {
+            '/page{}'.format(i): dict(body='page {}'.format(i))
+            for i in range(8)
+        }
+        self.serverContext = stand_in_server(self.pages)
+        self.server = self.serverContext.__enter__()
+
+    def tearDown(self):
+        self.serverContext.__exit__(None, None, None)
+        self.sandbox.__exit__(None, None, None)
+
+    def url(self, i):
+        return self.server.url('/page{}'.format(i))
+
+    def requestedPaths(self):
+        return sorted(path for path, headers in self.server.requests)
+
+    def test_keepsOrder(self):
+        urls = [self.url(i) for i in (3, 0, 7, 1)]
+        responses = Fetcher('cache').get_many(urls)
+        self.assertEqual([r.text for r in responses], [
+            'page 3', 'page 0', 'page 7', 'page 1',
+        ])
+
+    def test_storesInCache(self):
+        fetcher = Fetcher('cache')
+        fetcher.get_many([self.url(0), self.url(1)])
+        self.assertIn(self.url(0), fetcher)
+        self.assertIn(self.url(1), fetcher)
+
+    def test_cached_noNetwork(self):
+        fetcher = Fetcher('cache')
+        fetcher.get(self.url(1))
+        responses = fetcher.get_many([self.url(0), self.url(1), self.url(2)])
+        self.assertEqual([r.text for r in responses], ['page 0', 'page 1', 'page 2'])
+        self.assertEqual(self.requestedPaths(), ['/page0', '/page1', '/page2'])
+
+    def test_allCached_noThreads(self):
+        fetcher = Fetcher('cache')
+        fetcher.get(self.url(0))
+        with mock.patch('concurrent.futures.ThreadPoolExecutor') as executor:
+            [response] = fetcher.get_many([self.url(0)])
+        self.assertEqual(response.text, 'page 0')
+        executor.assert_not_called()
+
+    def test_repeatedUrls_fetchedOnce(self):
+        responses = Fetcher('cache').get_many([self.url(0), self.url(1), self.url(0)])
+        self.assertEqual([r.text for r in responses], ['page 0', 'page 1', 'page 0'])
+        self.assertEqual(self.requestedPaths(), ['/page0', '/page1'])
+
+    def test_empty(self):
+        self.assertEqual(Fetcher('cache').get_many([]), [])
+
+    def test_httpError_returnedAsResponse(self):
+        [missing, found] = Fetcher('cache').get_many([
+            self.server.url('/missing'),
+            self.url(0),
+        ])
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(found.text, 'page 0')
+
+    def test_connectionError_inPlace(self):
+        import socket
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        unreachable = 'http://127.0.0.1:{}/page'.format(unused.getsockname()[1])
+        unused.close()
+        [failed, found] = Fetcher('cache').get_many([unreachable, self.url(0)])
+        self.assertIsInstance(failed, requests.ConnectionError)
+        self.assertEqual(found.text, 'page 0')
+
+    def test_concurrent(self):
+        for page in self.pages.values():
+            page.update(delay=0.2)
+        start = time.perf_counter()
+        Fetcher('cache').get_many([self.url(i) for i in range(4)], max_workers=4)
+        self.assertLess(time.perf_counter() - start, 0.6) # sequential 0.8
+
+    def test_perHost_limitsConcurrency(self):
+        for page in self.pages.values():
+            page.update(delay=0.05)
+        start = time.perf_counter()
+        Fetcher('cache').get_many([self.url(i) for i in range(4)],
+            max_workers=4, per_host=1)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        self.assertEqual(len(set(self.server.clients)), 1)
+
+class EnvironmentTtl_Test(unittest.TestCase):
+
+    def ttl(self, setting, namespace='linkcard'):
+        with mock.patch.dict(os.environ, CUSTOMBLOCKS_FETCHER_TTL=setting):
+            return _environmentTtl(namespace)
+
+    def test_unset(self):
+        self.assertIsNone(self.ttl(''))
+
+    def test_global(self):
+        self.assertEqual(self.ttl('3600'), 3600)
+
+    def test_perNamespace(self):
+        self.assertEqual(self.ttl('twitter=60, linkcard=3600'), 3600)
+
+    def test_perNamespace_otherNamespace(self):
+        self.assertIsNone(self.ttl('twitter=60'))
+
+    def test_perNamespace_withDefault(self):
+        self.assertEqual(self.ttl('twitter=60,86400'), 86400)
+
+    def test_fetcher_takesIt(self):
+        with mock.patch.dict(os.environ, CUSTOMBLOCKS_FETCHER_TTL='linkcard=60'):
+            with sandbox_dir():
+                self.assertEqual(Fetcher('fetchercache/linkcard').ttl, 60)
 
 # vim: et ts=4 sw=4
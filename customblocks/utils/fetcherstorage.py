@@ -0,0 +1,325 @@
+"""
+Storage engines for the Fetcher cache.
+
+- DirectoryStorage: a yaml file per url in a directory (the default)
+- SqliteStorage: a single sqlite database file
+
+Any object having `load`, `save`, `age`, `touch`, `remove`,
+`__contains__` and `clear` methods like these ones can be used as storage.
+
+To move an existing directory cache into a sqlite database:
+
+    python -m customblocks.utils.fetcherstorage fetchercache/linkcard
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+from yamlns import namespace as ns
+
+def legacyName(url):
+    """File name of the url in the directory storage"""
+    return (url
+        .replace('://','_')
+        .replace('//','_')
+        .replace('/','_')
+    )
+
+_defaultPorts = dict(http=':80', https=':443')
+
+def normalizeUrl(url):
+    """Url as key for the cache: lowercase scheme and host,
+    no default port, root path if empty, and no fragment"""
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+    port = _defaultPorts.get(scheme)
+    if port and netloc.endswith(port):
+        netloc = netloc[:-len(port)]
+    return urlunsplit((scheme, netloc, path or '/', query, ''))
+
+def response2namespace(response):
+    result = ns(
+        url=response.url,
+        headers=ns(response.headers),
+        status_code=response.status_code,
+    )
+    try:
+        result.update(json=response.json())
+    except Exception:
+        if 'text' in response.headers['Content-Type']:
+            result.update(
+                text=response.text,
+                encoding=response.encoding,
+            )
+        else:
+            result.update(content=response.content)
+
+    return result
+
+def namespace2response(namespace):
+    result = requests.Response()
+    for key in namespace:
+        if key in ('content', 'text', 'json'): continue
+        setattr(result, key, namespace[key])
+    if 'text' in namespace:
+        result._content = namespace.text.encode(namespace.encoding)
+    elif 'json' in namespace:
+        result._content = json.dumps(namespace.json).encode('utf8')
+    else:
+        result._content = namespace.content
+    return result
+
+class DirectoryStorage:
+    """Stores each response as a yaml file in a directory"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _url2path(self, url):
+        return self.path / legacyName(url)
+
+    def __contains__(self, url):
+        return self._url2path(url).exists()
+
+    def load(self, url):
+        cachefile = self._url2path(url)
+        if not cachefile.exists():
+            return None
+        return namespace2response(ns.load(str(cachefile)))
+
+    def save(self, url, response):
+        # Written aside and then moved, so that concurrent readers
+        # never get a partially written file.
+        # Short unique name, cache names may be already near the limit.
+        cachefile = self._url2path(url)
+        with tempfile.NamedTemporaryFile('w', dir=str(self.path),
+                prefix='.tmp', delete=False) as partial:
+            pass
+        try:
+            response2namespace(response).dump(partial.name)
+            now = time.time()
+            os.utime(partial.name, (now, now))
+            os.replace(partial.name, cachefile)
+        finally:
+            if os.path.exists(partial.name):
+                os.unlink(partial.name)
+
+    def age(self, url):
+        """Seconds since the response was stored or touched,
+        None if not stored"""
+        try:
+            return time.time() - self._url2path(url).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def touch(self, url):
+        """Resets the age of the stored response"""
+        now = time.time()
+        os.utime(self._url2path(url), (now, now))
+
+    def remove(self, url):
+        self._url2path(url).unlink()
+
+    def clear(self):
+        for item in self.path.glob('*'):
+            item.unlink()
+        if self.path.exists():
+            self.path.rmdir()
+
+class SqliteStorage:
+    """Stores the responses in a single sqlite database,
+    indexed by normalized url, with the raw body as a blob.
+    Responses migrated from a directory storage are also found
+    by the file name they had there, since it can not be turned
+    back into the requested url.
+
+    Use `open` to share a single connection, and its writes,
+    among all the fetchers and threads using the same file.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            final_url TEXT,
+            status_code INTEGER,
+            headers TEXT,
+            encoding TEXT,
+            body BLOB,
+            stored REAL
+        );
+        CREATE TABLE IF NOT EXISTS aliases (
+            alias TEXT PRIMARY KEY,
+            url TEXT NOT NULL
+        );
+    """
+    _columns = 'final_url, status_code, headers, encoding, body'
+
+    _instances = {}
+    _instancesLock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        """Process wide storage for the database file"""
+        key = str(Path(path).resolve())
+        with cls._instancesLock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(self._schema)
+
+    def _query(self, sql, *params):
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()
+
+    def _write(self, sql, *params):
+        with self._lock, self._db:
+            self._db.execute(sql, params)
+
+    def _key(self, url):
+        """The key of the stored response, by normalized url, or else
+        by the name of the file in the directory storage, for migrated ones"""
+        key = normalizeUrl(url)
+        if self._query('SELECT 1 FROM responses WHERE url = ?', key):
+            return key
+        row = self._query('SELECT url FROM aliases WHERE alias = ?', legacyName(url))
+        return key if row is None else row[0]
+
+    def _row(self, url):
+        return self._query(
+            'SELECT {} FROM responses WHERE url = ?'.format(self._columns),
+            self._key(url))
+
+    def __contains__(self, url):
+        return self._row(url) is not None
+
+    def load(self, url):
+        row = self._row(url)
+        if row is None:
+            return None
+        finalUrl, status, headers, encoding, body = row
+        response = requests.Response()
+        response.url = finalUrl
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response.encoding = encoding
+        response._content = bytes(body)
+        return response
+
+    def save(self, url, response, alias=None):
+        """Stores the response for the url,
+        also found by alias, if given"""
+        if alias:
+            self._write(
+                'INSERT OR REPLACE INTO aliases (alias, url) VALUES (?, ?)',
+                alias, normalizeUrl(url))
+        self._write(
+            'INSERT OR REPLACE INTO responses '
+            '(url, final_url, status_code, headers, encoding, body, stored) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            normalizeUrl(url),
+            response.url,
+            response.status_code,
+            json.dumps(dict(response.headers)),
+            response.encoding,
+            response.content,
+            time.time(),
+        )
+
+    def age(self, url):
+        """Seconds since the response was stored or touched,
+        None if not stored"""
+        row = self._query(
+            'SELECT stored FROM responses WHERE url = ?', self._key(url))
+        return None if row is None else time.time() - row[0]
+
+    def touch(self, url):
+        """Resets the age of the stored response"""
+        self._write(
+            'UPDATE responses SET stored = ? WHERE url = ?',
+            time.time(), self._key(url))
+
+    def remove(self, url):
+        key = self._key(url)
+        self._write('DELETE FROM responses WHERE url = ?', key)
+        self._write('DELETE FROM aliases WHERE url = ?', key)
+
+    def clear(self):
+        self._write('DELETE FROM responses')
+        self._write('DELETE FROM aliases')
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM responses')[0]
+
+    def close(self):
+        with self._instancesLock:
+            key = str(self.path.resolve())
+            if self._instances.get(key) is self:
+                del self._instances[key]
+        with self._lock:
+            self._db.close()
+
+def sqlitePath(directory):
+    """Database file used instead of a cache directory"""
+    directory = Path(directory)
+    return directory.with_name(directory.name + '.sqlite')
+
+def migrate(directory, database=None, remove=False):
+    """Copies every response cached in a directory storage
+    into a sqlite storage, by default next to the directory
+    with the `.sqlite` extension.
+    Returns the number of responses copied."""
+    directory = Path(directory)
+    target = SqliteStorage.open(database or sqlitePath(directory))
+    count = 0
+    for cachefile in sorted(directory.glob('*')):
+        if not cachefile.is_file(): continue
+        if cachefile.name.startswith('.'): continue # partially written
+        response = namespace2response(ns.load(str(cachefile)))
+        target.save(response.url, response, alias=cachefile.name)
+        count += 1
+        if remove:
+            cachefile.unlink()
+    if remove and not any(directory.iterdir()):
+        directory.rmdir()
+    return count
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m customblocks.utils.fetcherstorage',
+        description="Moves directory fetcher caches into sqlite databases",
+    )
+    parser.add_argument('directories', nargs='+', metavar='DIRECTORY',
+        help="cache directory, like fetchercache/linkcard")
+    parser.add_argument('--database', metavar='FILE',
+        help="target database, by default DIRECTORY.sqlite")
+    parser.add_argument('--remove', action='store_true',
+        help="remove the yaml files once copied")
+    options = parser.parse_args(argv)
+    for directory in options.directories:
+        if not Path(directory).is_dir(): continue # like a previous database
+        database = options.database or sqlitePath(directory)
+        count = migrate(directory, database, remove=options.remove)
+        print("{}: {} responses copied into {}".format(directory, count, database))
+
+if __name__ == '__main__':
+    main()
+
+# vim: et ts=4 sw=4
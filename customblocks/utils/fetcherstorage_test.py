@@ -0,0 +1,286 @@
+import os
+import io
+import sqlite3
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+import requests
+import responses
+from yamlns import namespace as ns
+from ..testutils import sandbox_dir
+from .fetcher import Fetcher
+from . import fetcherstorage
+from .fetcherstorage import (
+    DirectoryStorage,
+    SqliteStorage,
+    normalizeUrl,
+    migrate,
+    main,
+)
+
+class NormalizeUrl_Test(unittest.TestCase):
+
+    def test_lowercasesSchemeAndHost(self):
+        self.assertEqual(normalizeUrl('HTTPS://Example.COM/Path'), 'https://example.com/Path')
+
+    def test_emptyPath_isRoot(self):
+        self.assertEqual(normalizeUrl('http://example.com'), 'http://example.com/')
+
+    def test_removesDefaultPort(self):
+        self.assertEqual(normalizeUrl('https://example.com:443/a'), 'https://example.com/a')
+        self.assertEqual(normalizeUrl('http://example.com:80/a'), 'http://example.com/a')
+
+    def test_keepsOtherPorts(self):
+        self.assertEqual(normalizeUrl('http://example.com:8080/a'), 'http://example.com:8080/a')
+
+    def test_keepsQuery_removesFragment(self):
+        self.assertEqual(normalizeUrl('http://example.com/a?b=1#c'), 'http://example.com/a?b=1')
+
+class DirectoryStorage_Test(unittest.TestCase):
+
+    def download(self, url, body="hello"):
+        responses.add(method='GET', url=url, status=200, body=body)
+        return requests.get(url)
+
+    @responses.activate
+    def test_save_writesAside(self):
+        replaced = []
+        def replace(source, target):
+            replaced.append(os.path.basename(source))
+            os.rename(source, target)
+        with sandbox_dir():
+            storage = DirectoryStorage('cache')
+            with mock.patch.object(fetcherstorage.os, 'replace', replace):
+                storage.save('http://mysite.com/page', self.download('http://mysite.com/page'))
+            self.assertEqual(storage.load('http://mysite.com/page').text, "hello")
+            self.assertEqual(sorted(os.listdir('cache')), ['http_mysite.com_page'])
+        [partial] = replaced
+        self.assertTrue(partial.startswith('.tmp'))
+
+    @responses.activate
+    def test_save_longUrl(self):
+        url = 'http://mysite.com/' + 'a' * (245 - len('http_mysite.com_'))
+        with sandbox_dir():
+            storage = DirectoryStorage('cache')
+            storage.save(url, self.download(url))
+            self.assertEqual(storage.load(url).text, "hello")
+
+    @responses.activate
+    def test_save_failed_noPartialLeft(self):
+        with sandbox_dir():
+            storage = DirectoryStorage('cache')
+            response = self.download('http://mysite.com/page')
+            with mock.patch.object(fetcherstorage.os, 'utime', side_effect=OSError("Failed")):
+                with self.assertRaises(OSError):
+                    storage.save('http://mysite.com/page', response)
+            self.assertEqual(os.listdir('cache'), [])
+
+    def test_existingDirectory(self):
+        with sandbox_dir():
+            os.mkdir('cache')
+            DirectoryStorage('cache')
+            self.assertTrue(os.path.isdir('cache'))
+
+class SqliteStorage_Test(unittest.TestCase):
+
+    from yamlns.testutils import assertNsEqual
+
+    def setUp(self):
+        self.sandbox = sandbox_dir()
+        self.sandbox.__enter__()
+        self.storages = []
+
+    def tearDown(self):
+        for storage in self.storages:
+            storage.close()
+        self.sandbox.__exit__(None, None, None)
+
+    def storage(self, path='cache.sqlite'):
+        storage = SqliteStorage.open(path)
+        self.storages.append(storage)
+        return storage
+
+    def fetcher(self, cache='cache'):
+        fetcher = Fetcher(cache, storage='sqlite')
+        self.storages.append(fetcher.storage)
+        return fetcher
+
+    def download(self, url, **kwds):
+        responses.add(method='GET', url=url, status=200, **kwds)
+        return requests.get(url)
+
+    def assertSameResponse(self, response, expected):
+        self.assertNsEqual(
+            Fetcher._response2namespace(response),
+            Fetcher._response2namespace(expected),
+        )
+
+    @responses.activate
+    def test_load_text(self):
+        storage = self.storage()
+        response = self.download('http://mysite.com/page', body="La caña")
+        storage.save('http://mysite.com/page', response)
+        self.assertSameResponse(storage.load('http://mysite.com/page'), response)
+
+    @responses.activate
+    def test_load_binary(self):
+        storage = self.storage()
+        response = self.download('http://mysite.com/image',
+            body=b'\x89PNG\x00\xff', content_type='image/png')
+        storage.save('http://mysite.com/image', response)
+        loaded = storage.load('http://mysite.com/image')
+        self.assertEqual(loaded.content, b'\x89PNG\x00\xff')
+        self.assertSameResponse(loaded, response)
+
+    @responses.activate
+    def test_load_json(self):
+        storage = self.storage()
+        response = self.download('http://mysite.com/api', json=dict(data='value'))
+        storage.save('http://mysite.com/api', response)
+        loaded = storage.load('http://mysite.com/api')
+        self.assertEqual(loaded.json(), dict(data='value'))
+        self.assertEqual(loaded.headers['content-type'], 'application/json')
+
+    def test_load_missing(self):
+        storage = self.storage()
+        self.assertIsNone(storage.load('http://mysite.com/page'))
+
+    @responses.activate
+    def test_load_byNormalizedUrl(self):
+        storage = self.storage()
+        response = self.download('http://mysite.com/', body="hello")
+        storage.save('http://MYSITE.com:80', response)
+        self.assertIn('http://mysite.com/', storage)
+        self.assertEqual(storage.load('http://mysite.com').text, "hello")
+
+    @responses.activate
+    def test_remove(self):
+        storage = self.storage()
+        storage.save('http://mysite.com/page', self.download('http://mysite.com/page', body="hello"))
+        storage.remove('http://mysite.com/page')
+        self.assertNotIn('http://mysite.com/page', storage)
+
+    @responses.activate
+    def test_clear(self):
+        storage = self.storage()
+        storage.save('http://mysite.com/one', self.download('http://mysite.com/one', body="one"))
+        storage.save('http://mysite.com/two', self.download('http://mysite.com/two', body="two"))
+        self.assertEqual(len(storage), 2)
+        storage.clear()
+        self.assertEqual(len(storage), 0)
+
+    def test_walMode(self):
+        self.storage()
+        db = sqlite3.connect('cache.sqlite')
+        [mode] = db.execute('PRAGMA journal_mode').fetchone()
+        db.close()
+        self.assertEqual(mode, 'wal')
+
+    def test_open_sharedByPath(self):
+        self.assertIs(self.storage('cache.sqlite'), self.storage('./cache.sqlite'))
+
+    @responses.activate
+    def test_fetcher_storesAndUsesCache(self):
+        responses.add(method='GET', url='http://google.com', status=200, body="hello world")
+        self.fetcher().get('http://google.com')
+        response = self.fetcher().get('http://google.com')
+        self.assertEqual(response.text, "hello world")
+        self.assertEqual(len(responses.calls), 1)
+        self.assertTrue(os.path.exists('cache.sqlite'))
+        self.assertFalse(os.path.exists('cache'))
+
+    @responses.activate
+    def test_fetcher_storageFromEnvironment(self):
+        with mock.patch.dict(os.environ, CUSTOMBLOCKS_FETCHER_STORAGE='sqlite'):
+            fetcher = Fetcher('cache')
+        self.storages.append(fetcher.storage)
+        self.assertIsInstance(fetcher.storage, SqliteStorage)
+
+    def test_fetcher_directoryByDefault(self):
+        with mock.patch.dict(os.environ, CUSTOMBLOCKS_FETCHER_STORAGE=''):
+            fetcher = Fetcher('cache')
+        self.assertIsInstance(fetcher.storage, DirectoryStorage)
+
+    def test_fetcher_unknownStorage(self):
+        with self.assertRaises(ValueError) as ctx:
+            Fetcher('cache', storage='floppy')
+        self.assertEqual(format(ctx.exception), "Unknown fetcher storage: floppy")
+
+    @responses.activate
+    def test_migrate(self):
+        responses.add(method='GET', url='http://google.com', status=200, body="hello world")
+        Fetcher('cache', storage='directory').get('http://google.com')
+
+        self.assertEqual(migrate('cache'), 1)
+
+        response = self.fetcher().get('http://google.com')
+        self.assertEqual(response.text, "hello world")
+        self.assertEqual(len(responses.calls), 1)
+        self.assertTrue(os.path.exists('cache'))
+
+    def test_migrate_redirected_foundByRequestedUrl(self):
+        # Stored url is the one after redirection
+        directory = DirectoryStorage('cache')
+        directory._url2path('http://short.url/a').write_text(encoding='utf8', data="""\
+            url: https://www.example.com/article
+            status_code: 200
+            headers:
+              Content-Type: text/plain
+            text: redirected
+            encoding: utf-8
+        """)
+        migrate('cache')
+        fetcher = self.fetcher()
+        self.assertEqual(fetcher.get('http://short.url/a').text, "redirected")
+        self.assertEqual(fetcher.get('https://www.example.com/article').text, "redirected")
+
+    def writeLegacy(self, directory, url, finalUrl, text, name=None):
+        cachefile = directory._url2path(url)
+        if name: cachefile = cachefile.with_name(name)
+        cachefile.write_text(encoding='utf8', data="""\
+            url: {}
+            status_code: 200
+            headers:
+              Content-Type: text/plain
+            text: {}
+            encoding: utf-8
+        """.format(finalUrl, text))
+
+    def test_migrate_redirectedToSameUrl_bothFound(self):
+        directory = DirectoryStorage('cache')
+        self.writeLegacy(directory, 'http://short.url/a', 'https://www.example.com/article', "first")
+        self.writeLegacy(directory, 'http://other.url/b', 'https://www.example.com/article', "second")
+        self.assertEqual(migrate('cache'), 2)
+        fetcher = self.fetcher()
+        self.assertIn('http://short.url/a', fetcher.storage)
+        self.assertIn('http://other.url/b', fetcher.storage)
+        self.assertEqual(fetcher.get('http://short.url/a').url, 'https://www.example.com/article')
+
+    def test_migrate_partialFilesSkipped(self):
+        directory = DirectoryStorage('cache')
+        self.writeLegacy(directory, 'http://short.url/a', 'http://short.url/a', "partial",
+            name='.tmpabcd1234')
+        self.assertEqual(migrate('cache'), 0)
+
+    def test_remove_migrated_byAlias(self):
+        directory = DirectoryStorage('cache')
+        self.writeLegacy(directory, 'http://short.url/a', 'https://www.example.com/article', "text")
+        migrate('cache')
+        storage = self.storage('cache.sqlite')
+        storage.remove('http://short.url/a')
+        self.assertNotIn('http://short.url/a', storage)
+        self.assertNotIn('https://www.example.com/article', storage)
+
+    @responses.activate
+    def test_main_remove(self):
+        responses.add(method='GET', url='http://google.com', status=200, body="hello world")
+        Fetcher('cache', storage='directory').get('http://google.com')
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main(['cache', '--remove'])
+        self.assertEqual(output.getvalue(),
+            "cache: 1 responses copied into cache.sqlite\n")
+        self.assertFalse(os.path.exists('cache'))
+        self.assertEqual(self.fetcher().get('http://google.com').text, "hello world")
+
+# vim: et ts=4 sw=4
@@ -76,7 +76,13 @@ class Markdown:
     def parse(self, parent):
         self.parser.parseChunk(parent, self.text)
 
-
+class RawHtml(str):
+    """
+    Marks a string returned by a generator as trusted html.
+    It is inserted verbatim in the output, instead of being
+    parsed as xml, so it just needs to be valid html.
+    """
+    __slots__ = ()
 
 
 # vim: et ts=4 sw=4
@@ -6,7 +6,9 @@ import mimetypes
 from typing import Union
 from PIL import Image, UnidentifiedImageError
 from .fetcher import Fetcher
+from .. import tracing
 
+@tracing.traced('image.embed', 'image')
 def embed(localfile: Union[Path, str]) -> str:
     """
     Turns a localfile into a base64 encoded data url to embed
@@ -17,6 +19,7 @@ def embed(localfile: Union[Path, str]) -> str:
         encoded = base64.b64encode(f.read()).decode('ascii')
         return f"data:{mime};base64,{encoded}"
 
+@tracing.traced('image.thumbnail', 'image')
 def thumbnail(localfile: Union[Path, str], max_width:int=200, max_height:int=200, target:Path=Path()) -> Path:
     """
     Generates a new image file with limited size to be used
@@ -2,13 +2,15 @@ from yamlns import namespace as ns
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin, urlunsplit
 from decorator import decorator
+from .. import tracing
 
 @decorator
 def cached(f, self):
     """After the property decorator, makes the property cached"""
     propname = f.__name__
     if propname not in self._cache:
-        self._cache[propname] = f(self)
+        with tracing.span('PageInfo.' + propname, 'pageinfo'):
+            self._cache[propname] = f(self)
     return self._cache.get(propname)
 
 class PageInfo: